@@ -3,12 +3,24 @@ import os
 import logging
 import requests
 import json
+import hashlib
+import threading
+from time import sleep, time
+from random import random
 try:
     from urlparse import urljoin
 except ImportError:
     from urllib.parse import urljoin  # 3.*
-from .utils import retry
-from .errors import GoogleApiError
+from .utils import retry, atomic_write_json, RetryAttempts, RetryPolicy, \
+    retry_after_seconds
+from .errors import GoogleApiError, RetryLimitError
+from .batch import MAX_BATCH_SIZE, encode_batch, parse_batch_response
+from .multipart import MultipartRelatedStream
+from .credential import CredentialStore
+from .ratelimit import RateLimiter
+from .metrics import MetricsRegistry
+from .timing import RequestTiming, TimedHTTPAdapter, recording
+from .requestlog import RequestLogMessage, redact_headers
 
 
 class APIRequest(object):
@@ -16,35 +28,216 @@ class APIRequest(object):
 
     _API_URL = 'https://www.googleapis.com/'
     _TOKEN_URL = 'https://accounts.google.com/o/oauth2/token'
+    _CHUNK_GRANULARITY = 256 * 1024  # chunk sizes must be a multiple
+    # Google only compresses responses for a user agent containing "gzip"
+    _USER_AGENT = 'gdapi {0} (gzip)'.format(
+        requests.utils.default_user_agent())
 
     def __init__(self,
-                 credential_path):
+                 credential_path,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 keep_alive=True,
+                 refresh_margin=60,
+                 max_qps=None,
+                 retry_budget=None,
+                 retry_deadline=None,
+                 compress=True,
+                 metrics=None,
+                 collect_timings=False,
+                 timing_callback=None,
+                 log_body_limit=256,
+                 log_sample_rate=1.0,
+                 api_url=None,
+                 token_url=None,
+                 recorder=None):
         """
         :param credential_path:
             Authentication file to use.
         :type credential_path:
             `unicode`
+
+        :param pool_connections:
+            Number of host pools to cache in the session.
+        :type pool_connections:
+            `int`
+
+        :param pool_maxsize:
+            Maximum number of connections kept alive per host.
+        :type pool_maxsize:
+            `int`
+
+        :param keep_alive:
+            If False, ask the server to close the connection after
+            each request.
+        :type keep_alive:
+            `boolean`
+
+        :param refresh_margin:
+            Refresh the access token this many seconds before it expires.
+        :type refresh_margin:
+            `int`
+
+        :param max_qps:
+            (Optional) Limit the API calls per second of this client,
+            across threads. The rate is lowered while the server answers
+            with quota errors and raised back slowly afterwards.
+        :type max_qps:
+            `float`
+
+        :param retry_budget:
+            (Optional) Retries allowed across every call of this client,
+            including uploaded chunks and batch sub-requests. Off by
+            default: each call only has its own tries. Pass the same
+            budget to several clients to share it. Once it is spent,
+            calls raise :class:`gdapi.errors.RetryLimitError` instead of
+            retrying.
+        :type retry_budget:
+            `RetryBudget`
+
+        :param retry_deadline:
+            (Optional) Stop retrying a call after this many seconds, and
+            raise :class:`gdapi.errors.RetryLimitError`. Off by default.
+        :type retry_deadline:
+            `float`
+
+        :param compress:
+            Ask for gzip compressed responses. Media downloads are always
+            requested uncompressed.
+        :type compress:
+            `boolean`
+
+        :param metrics:
+            (Optional) Where to record request metrics, a new
+            :class:`gdapi.metrics.MetricsRegistry` by default. Pass the
+            same registry to several clients to add up their metrics.
+        :type metrics:
+            `MetricsRegistry`
+
+        :param collect_timings:
+            Measure the phases of every request: DNS, connect, TLS, send,
+            time to first byte and transfer. See :attr:`last_timing`.
+        :type collect_timings:
+            `boolean`
+
+        :param timing_callback:
+            (Optional) Called with the :class:`gdapi.timing.RequestTiming`
+            of every request, once its body has been read. Implies
+            collect_timings.
+        :type timing_callback:
+            `callable`
+
+        :param log_body_limit:
+            Characters of a request body kept in the INFO log line of a
+            request, None for all of them. Credentials are never logged.
+        :type log_body_limit:
+            `int`
+
+        :param log_sample_rate:
+            Fraction of the successful requests to log. Failed requests
+            are always logged.
+        :type log_sample_rate:
+            `float`
+
+        :param api_url:
+            (Optional) Base URL of the API instead of Google's, e.g. the
+            one of a :class:`gdapi.emulator.DriveEmulator`.
+        :type api_url:
+            `unicode`
+
+        :param token_url:
+            (Optional) URL of the OAuth token endpoint instead of
+            Google's.
+        :type token_url:
+            `unicode`
+
+        :param recorder:
+            (Optional) Where to record every HTTP request, for
+            :func:`gdapi.recorder.replay`.
+        :type recorder:
+            :class:`gdapi.recorder.TrafficRecorder`
         """
         self._logger = logging.getLogger(u"gdapi.%s" % self.__class__.__name__)
+        if api_url is not None:
+            self._API_URL = api_url
+        if token_url is not None:
+            self._TOKEN_URL = token_url
         self._credential = {'access_token': 'N/A'}
         self._credential_path = credential_path
+        self._credential_store = CredentialStore(credential_path)
         self._error = {'code': 0, 'reason': ''}
         self._read_credential_file()
+        self._set_default_headers()
+        self._timing_callback = timing_callback
+        self._collect_timings = bool(collect_timings or timing_callback)
+        self._timings = threading.local()
+        self._session = self._create_session(
+            pool_connections, pool_maxsize, keep_alive, compress,
+            self._collect_timings)
+        self._refresh_margin = refresh_margin
+        self._refresh_lock = threading.Lock()
+        self._rate_limiter = RateLimiter(max_qps) if max_qps else None
+        self._retry_budget = retry_budget
+        self._retry_deadline = retry_deadline
+        self._metrics = metrics if metrics is not None else MetricsRegistry()
+        self._log_body_limit = log_body_limit
+        self._log_sample_rate = log_sample_rate
+        self._recorder = recorder
+
+    def _create_session(self, pool_connections, pool_maxsize, keep_alive,
+                        compress=True, timed=False):
+        """Returns the long-lived session shared by every API call."""
+        session = requests.Session()
+        adapter_class = TimedHTTPAdapter if timed else \
+            requests.adapters.HTTPAdapter
+        adapter = adapter_class(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
+        session.headers['User-Agent'] = self._USER_AGENT
+        session.headers['Accept-Encoding'] = 'gzip' if compress else 'identity'
+        return session
+
+    def close(self):
+        """Close the pooled connections."""
+        self._session.close()
+
+    def _read_credential_file(self):
+        self._credential.update(self._credential_store.load())
+
+    def _save_credential_file(self):
+        with self._credential_store.lock():
+            self._credential_store.save(self._credential)
+
+    def _reload_credential_file(self):
+        """Pick up the credential saved by another process, e.g. after
+        it refreshed the token.
+
+        :returns:
+            If the access token changed.
+        :rtype:
+            `boolean`
+        """
+        if not self._credential_store.changed():
+            return False
+        token = self._credential.get('access_token')
+        with self._credential_store.lock():
+            self._read_credential_file()
+        if self._credential.get('access_token') == token:
+            return False
+        self._set_default_headers()
+        return True
+
+    def _set_default_headers(self):
         self._default_headers = {
             'content-type': 'application/json',
             'Authorization': 'Bearer {0}'.format(
                 self._credential['access_token']),
         }
 
-    def _read_credential_file(self):
-        if os.path.isfile(self._credential_path):
-            with open(self._credential_path, 'r') as fin:
-                self._credential.update(json.load(fin))
-
-    def _save_credential_file(self):
-        with open(self._credential_path, 'w') as f:
-            json.dump(self._credential, f, indent=2)
-
     def _is_failed_status_code(self, status_code):
         """Returns whether the status code indicates failure."""
         return (status_code < requests.codes.OK
@@ -68,36 +261,169 @@ class APIRequest(object):
                      stream=None):
         """The real request function call"""
         from timeit import default_timer as timer
+        if headers and 'Authorization' in headers:
+            renewed = self._reload_credential_file()
+            if self._is_token_expiring():
+                renewed = self._refresh_access_token(only_if_expiring=True)
+            if renewed:
+                headers['Authorization'] = \
+                    self._default_headers['Authorization']
+        limited = self._rate_limiter is not None and url != self._TOKEN_URL
+        if limited:
+            self._rate_limiter.acquire()
+        timing = RequestTiming(method, url) if self._collect_timings \
+            else None
+        started = time()
         start = timer()
-        if session is not None:
-            resp = session.request(
-                method,
-                url,
-                params=params,
-                data=data,
-                headers=headers,
-                files=files,
-                verify=verify,
-                stream=stream,
-            )
-        else:
-            resp = requests.request(
-                method,
-                url,
-                params=params,
-                data=data,
-                headers=headers,
-                files=files,
-                verify=verify,
-                stream=stream,
-            )
-        self._logger.info(u'%s %r %s %d headers %s params %s data %s', method,
-                          timer() - start, url,
-                          resp.status_code, headers, params, data)
+        if session is None:
+            session = self._session
+        try:
+            with recording(timing):
+                resp = session.request(
+                    method,
+                    url,
+                    params=params,
+                    data=data,
+                    headers=headers,
+                    files=files,
+                    verify=verify,
+                    stream=stream,
+                )
+        except requests.RequestException:
+            elapsed = timer() - start
+            self._metrics.observe_request(method, url, 'error', elapsed)
+            if timing is not None:
+                timing.total = elapsed
+                self._finish_timing(timing)
+            if self._recorder is not None:
+                self._recorder.record(started, method, url, 'error', elapsed,
+                                      params=params, timing=timing)
+            raise
+        elapsed = timer() - start
+        if timing is not None:
+            self._time_response(resp, timing, start, elapsed, stream)
+        received = self._received_bytes(
+            resp.headers, None if stream else resp.content)
+        sent = int(resp.request.headers.get('Content-Length') or 0)
+        self._metrics.observe_request(method, url, resp.status_code, elapsed,
+                                      sent, received)
+        if self._recorder is not None:
+            self._recorder.record(started, method, resp.request.url,
+                                  resp.status_code, elapsed, sent,
+                                  received, timing=timing)
+        self._log_request(method, url, resp.status_code, elapsed,
+                          headers, params, data)
         self._error['code'] = resp.status_code
         self._error['reason'] = resp.reason
+        if limited:
+            jobj = None
+            if resp.status_code == 403:
+                try:
+                    jobj = resp.json()
+                except ValueError:
+                    pass
+            self._adapt_rate(resp.status_code, jobj)
         return resp
 
+    def _received_bytes(self, headers, body):
+        """Returns the size of a response body once decoded, as the
+        caller reads it whatever the compression. An unread body counts
+        its Content-Length unless it is compressed, else 0."""
+        if body is not None:
+            return len(body)
+        if headers.get('Content-Encoding', 'identity') != 'identity':
+            return 0
+        return int(headers.get('Content-Length') or 0)
+
+    def _log_request(self, method, url, status_code, elapsed, headers=None,
+                     params=None, data=None):
+        """Log a request at INFO. Nothing is formatted unless the line is
+        emitted, as bodies can be whole files."""
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+        if self._log_sample_rate < 1 and \
+                not self._is_failed_status_code(status_code) and \
+                random() >= self._log_sample_rate:
+            return
+        message = RequestLogMessage(method, url, status_code, elapsed,
+                                    headers, params, data,
+                                    self._log_body_limit)
+        self._logger.info(u'%s', message,
+                          extra={'gdapi_request': message.fields})
+
+    def _time_response(self, resp, timing, start, elapsed, stream):
+        """Complete timing with the body transfer and attach it to resp.
+        A streamed body is timed while it is read through iter_content,
+        until it is read or closed."""
+        from timeit import default_timer as timer
+        timing.status = resp.status_code
+        resp.timing = timing
+        if not stream:
+            timing.total = elapsed
+            timing.transfer = max(0.0, elapsed - timing.dns - timing.connect -
+                                  timing.tls - timing.send - timing.ttfb)
+            timing.bytes = len(resp.content)
+            self._finish_timing(timing)
+            return
+        self._timings.last = timing
+        iter_content = resp.iter_content
+        close = resp.close
+        state = {'begun': None, 'received': 0, 'done': False}
+
+        def finish():
+            if state['done']:
+                return
+            state['done'] = True
+            now = timer()
+            if state['begun'] is not None:
+                timing.transfer = now - state['begun']
+            timing.total = now - start
+            timing.bytes = state['received']
+            self._finish_timing(timing)
+
+        def timed_iter_content(*args, **kwargs):
+            if state['begun'] is None:
+                state['begun'] = timer()
+            try:
+                for chunk in iter_content(*args, **kwargs):
+                    state['received'] += len(chunk)
+                    yield chunk
+            finally:
+                finish()
+
+        def timed_close():
+            try:
+                close()
+            finally:  # the body may be dropped unread
+                finish()
+        resp.iter_content = timed_iter_content
+        resp.close = timed_close
+
+    def _finish_timing(self, timing):
+        self._timings.last = timing
+        if self._timing_callback is not None:
+            try:
+                self._timing_callback(timing)
+            except Exception:
+                self._logger.exception(u'Timing callback failed')
+
+    def _adapt_rate(self, status_code, jobj=None):
+        """Tell the rate limiter whether the server throttled the call.
+
+        :param jobj:
+            The decoded body, needed for 403 responses only.
+        :type jobj:
+            `dict`
+        """
+        if status_code == 403:
+            if isinstance(jobj, dict) and \
+                    self._is_rate_limit_error(jobj.get('error', {})):
+                self._rate_limiter.throttled()
+        elif status_code == 429:
+            self._rate_limiter.throttled()
+        elif not self._is_failed_status_code(status_code):
+            self._rate_limiter.succeeded()
+
     @retry(requests.ConnectionError, 10, delay=1)
     def _oauth_api_request(self,
                            method,
@@ -145,7 +471,47 @@ class APIRequest(object):
         )
         return resp.status_code, resp.json()
 
-    def _refresh_access_token(self):
+    def _is_token_expiring(self):
+        """Returns whether the access token expires within the refresh
+        margin. Unknown expiry is left to the 401 handling."""
+        expires_at = self._credential.get('expires_at')
+        if expires_at is None or 'refresh_token' not in self._credential:
+            return False
+        return time() >= expires_at - self._refresh_margin
+
+    def _update_access_token(self, jobj):
+        """Store a token response of the OAuth endpoint."""
+        if 'expires_in' in jobj:
+            jobj = dict(jobj, expires_at=time() + int(jobj['expires_in']))
+        self._credential.update(jobj)
+        self._save_credential_file()
+        self._set_default_headers()
+
+    def _refresh_access_token(self, only_if_expiring=False):
+        """Get a new access token. Only one refresh runs at a time; the
+        callers waiting for it reuse its token instead of refreshing
+        again.
+
+        :param only_if_expiring:
+            Skip the refresh unless the token is about to expire.
+        :type only_if_expiring:
+            `boolean`
+
+        :returns:
+            If a valid token is available.
+        :rtype:
+            `boolean`
+        """
+        token = self._credential.get('access_token')
+        with self._refresh_lock, self._credential_store.lock():
+            self._reload_credential_file()
+            if self._credential.get('access_token') != token:
+                return True  # refreshed while we were waiting
+            if only_if_expiring and not self._is_token_expiring():
+                return True
+            return self._request_access_token()
+
+    def _request_access_token(self):
         status_code, jobj = self._oauth_api_request(
             'POST',
             data={
@@ -156,6 +522,7 @@ class APIRequest(object):
             },
         )
         if self._is_failed_status_code(status_code):
+            self._metrics.incr('token_refreshes', result='failed')
             return False
         if jobj.get('access_token') is None:
             self._error['code'] = -1
@@ -163,69 +530,88 @@ class APIRequest(object):
                                      'receiving access_token: '
                                      '{0}'.format(jobj))
             self._logger.error(self._error['reason'])
+            self._metrics.incr('token_refreshes', result='failed')
             return False
-        self._credential.update(jobj)
-        self._save_credential_file()
-        self._default_headers = {
-            'content-type': 'application/json',
-            'Authorization': 'Bearer {0}'.format(
-                self._credential['access_token']),
-        }
+        self._update_access_token(jobj)
+        self._metrics.incr('token_refreshes', result='ok')
         return True
 
-    @retry(requests.ConnectionError, 5, delay=1)
     def multipart_file_upload(self,
                               local_path,
                               body,
-                              verify=True):
-        with open(local_path, "rb") as f:
-            file_content = f.read()
-        import base64
-        headers = self._default_headers
-        boundary = 'xiIdabcdyl172dfasyd937845asdf'
-        headers['content-type'] = ('multipart/related; '
-                                   'boundary="{0}"'.format(boundary))
-        parts = []
-        parts.append('--' + boundary)
-        parts.append('Content-Type: application/json')
-        parts.append('')
-        parts.append(json.dumps(body))
-        parts.append('--' + boundary)
-        parts.append('Content-Type: application/octet-stream')
-        parts.append('Content-Transfer-Encoding: base64')
-        parts.append('')
-        parts.append(base64.b64encode(file_content))
-        parts.append('--' + boundary + '--')
-        parts.append('')
-        body = '\r\n'.join(parts)
+                              verify=True,
+                              fields=None):
+        """Create a file with its metadata and content in one request.
+
+        The content is streamed from the file, so memory use does not
+        depend on the file size. A file object is sent from its current
+        position, every attempt.
 
+        :param local_path:
+            file object or file path.
+        :type local_path:
+            `file object` or `unicode`.
+
+        :param body:
+            Request body.
+        :type body:
+            `dict`.
+
+        :param fields:
+            (Optional) Fields of the created file to return.
+        :type fields:
+            `unicode`
+
+        :returns:
+            Response from the API call.
+        :rtype:
+            `dict`
+        """
+        if hasattr(local_path, 'read'):
+            return self._multipart_file_upload(
+                local_path, local_path.tell(), body, verify, fields)
+        with open(local_path, 'rb') as f:
+            return self._multipart_file_upload(f, 0, body, verify, fields)
+
+    def _upload_params(self, upload_type, fields=None):
+        params = {'uploadType': upload_type}
+        if fields:
+            params['fields'] = fields
+        return params
+
+    @retry(requests.ConnectionError, 5, delay=1)
+    def _multipart_file_upload(self, f, start, body, verify, fields=None):
+        # a failed attempt may have read any part of the content
+        f.seek(start)
+        stream = MultipartRelatedStream(body, f)
+        headers = dict(self._default_headers)
+        headers['content-type'] = stream.content_type
         resp = self._api_request(
             'POST',
             urljoin(self._API_URL, '/upload/drive/v2/files'),
-            params={'uploadType': 'multipart'},
+            params=self._upload_params('multipart', fields),
             headers=headers,
-            data=body,
+            data=stream,
             verify=verify,)
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 self._logger.debug('Need to refresh token')
                 if self._refresh_access_token():  # retry on success
                     raise requests.ConnectionError
             else:  # need to log 'request exception' to file
                    # and notify user via UI
+                error = {}
                 try:
                     error = resp.json().get('error', {})
-                except:
+                except ValueError:
                     pass
-                if error.get('code') == 403 and \
-                   error.get('errors')[0].get('reason') \
-                   in ['rateLimitExceeded', 'userRateLimitExceeded']:
+                if self._is_rate_limit_error(error):
                     self._logger.debug('Rate limit, retry')
                     self._logger.debug(error)
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 raise GoogleApiError(
                     code=resp.status_code,
                     message=error.get('message', resp.content))
@@ -262,13 +648,13 @@ class APIRequest(object):
         import xml.etree.ElementTree as ET
         self._logger.debug(u"file {0} with body {1}"
                            "".format(fp, body))
-        req = requests.Session()
-        req.headers.update(self._default_headers)
-        headers = {
+        req = self._session
+        headers = dict(self._default_headers)
+        headers.update({
             "GData-Version": 3,
             "Content-Length": 0,
             "X-Upload-Content-Type": "application/octet-stream",
-        }
+        })
         resp = self._api_request(
             'POST',
             'https://docs.google.com/feeds/upload'
@@ -280,7 +666,7 @@ class APIRequest(object):
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 self._logger.debug('Need to refresh token')
                 if self._refresh_access_token():  # retry on success
@@ -293,7 +679,7 @@ class APIRequest(object):
                    in ['rateLimitExceeded', 'userRateLimitExceeded']:
                     self._logger.debug('Rate limit, retry')
                     self._logger.debug(error)
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 raise GoogleApiError(
                     code=resp.status_code,
                     message=error.get('message', resp.content))
@@ -321,7 +707,7 @@ class APIRequest(object):
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 # if 401, we still raise to retry
                 self._logger.debug('Need to refresh token')
@@ -341,7 +727,7 @@ class APIRequest(object):
                    in ['rateLimitExceeded', 'userRateLimitExceeded']:
                     self._logger.debug('Rate limit, retry')
                     self._logger.debug(error)
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 raise GoogleApiError(
                     code=resp.status_code,
                     message=error.get('message', resp.content))
@@ -360,10 +746,12 @@ class APIRequest(object):
             retries = retries - 1
             self._logger.debug(u"Update file {0} with {1}".format(
                 file_id, json.dumps(body)))
-            req.headers.update(self._default_headers)
-            resp = req.put(
+            headers.update(self._default_headers)
+            resp = self._api_request(
+                'PUT',
                 urljoin(self._API_URL, '/drive/v2/files/{0}'.format(
                     file_id)),
+                session=req,
                 headers=headers,
                 data=json.dumps(body),
                 verify=False,)
@@ -383,8 +771,9 @@ class APIRequest(object):
                     in ['rateLimitExceeded', 'userRateLimitExceeded']:
                         self._logger.debug('Rate limit, retry')
                         continue
-                    raise GoogleApiError(code=resp.status_code,
-                                        message=error.get('message', resp.content))
+                    raise GoogleApiError(
+                        code=resp.status_code,
+                        message=error.get('message', resp.content))
                 self._error['code'] = resp.status_code
                 self._error['reason'] = resp.reason
                 return None
@@ -392,11 +781,186 @@ class APIRequest(object):
         self._logger.debug(drive_file)
         return drive_file
 
+    def _check_chunk_size(self, chunk_size):
+        if chunk_size is not None and (
+                chunk_size <= 0 or chunk_size % self._CHUNK_GRANULARITY):
+            raise ValueError("chunk_size must be a positive multiple "
+                             "of {0}".format(self._CHUNK_GRANULARITY))
+
+    def _upload_state_key(self, fp, file_id):
+        """Identify the upload, so a saved state is only resumed for the
+        same unchanged content. File objects have no mtime, their first
+        chunk is hashed instead."""
+        if hasattr(fp, 'read'):
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            fp.seek(0)
+            head = hashlib.md5(fp.read(self._CHUNK_GRANULARITY))
+            return {'path': getattr(fp, 'name', None),
+                    'size': size,
+                    'head_md5': head.hexdigest(),
+                    'file_id': file_id}
+        stat = os.stat(fp)
+        return {'path': os.path.abspath(fp),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'file_id': file_id}
+
+    def _load_upload_state(self, state_path, key):
+        """Returns the saved upload state if it matches key, or None."""
+        if state_path is None or not os.path.isfile(state_path):
+            return None
+        try:
+            with open(state_path, 'r') as fin:
+                state = json.load(fin)
+        except ValueError:
+            return None
+        if state.get('key') != key or not state.get('session_url'):
+            self._logger.debug(u'Ignore stale upload state %s', state_path)
+            return None
+        return state
+
+    def _save_upload_state(self, state_path, key, session_url, offset):
+        if state_path is not None:
+            atomic_write_json(state_path, {
+                'key': key,
+                'session_url': session_url,
+                'offset': offset,
+            })
+
+    def _remove_upload_state(self, state_path):
+        if state_path is not None and os.path.isfile(state_path):
+            os.unlink(state_path)
+
+    def _next_offset(self, resp):
+        """Returns the first byte the server has not received yet, from
+        the Range header of a 308 response."""
+        received = resp.headers.get('range')
+        if not received:
+            return 0
+        return int(received.rsplit('-', 1)[-1]) + 1
+
+    def _query_upload_status(self, resumable_url, size, verify=False):
+        """Ask the server how much of the upload it already has.
+
+        :returns:
+            A tuple of the next offset to send and the drive file if the
+            upload is already complete.
+        :rtype:
+            `tuple`
+        """
+        resp = self._api_request(
+            'PUT',
+            resumable_url,
+            headers={'Content-Range': 'bytes */{0}'.format(size)},
+            verify=verify)
+        if resp.status_code == 308:
+            return self._next_offset(resp), None
+        if resp.status_code in (200, 201):
+            return size, resp.json()
+        if resp.status_code in (404, 410):  # session expired
+            return None, None
+        # raise to retry
+        raise requests.ConnectionError
+
+    def _upload_chunks(self, resumable_url, f, chunk_size, key,
+                       state_path=None, resumed=False, verify=False,
+                       tries=5, delay=1):
+        """Send the content of f to the session uri chunk by chunk.
+
+        The offset is saved to state_path after every chunk. A failed
+        chunk is resent from what the server reports it has.
+
+        :returns:
+            Response from the API call.
+        :rtype:
+            `dict`
+        """
+        size = key['size']
+        offset = 0
+        if resumed:
+            offset, drive_file = self._query_upload_status(
+                resumable_url, size, verify=verify)
+            if drive_file is not None:
+                self._remove_upload_state(state_path)
+                return drive_file
+            if offset is None:  # session expired, start over
+                self._remove_upload_state(state_path)
+                raise requests.ConnectionError
+            self._logger.debug(u'Resume upload at %d/%d', offset, size)
+        policy = RetryPolicy(tries, delay)
+        attempts = RetryAttempts(policy, self, '_upload_chunks',
+                                 self._logger)
+        while True:
+            f.seek(offset)
+            data = f.read(chunk_size)
+            if data:
+                content_range = 'bytes {0}-{1}/{2}'.format(
+                    offset, offset + len(data) - 1, size)
+            else:  # empty file
+                content_range = 'bytes */{0}'.format(size)
+            try:
+                resp = self._api_request(
+                    'PUT',
+                    resumable_url,
+                    headers={'Content-Range': content_range},
+                    data=data,
+                    verify=verify)
+            except requests.ConnectionError as error:
+                self._logger.debug(u'Chunk %s failed: %r',
+                                   content_range, error)
+                resp, failure = None, error
+            else:
+                failure = requests.ConnectionError(response=resp)
+            if resp is not None:
+                if resp.status_code == 308:  # resume incomplete
+                    offset = self._next_offset(resp)
+                    self._save_upload_state(state_path, key,
+                                            resumable_url, offset)
+                    attempts = RetryAttempts(policy, self, '_upload_chunks',
+                                             self._logger)
+                    continue
+                if not self._is_failed_status_code(resp.status_code):
+                    self._remove_upload_state(state_path)
+                    return resp.json()
+                if resp.status_code in (404, 410):  # session expired
+                    self._remove_upload_state(state_path)
+                    raise requests.ConnectionError
+                if not (self._is_server_side_error_status_code(
+                        resp.status_code) or resp.status_code == 429):
+                    raise GoogleApiError(
+                        code=resp.status_code, message=resp.content)
+            wait = attempts.failed(failure)
+            if wait is None:
+                # raise to retry, the saved state resumes the session
+                raise requests.ConnectionError
+            sleep(wait)
+            offset, drive_file = self._query_upload_status(
+                resumable_url, size, verify=verify)
+            if drive_file is not None:
+                self._remove_upload_state(state_path)
+                return drive_file
+            if offset is None:
+                self._remove_upload_state(state_path)
+                raise requests.ConnectionError
+
+    def _upload_chunked(self, resumable_url, fp, chunk_size, key,
+                        state_path=None, resumed=False):
+        if hasattr(fp, 'read'):
+            return self._upload_chunks(resumable_url, fp, chunk_size, key,
+                                       state_path, resumed)
+        with open(fp, 'rb') as f:
+            return self._upload_chunks(resumable_url, f, chunk_size, key,
+                                       state_path, resumed)
+
     @retry(requests.ConnectionError, 5, delay=1)
     def resumable_file_upload(self,
                               fp,
                               body,
-                              verify=True):
+                              verify=True,
+                              chunk_size=None,
+                              state_path=None,
+                              fields=None):
         """Create a file.
 
         :param fp:
@@ -414,6 +978,23 @@ class APIRequest(object):
         :type body:
             `dict`.
 
+        :param chunk_size:
+            (Optional) Upload in chunks of this many bytes, a multiple of
+            256 KiB. The whole content is sent at once if not given.
+        :type chunk_size:
+            `int`
+
+        :param state_path:
+            (Optional) With chunk_size, file to save the upload session
+            to, so an interrupted upload resumes where it stopped.
+        :type state_path:
+            `unicode`
+
+        :param fields:
+            (Optional) Fields of the created file to return.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -421,12 +1002,20 @@ class APIRequest(object):
         """
         self._logger.debug(u"file {0} with body {1}"
                            "".format(fp, body))
-        req = requests.Session()
+        self._check_chunk_size(chunk_size)
+        if chunk_size is not None:
+            key = self._upload_state_key(fp, None)
+            state = self._load_upload_state(state_path, key)
+            if state is not None:
+                return self._upload_chunked(state['session_url'], fp,
+                                            chunk_size, key, state_path,
+                                            resumed=True)
+        req = self._session
         resp = self._api_request(
             'POST',
             urljoin(self._API_URL, '/upload/drive/v2/files'),
             session=req,
-            params={'uploadType': 'resumable'},
+            params=self._upload_params('resumable', fields),
             headers=self._default_headers,
             data=json.dumps(body),
             verify=verify,)
@@ -434,7 +1023,7 @@ class APIRequest(object):
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 self._logger.debug('Need to refresh token')
                 if self._refresh_access_token():  # retry on success
@@ -447,7 +1036,7 @@ class APIRequest(object):
                    in ['rateLimitExceeded', 'userRateLimitExceeded']:
                     self._logger.debug('Rate limit, retry')
                     self._logger.debug(error)
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 raise GoogleApiError(
                     code=resp.status_code,
                     message=error.get('message', resp.content))
@@ -457,6 +1046,10 @@ class APIRequest(object):
             self._error['reason'] = 'No resumable url {0}'.format(
                 resp.headers)
             return None
+        if chunk_size is not None:
+            self._save_upload_state(state_path, key, resumable_url, 0)
+            return self._upload_chunked(resumable_url, fp, chunk_size, key,
+                                        state_path)
         if hasattr(fp, 'read'):
             resp = self._api_request(
                 'POST',
@@ -475,7 +1068,7 @@ class APIRequest(object):
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 # if 401, we still raise to retry
                 self._logger.debug('Need to refresh token')
@@ -495,7 +1088,7 @@ class APIRequest(object):
                    in ['rateLimitExceeded', 'userRateLimitExceeded']:
                     self._logger.debug('Rate limit, retry')
                     self._logger.debug(error)
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 raise GoogleApiError(
                     code=resp.status_code,
                     message=error.get('message', resp.content))
@@ -535,10 +1128,11 @@ class APIRequest(object):
         :rtype:
             `dict`
         """
-        self._logger.debug(u"file {0} with headers {1} body {2}"
-                           "".format(local_path, headers, body))
-        req = requests.Session()
-        req.headers.update(self._default_headers)
+        self._logger.debug(u'file %s with headers %s body %s',
+                           local_path, redact_headers(headers), body)
+        req = self._session
+        request_headers = dict(self._default_headers)
+        request_headers.update(headers)
         if file_id is None:
             method = 'POST'
             url = urljoin(self._API_URL, '/upload/drive/v2/files')
@@ -547,23 +1141,22 @@ class APIRequest(object):
             url = urljoin(self._API_URL,
                           '/upload/drive/v2/files/{0}'.format(file_id))
         with open(local_path, 'rb') as f:
-            resp = req.request(
+            resp = self._api_request(
                 method,
                 url,
+                session=req,
                 params={'uploadType': 'media'},
-                headers=headers,
+                headers=request_headers,
                 data=f,
                 verify=False,)
-            self._logger.debug("{0} {1} {2}".format(
-                resp.status_code, resp.headers, resp.content))
-            self._logger.debug("Request header: {0}".format(
-                resp.request.headers))
+            self._logger.debug(u'%s %s', resp.status_code,
+                               redact_headers(resp.headers))
 
         self._logger.debug(resp.status_code)
         if self._is_failed_status_code(resp.status_code):
             if self._is_server_side_error_status_code(resp.status_code):
                 # raise to retry
-                raise requests.ConnectionError
+                raise requests.ConnectionError(response=resp)
             elif resp.status_code == 401:  # need to refresh token
                 self._logger.debug('Need to refresh token')
                 if self._refresh_access_token():  # retry on success
@@ -575,9 +1168,10 @@ class APIRequest(object):
                    error.get('errors')[0].get('reason') \
                    in ['rateLimitExceeded', 'userRateLimitExceeded']:
                     self._logger.debug('Rate limit, retry')
-                    raise requests.ConnectionError
-                raise GoogleApiError(code=resp.status_code,
-                                     message=error.get('message', resp.content))
+                    raise requests.ConnectionError(response=resp)
+                raise GoogleApiError(
+                    code=resp.status_code,
+                    message=error.get('message', resp.content))
             self._error['code'] = resp.status_code
             self._error['reason'] = resp.reason
             return None
@@ -588,11 +1182,13 @@ class APIRequest(object):
             retries = retries - 1
             self._logger.debug(u"Update file {0} with {1}".format(
                 drive_file['id'], json.dumps(body)))
-            req.headers.update(self._default_headers)
-            resp = req.put(
+            request_headers.update(self._default_headers)
+            resp = self._api_request(
+                'PUT',
                 urljoin(self._API_URL, '/drive/v2/files/{0}'.format(
                     drive_file['id'])),
-                headers=headers,
+                session=req,
+                headers=request_headers,
                 data=json.dumps(body),
                 verify=False,)
             if self._is_failed_status_code(resp.status_code):
@@ -611,8 +1207,9 @@ class APIRequest(object):
                     in ['rateLimitExceeded', 'userRateLimitExceeded']:
                         self._logger.debug('Rate limit, retry')
                         continue
-                    raise GoogleApiError(code=resp.status_code,
-                                        message=error.get('message', resp.content))
+                    raise GoogleApiError(
+                        code=resp.status_code,
+                        message=error.get('message', resp.content))
                 self._error['code'] = resp.status_code
                 self._error['reason'] = resp.reason
                 return None
@@ -627,7 +1224,10 @@ class APIRequest(object):
                               headers={},
                               body=None,
                               etag=None,
-                              verify=True):
+                              verify=True,
+                              chunk_size=None,
+                              state_path=None,
+                              fields=None):
         """Create a file.
 
         :param file_id:
@@ -655,14 +1255,39 @@ class APIRequest(object):
         :type etag:
             `unicode`
 
+        :param chunk_size:
+            (Optional) Upload in chunks of this many bytes, a multiple of
+            256 KiB. The whole content is sent at once if not given.
+        :type chunk_size:
+            `int`
+
+        :param state_path:
+            (Optional) With chunk_size, file to save the upload session
+            to, so an interrupted upload resumes where it stopped.
+        :type state_path:
+            `unicode`
+
+        :param fields:
+            (Optional) Fields of the updated file to return.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
             `dict`
         :raises: GoogleApiError.
         """
+        self._check_chunk_size(chunk_size)
+        if chunk_size is not None:
+            key = self._upload_state_key(fp, file_id)
+            state = self._load_upload_state(state_path, key)
+            if state is not None:
+                return self._upload_chunked(state['session_url'], fp,
+                                            chunk_size, key, state_path,
+                                            resumed=True)
         # we should update file meta first, then the content
-        req = requests.Session()
+        req = self._session
 
         while True:  # always update latest etag/description
             self._logger.debug(u"Update file with fileId: {0}"
@@ -670,7 +1295,7 @@ class APIRequest(object):
             if headers:
                 headers.update(self._default_headers)
             else:
-                headers = self._default_headers
+                headers = dict(self._default_headers)
             if etag:
                 headers.update({'If-Match': etag})
             if body is not None:
@@ -682,7 +1307,7 @@ class APIRequest(object):
                 urljoin(self._API_URL, '/upload/drive/v2/files/{0}'.format(
                     file_id)),
                 session=req,
-                params={'uploadType': 'resumable'},
+                params=self._upload_params('resumable', fields),
                 headers=headers,
                 data=data,
                 verify=verify)
@@ -691,7 +1316,7 @@ class APIRequest(object):
             if self._is_failed_status_code(resp.status_code):
                 if self._is_server_side_error_status_code(resp.status_code):
                     # raise to retry
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 elif resp.status_code == 401:  # need to refresh token
                     self._logger.debug('Need to refresh token')
                     if self._refresh_access_token():  # retry on success
@@ -716,6 +1341,10 @@ class APIRequest(object):
                         resp.headers)
                     return None
                 break
+        if chunk_size is not None:
+            self._save_upload_state(state_path, key, resumable_url, 0)
+            return self._upload_chunked(resumable_url, fp, chunk_size, key,
+                                        state_path)
         # update content
         while True:
             if hasattr(fp, 'read'):
@@ -736,7 +1365,7 @@ class APIRequest(object):
             if self._is_failed_status_code(resp.status_code):
                 if self._is_server_side_error_status_code(resp.status_code):
                     # raise to retry
-                    raise requests.ConnectionError
+                    raise requests.ConnectionError(response=resp)
                 elif resp.status_code == 401:  # need to refresh token
                     self._logger.debug('Need to refresh token')
                     if self._refresh_access_token():  # retry on success
@@ -772,7 +1401,23 @@ class APIRequest(object):
                     files=None,
                     verify=False,
                     stream=False):
-        """Make an API call.
+        """Make an API call, retried on transient errors. See
+        :meth:`_api_call` for the parameters."""
+        return self._api_call(method, resource, params=params, data=data,
+                              headers=headers, files=files, verify=verify,
+                              stream=stream)
+
+    def _api_call(self,
+                  method,
+                  resource,
+                  params=None,
+                  data=None,
+                  headers=None,
+                  files=None,
+                  verify=False,
+                  stream=False):
+        """Make one attempt of an API call. Raise ConnectionError when the
+        call should be retried.
 
         :param method:
             Method to use for the call.
@@ -824,7 +1469,7 @@ class APIRequest(object):
         if headers:
             headers.update(self._default_headers)
         else:
-            headers = self._default_headers
+            headers = dict(self._default_headers)
         resp = self._api_request(
             method,
             url,
@@ -835,10 +1480,11 @@ class APIRequest(object):
             verify=verify,
             stream=stream,
         )
-        if self._is_server_side_error_status_code(resp.status_code):
+        if self._is_server_side_error_status_code(resp.status_code) or \
+                resp.status_code == 429:
             self._logger.debug(resp)
             # raise to retry
-            raise requests.ConnectionError
+            raise requests.ConnectionError(response=resp)
         if resp.status_code == 401:  # raise to retry
             self._logger.debug(u'Need to refresh token')
             if self._refresh_access_token():  # retry on success
@@ -853,10 +1499,169 @@ class APIRequest(object):
         except ValueError:
             return resp.status_code, resp.content
 
+    def _is_rate_limit_error(self, error):
+        """Returns whether the API error body is a quota error."""
+        return (error.get('code') == 403 and
+                error.get('errors', [{}])[0].get('reason')
+                in ['rateLimitExceeded', 'userRateLimitExceeded'])
+
+    @staticmethod
+    def _batch_failure(parsed, sub_headers, failed_at):
+        """Returns an error standing for the failed sub-responses at the
+        given indexes, the one asking to wait the longest.
+
+        :rtype:
+            `requests.ConnectionError`
+        """
+        failure, longest = None, None
+        for n in failed_at:
+            resp = requests.Response()
+            resp.status_code = parsed.get(n, (None, None))[0]
+            resp.headers.update(sub_headers.get(n, {}))
+            error = requests.ConnectionError(response=resp)
+            seconds = retry_after_seconds(error) or 0
+            if failure is None or seconds > longest:
+                failure, longest = error, seconds
+        return failure
+
+    def _is_retryable_result(self, status_code, jobj):
+        """Returns whether a batch sub-request should be sent again."""
+        if status_code is None:  # missing from the batch response
+            return True
+        if (self._is_server_side_error_status_code(status_code)
+                or status_code in (401, 429)):
+            return True
+        if status_code == 403 and isinstance(jobj, dict):
+            return self._is_rate_limit_error(jobj.get('error', {}))
+        return False
+
+    @retry(requests.ConnectionError, 20, delay=1)
+    def _batch_call(self, calls, verify=False, sub_headers=None):
+        """Send one batch request.
+
+        sub_headers, if given, is filled with the headers of each
+        sub-response, see :func:`gdapi.batch.parse_batch_response`.
+
+        :returns:
+            Mapping from index in calls to ``(status_code, json)``.
+        :rtype:
+            `dict`
+        """
+        content_type, body = encode_batch(calls)
+        headers = dict(self._default_headers)
+        headers['content-type'] = content_type
+        resp = self._api_request(
+            'POST',
+            urljoin(self._API_URL, '/batch/drive/v2'),
+            headers=headers,
+            data=body,
+            verify=verify,
+        )
+        if self._is_server_side_error_status_code(resp.status_code) or \
+                resp.status_code == 429:
+            # raise to retry
+            raise requests.ConnectionError(response=resp)
+        if resp.status_code == 401:  # need to refresh token
+            self._logger.debug(u'Need to refresh token')
+            if self._refresh_access_token():  # retry on success
+                raise requests.ConnectionError
+        if self._is_failed_status_code(resp.status_code):
+            raise GoogleApiError(code=resp.status_code, message=resp.content)
+        return parse_batch_response(resp.headers.get('content-type', ''),
+                                    resp.content, sub_headers)
+
+    def batch_request(self, calls, tries=5, delay=1, verify=False):
+        """Make many API calls through the batch endpoint, up to
+        MAX_BATCH_SIZE per HTTP request. Only the sub-requests that failed
+        with a transient error are sent again.
+
+        :param calls:
+            Sequence of ``(method, resource, params, data)``, see
+            :meth:`api_request`.
+        :type calls:
+            `list`
+
+        :param tries:
+            How many times a sub-request is sent at most.
+        :type tries:
+            `int`
+
+        :param delay:
+            Initial delay in seconds before sending failed sub-requests
+            again, see :class:`gdapi.utils.RetryPolicy`. The longest
+            Retry-After of the failed sub-responses is honoured.
+        :type delay:
+            `int`
+
+        :returns:
+            A list of ``(status_code, json)``, in the order of calls,
+            ``(None, None)`` for those never answered.
+        :rtype:
+            `list`
+        """
+        calls = list(calls)
+        results = [None] * len(calls)
+        for start in range(0, len(calls), MAX_BATCH_SIZE):
+            pending = list(range(start,
+                                 min(start + MAX_BATCH_SIZE, len(calls))))
+            attempts = RetryAttempts(RetryPolicy(tries, delay), self,
+                                     'batch_request', self._logger)
+            while pending:
+                sub_headers = {}
+                parsed = self._batch_call([calls[i] for i in pending],
+                                          verify=verify,
+                                          sub_headers=sub_headers)
+                if parsed is False:  # out of tries
+                    self._logger.debug(u'Batch request of %d sub-requests '
+                                       u'failed', len(pending))
+                    for index in pending:
+                        if results[index] is None:  # never answered
+                            results[index] = (None, None)
+                    break
+                failed = []
+                need_refresh = False
+                failed_at = []
+                for n, index in enumerate(pending):
+                    status_code, jobj = parsed.get(n, (None, None))
+                    results[index] = (status_code, jobj)
+                    if self._is_retryable_result(status_code, jobj):
+                        failed.append(index)
+                        need_refresh = need_refresh or status_code == 401
+                        failed_at.append(n)
+                pending = failed
+                if not pending:
+                    break
+                try:
+                    wait = attempts.failed(self._batch_failure(
+                        parsed, sub_headers, failed_at))
+                except RetryLimitError as error:
+                    self._logger.debug(u'%s', error)
+                    break
+                if wait is None:
+                    break
+                self._logger.debug(u'Retry %d of %d batch sub-requests in '
+                                   u'%.2f seconds', len(pending),
+                                   len(parsed), wait)
+                if need_refresh and not self._refresh_access_token():
+                    break
+                sleep(wait)
+        return results
+
     @property
     def error(self):
         return self._error
 
+    @property
+    def metrics(self):
+        """The :class:`gdapi.metrics.MetricsRegistry` of this client."""
+        return self._metrics
+
+    @property
+    def last_timing(self):
+        """The :class:`gdapi.timing.RequestTiming` of the last request
+        made by the current thread, None unless timings are collected."""
+        return getattr(self._timings, 'last', None)
+
 
 if __name__ == '__main__':
     logger = logging.getLogger('gdapi.APIRequest')
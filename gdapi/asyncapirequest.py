@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+import json
+import asyncio
+import aiohttp
+from time import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from .apirequest import APIRequest
+from .asyncutils import async_retry
+from .errors import GoogleApiError
+
+
+class RetryableResponseError(aiohttp.ClientConnectionError):
+    """Raised to retry a call answered with a transient failure. The
+    response is attached for its ``Retry-After`` header."""
+
+    def __init__(self, response):
+        super(RetryableResponseError, self).__init__(
+            u'{0} {1}'.format(response.status, response.reason))
+        self.response = response
+
+
+class AsyncAPIRequest(APIRequest):
+    """Asyncio version of :class:`APIRequest`, built on aiohttp.
+
+    Credential handling and status code helpers are shared with the
+    synchronous client; every network call is a coroutine.
+    """
+
+    def _create_session(self, pool_connections, pool_maxsize, keep_alive,
+                        compress=True, timed=False):
+        """The aiohttp session must be created inside a running loop, so
+        only remember the pool options here. Phase timings are not
+        measured by this client."""
+        self._pool_options = {
+            'limit': pool_connections * pool_maxsize,
+            'limit_per_host': pool_maxsize,
+            'force_close': not keep_alive,
+        }
+        self._session_headers = {
+            'User-Agent': self._USER_AGENT,
+            'Accept-Encoding': 'gzip' if compress else 'identity',
+        }
+        return None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**self._pool_options),
+                headers=self._session_headers)
+        return self._session
+
+    async def close(self):
+        """Close the pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if getattr(self, '_credential_thread', None) is not None:
+            self._credential_thread.shutdown(wait=False)
+            self._credential_thread = None
+
+    async def _in_credential_thread(self, func, *args):
+        """Run func on the one thread that touches the credential file.
+        Its blocking file lock then does not stall the event loop, and
+        is taken and released by the same thread, which can still read
+        and save the file while holding it."""
+        if getattr(self, '_credential_thread', None) is None:
+            self._credential_thread = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='gdapi-credential')
+        return await asyncio.get_running_loop().run_in_executor(
+            self._credential_thread, partial(func, *args))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _api_request(self,
+                           method,
+                           url,
+                           session=None,
+                           headers=None,
+                           params=None,
+                           data=None,
+                           verify=None,
+                           stream=None):
+        """The real request function call.
+
+        The body is read before returning unless ``stream`` is set, in
+        which case the caller must read and release the response."""
+        from timeit import default_timer as timer
+        if headers and 'Authorization' in headers:
+            renewed = False
+            if self._credential_store.changed():
+                renewed = await self._in_credential_thread(
+                    self._reload_credential_file)
+            if self._is_token_expiring():
+                renewed = await self._refresh_access_token(
+                    only_if_expiring=True)
+            if renewed:
+                headers['Authorization'] = \
+                    self._default_headers['Authorization']
+        limited = self._rate_limiter is not None and url != self._TOKEN_URL
+        if limited:
+            wait = self._rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        started = time()
+        start = timer()
+        if session is None:
+            session = await self._get_session()
+        options = {}
+        if not verify:  # otherwise aiohttp's default, which verifies
+            options['ssl'] = False
+        try:
+            resp = await session.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                headers=headers,
+                **options
+            )
+            body = None if stream else await resp.read()
+        except aiohttp.ClientError:
+            elapsed = timer() - start
+            self._metrics.observe_request(method, url, 'error', elapsed)
+            if self._recorder is not None:
+                self._recorder.record(started, method, url, 'error', elapsed,
+                                      params=params)
+            raise
+        elapsed = timer() - start
+        received = self._received_bytes(resp.headers, body)
+        sent = int(resp.request_info.headers.get('Content-Length') or 0)
+        self._metrics.observe_request(method, url, resp.status, elapsed,
+                                      sent, received)
+        if self._recorder is not None:
+            self._recorder.record(started, method, str(resp.url),
+                                  resp.status, elapsed, sent, received)
+        self._log_request(method, url, resp.status, elapsed,
+                          headers, params, data)
+        self._error['code'] = resp.status
+        self._error['reason'] = resp.reason
+        if limited:
+            jobj = None
+            if resp.status == 403:
+                jobj = await self._json_or_content(resp)
+            self._adapt_rate(resp.status, jobj)
+        return resp
+
+    async def _json_or_content(self, resp):
+        content = await resp.read()
+        try:
+            return json.loads(content.decode('utf-8'))
+        except ValueError:
+            return content
+
+    def _raise_for_upload_status(self, resp, error):
+        """Raise to retry when the failure is transient, otherwise raise
+        GoogleApiError."""
+        if error.get('code') == 403 and \
+           error.get('errors', [{}])[0].get('reason') \
+           in ['rateLimitExceeded', 'userRateLimitExceeded']:
+            self._logger.debug('Rate limit, retry')
+            self._logger.debug(error)
+            raise RetryableResponseError(resp)
+        raise GoogleApiError(
+            code=resp.status,
+            message=error.get('message', resp.reason))
+
+    @async_retry(aiohttp.ClientConnectionError, 10, delay=1)
+    async def _oauth_api_request(self,
+                                 method,
+                                 params=None,
+                                 data=None,
+                                 verify=True):
+        """Make an OAUTH 2 API call. Used to refresh the access token.
+
+        :returns:
+            A tuple of the status code of the response and the response itself.
+        :rtype:
+            `tuple`
+        """
+        resp = await self._api_request(
+            method,
+            self._TOKEN_URL,
+            params=params,
+            data=data,
+            verify=verify,
+        )
+        return resp.status, await self._json_or_content(resp)
+
+    async def _refresh_access_token(self, only_if_expiring=False):
+        """Get a new access token, one refresh at a time across the
+        coroutines of this client, and across processes and clients
+        sharing the credential file."""
+        if getattr(self, '_async_refresh_lock', None) is None:
+            self._async_refresh_lock = asyncio.Lock()
+        token = self._credential.get('access_token')
+        async with self._async_refresh_lock:
+            file_lock = self._credential_store.lock()
+            await self._in_credential_thread(file_lock.__enter__)
+            try:
+                await self._in_credential_thread(
+                    self._reload_credential_file)
+                if self._credential.get('access_token') != token:
+                    return True  # refreshed while we were waiting
+                if only_if_expiring and not self._is_token_expiring():
+                    return True
+                return await self._request_access_token()
+            finally:
+                await self._in_credential_thread(
+                    file_lock.__exit__, None, None, None)
+
+    async def _request_access_token(self):
+        status_code, jobj = await self._oauth_api_request(
+            'POST',
+            data={
+                'client_id': self._credential['client_id'],
+                'client_secret': self._credential['client_secret'],
+                'grant_type': 'refresh_token',
+                'refresh_token': self._credential['refresh_token']
+            },
+        )
+        if self._is_failed_status_code(status_code):
+            self._metrics.incr('token_refreshes', result='failed')
+            return False
+        if not isinstance(jobj, dict) or jobj.get('access_token') is None:
+            self._error['code'] = -1
+            self._error['reason'] = ('Refresh token success, but not '
+                                     'receiving access_token: '
+                                     '{0}'.format(jobj))
+            self._logger.error(self._error['reason'])
+            self._metrics.incr('token_refreshes', result='failed')
+            return False
+        await self._in_credential_thread(self._update_access_token, jobj)
+        self._metrics.incr('token_refreshes', result='ok')
+        return True
+
+    async def _upload_content(self, method, resumable_url, fp):
+        if hasattr(fp, 'read'):
+            return await self._api_request(
+                method,
+                resumable_url,
+                data=fp,
+                verify=False)
+        with open(fp, 'rb') as f:
+            return await self._api_request(
+                method,
+                resumable_url,
+                data=f,
+                verify=False)
+
+    @async_retry(aiohttp.ClientConnectionError, 5, delay=1)
+    async def resumable_file_upload(self,
+                                    fp,
+                                    body,
+                                    verify=True):
+        """Create a file.
+
+        :param fp:
+            file object or file path.
+        :type fp:
+            `file object` or `unicode`.
+
+        :param body:
+            Request body.
+        :type body:
+            `dict`.
+
+        :returns:
+            Response from the API call.
+        :rtype:
+            `dict`
+        """
+        self._logger.debug(u"file {0} with body {1}"
+                           "".format(fp, body))
+        resp = await self._api_request(
+            'POST',
+            urljoin(self._API_URL, '/upload/drive/v2/files'),
+            params={'uploadType': 'resumable'},
+            headers=self._default_headers,
+            data=json.dumps(body),
+            verify=verify,)
+
+        if self._is_failed_status_code(resp.status):
+            if self._is_server_side_error_status_code(resp.status):
+                # raise to retry
+                raise RetryableResponseError(resp)
+            elif resp.status == 401:  # need to refresh token
+                self._logger.debug('Need to refresh token')
+                if await self._refresh_access_token():  # retry on success
+                    raise RetryableResponseError(resp)
+            else:
+                jobj = await self._json_or_content(resp)
+                error = jobj.get('error', {}) if isinstance(jobj, dict) \
+                    else {}
+                self._raise_for_upload_status(resp, error)
+            return None
+        resumable_url = resp.headers.get('location', None)
+        if resumable_url is None:
+            self._error['reason'] = 'No resumable url {0}'.format(
+                resp.headers)
+            return None
+        resp = await self._upload_content('POST', resumable_url, fp)
+        if self._is_failed_status_code(resp.status):
+            if self._is_server_side_error_status_code(resp.status):
+                # raise to retry
+                raise RetryableResponseError(resp)
+            elif resp.status == 401:  # need to refresh token
+                self._logger.debug('Need to refresh token')
+                if await self._refresh_access_token():  # retry on success
+                    raise RetryableResponseError(resp)
+            elif resp.status == 404:
+                self._logger.debug(
+                    '404, Google Best Practise says retry:'
+                    'https://developers.google.com/drive/'
+                    'manage-uploads#best-practices')
+                raise RetryableResponseError(resp)
+            else:
+                jobj = await self._json_or_content(resp)
+                error = jobj.get('error', {}) if isinstance(jobj, dict) \
+                    else {}
+                self._raise_for_upload_status(resp, error)
+            return None
+        return await self._json_or_content(resp)
+
+    @async_retry(aiohttp.ClientConnectionError, 5, delay=1)
+    async def resumable_file_update(self,
+                                    file_id,
+                                    fp,
+                                    headers=None,
+                                    body=None,
+                                    etag=None,
+                                    verify=True):
+        """Update a file.
+
+        :param file_id:
+            The name of the file to update.
+        :type file_id:
+            `unicode`.
+
+        :param fp:
+            file object or file path.
+        :type fp:
+            `file object` or `unicode`.
+
+        :param headers:
+            Request headers.
+        :type headers:
+            `dict`.
+
+        :param body:
+            Request body.
+        :type body:
+            `dict`.
+
+        :param etag:
+            (Optional) to be append to If-Match.
+        :type etag:
+            `unicode`
+
+        :returns:
+            Response from the API call.
+        :rtype:
+            `dict`
+        :raises: GoogleApiError.
+        """
+        # we should update file meta first, then the content
+        self._logger.debug(u"Update file with fileId: {0}".format(file_id))
+        request_headers = dict(headers or {})
+        request_headers.update(self._default_headers)
+        if etag:
+            request_headers.update({'If-Match': etag})
+        resp = await self._api_request(
+            'PUT',
+            urljoin(self._API_URL, '/upload/drive/v2/files/{0}'.format(
+                file_id)),
+            params={'uploadType': 'resumable'},
+            headers=request_headers,
+            data=json.dumps(body) if body is not None else None,
+            verify=verify)
+        if self._is_failed_status_code(resp.status):
+            if self._is_server_side_error_status_code(resp.status):
+                # raise to retry
+                raise RetryableResponseError(resp)
+            elif resp.status == 401:  # need to refresh token
+                self._logger.debug('Need to refresh token')
+                if await self._refresh_access_token():  # retry on success
+                    raise RetryableResponseError(resp)
+                return None
+            elif resp.status == 412:  # precondition error
+                raise GoogleApiError(
+                    code=resp.status, message=await resp.read())
+            self._logger.debug(u'Update file failed with response %s',
+                               await resp.read())
+            return None
+        resumable_url = resp.headers.get('location', None)
+        if resumable_url is None:
+            self._error['reason'] = 'No resumable url {0}'.format(
+                resp.headers)
+            return None
+        # update content
+        resp = await self._upload_content('PUT', resumable_url, fp)
+        if self._is_failed_status_code(resp.status):
+            if self._is_server_side_error_status_code(resp.status):
+                # raise to retry
+                raise RetryableResponseError(resp)
+            elif resp.status == 401:  # need to refresh token
+                self._logger.debug('Need to refresh token')
+                if await self._refresh_access_token():  # retry on success
+                    raise RetryableResponseError(resp)
+                return None
+            elif resp.status == 404:
+                raise RetryableResponseError(resp)
+            elif resp.status == 412:  # precondition error
+                raise GoogleApiError(
+                    code=resp.status, message=await resp.read())
+            self._logger.debug(u'Update file failed with response %s',
+                               await resp.read())
+            return None
+        return await self._json_or_content(resp)
+
+    async def _api_call(self,
+                        method,
+                        resource,
+                        params=None,
+                        data=None,
+                        headers=None,
+                        verify=False,
+                        stream=False):
+        """One attempt of :meth:`api_request`, raising
+        :class:`RetryableResponseError` when the call should be retried.
+        """
+        if resource.startswith('http'):
+            url = resource
+        else:
+            url = urljoin(self._API_URL, resource)
+        if data:
+            data = json.dumps(data)
+        request_headers = dict(headers or {})
+        request_headers.update(self._default_headers)
+        resp = await self._api_request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=request_headers,
+            verify=verify,
+            stream=stream,
+        )
+        if self._is_server_side_error_status_code(resp.status) or \
+                resp.status == 429:
+            self._logger.debug(resp)
+            resp.release()
+            # raise to retry
+            raise RetryableResponseError(resp)
+        if resp.status == 401:  # raise to retry
+            self._logger.debug(u'Need to refresh token')
+            if await self._refresh_access_token():  # retry on success
+                resp.release()
+                raise RetryableResponseError(resp)
+        if self._is_failed_status_code(resp.status):
+            self._logger.debug(u'%s %s failed with response %r',
+                               method, url, await resp.read())
+        if stream:
+            return resp.status, resp
+        return resp.status, await self._json_or_content(resp)
+
+    @async_retry(aiohttp.ClientConnectionError, 20, delay=1)
+    async def api_request(self,
+                          method,
+                          resource,
+                          params=None,
+                          data=None,
+                          headers=None,
+                          verify=False,
+                          stream=False):
+        """Make an API call.
+
+        :param method:
+            Method to use for the call.
+        :type method:
+            `str`
+
+        :param resource:
+            The resource being accessed.
+        :type resource:
+            `str`
+
+        :param params:
+            Parameters to be sent in the query string of the call.
+        :type params:
+            `dict`
+
+        :param data:
+            The data to send in the body of the request.
+        :type data:
+            `dict`
+
+        :param headers:
+            The headers to use for the call.
+        :type headers:
+            `dict`
+
+        :param verify:
+            If need to verify the cert.
+        :type verify:
+            `boolean`
+
+        :param stream:
+            If set, the response is returned unread and the caller must
+            release it.
+        :type stream:
+            `boolean`
+
+        :returns:
+            A tuple of the status code of the response and the response itself.
+        :rtype:
+            `tuple`
+        """
+        return await self._api_call(method, resource, params=params,
+                                    data=data, headers=headers,
+                                    verify=verify, stream=stream)
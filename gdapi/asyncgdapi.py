@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+import logging
+import json
+import aiohttp
+from .asyncapirequest import AsyncAPIRequest
+from .errors import EmailInvalidError
+
+
+class AsyncGDAPI(object):
+    """Asyncio version of :class:`gdapi.gdapi.GDAPI`.
+
+    Every method is a coroutine with the same arguments and return value
+    as its synchronous counterpart.
+    """
+
+    _ITEM_TYPE_FOLDER = 'application/vnd.google-apps.folder'
+    _ITEM_TYPE_FILE = 'application/octet-stream'
+
+    def __init__(self,
+                 credential_path=None,
+                 **kwargs):
+        """
+        :param credential_path:
+            Authentication file to use.
+        :type credential_path:
+            `unicode`
+
+        :param kwargs:
+            Connection options passed to :class:`AsyncAPIRequest`, e.g.
+            ``pool_maxsize`` or ``keep_alive``.
+        :type kwargs:
+            `dict`
+        """
+        self._logger = logging.getLogger(u"gdapi.%s" % self.__class__.__name__)
+        self._googleapi = AsyncAPIRequest(credential_path, **kwargs)
+
+    @property
+    def metrics(self):
+        """The :class:`gdapi.metrics.MetricsRegistry` of the client."""
+        return self._googleapi.metrics
+
+    async def close(self):
+        """Close the pooled connections of the underlying API client."""
+        await self._googleapi.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def about(self):
+        status_code, about = await self._googleapi.api_request(
+            'GET',
+            '/drive/v2/about',
+        )
+        return about
+
+    async def get_file_meta(self, file_id):
+        self._logger.debug(file_id)
+        status_code, drive_file = await self._googleapi.api_request(
+            'GET',
+            '/drive/v2/files/{0}'.format(file_id),
+        )
+        return drive_file
+
+    async def copy_file(self, file_id):
+        """Copy a file. See :meth:`GDAPI.copy_file`."""
+        try:
+            status_code, drive_file = await self._googleapi.api_request(
+                'POST',
+                '/drive/v2/files/{0}/copy'.format(file_id))
+            self._logger.debug("COPY result: {0}".format(
+                drive_file))
+        except Exception as error:
+            self._logger.exception(error)
+            drive_file = None
+        return drive_file
+
+    async def create_file(self, parent_id, file_path, title,
+                          description=None, mime_type=None):
+        """Upload a file. See :meth:`GDAPI.create_file`."""
+        self._logger.debug(u"Upload file {0} "
+                           "under folder {1}".format(title, parent_id))
+        if mime_type is None:
+            mime_type = self._ITEM_TYPE_FILE
+        body = {
+            'title': title,
+            'parents': [{'id': parent_id}],  # gd allow multi-parent
+            'mimeType': mime_type,
+        }
+        if description is not None:
+            body.update({'description': description})
+        self._logger.debug(json.dumps(body))
+        return await self._googleapi.resumable_file_upload(
+            file_path, body)
+
+    async def create_folder(self, parent_id, title):
+        """Create a folder. See :meth:`GDAPI.create_folder`."""
+        self._logger.debug(u"Create folder {0} "
+                           "under folder {1}".format(title, parent_id))
+        param = {
+            'q': u"trashed=false and title='{0}' and "
+            "'{1}' in parents and mimeType='{2}'".format(
+                title, parent_id, self._ITEM_TYPE_FOLDER),
+            'maxResults': 1,  # only query top 1
+        }
+        status_code, folders = await self._googleapi.api_request(
+            'GET',
+            '/drive/v2/files',
+            params=param,
+        )
+        if folders.get('items', []):
+            return folders['items'][0]['id']
+        body = {
+            'title': title,
+            'parents': [{'id': parent_id}],  # gd allow multi-parent
+            'mimeType': self._ITEM_TYPE_FOLDER,
+        }
+        self._logger.debug(json.dumps(body))
+
+        status_code, drive_file = await self._googleapi.api_request(
+            'POST',
+            '/drive/v2/files',
+            data=body,
+        )
+        return drive_file.get('id', None)
+
+    async def create_meta_file(self, parent_id, title, description=None):
+        """Create a meta-only file. See :meth:`GDAPI.create_meta_file`."""
+        self._logger.debug(u"Create meta file {0} "
+                           "under folder {1}".format(title, parent_id))
+        body = {
+            'title': title,
+            'parents': [{'id': parent_id}],  # gd allow multi-parent
+        }
+        if description is not None:
+            body.update({'description': description})
+        self._logger.debug(json.dumps(body))
+
+        status_code, drive_file = await self._googleapi.api_request(
+            'POST',
+            '/drive/v2/files',
+            data=body,
+        )
+        return drive_file
+
+    async def create_or_update_file(self, parent_id, file_path, title,
+                                    description=None, etag=None):
+        """Upload new file or update file."""
+        param = {
+            'q': u"trashed=false and title='{0}' and "
+            "'{1}' in parents".format(title, parent_id),
+            'maxResults': 1,  # only query top 1
+        }
+        status_code, files = await self._googleapi.api_request(
+            'GET',
+            '/drive/v2/files',
+            params=param,
+        )
+        if not files.get('items', []):
+            # no such file
+            return await self.create_file(parent_id, file_path, title,
+                                          description)
+        return await self.update_file(files['items'][0]['id'], file_path,
+                                      description, etag)
+
+    async def delete_file(self, file_id):
+        """Permanently remove the file. See :meth:`GDAPI.delete_file`."""
+        self._logger.debug("DELETE the file/folder {0} forever"
+                           "".format(file_id))
+        status_code, drive_file = await self._googleapi.api_request(
+            'DELETE',
+            '/drive/v2/files/{0}'.format(file_id))
+        if status_code != 204:  # no content
+            return False
+        return True
+
+    async def download_file(self, file_id, file_path):
+        """Download a file. See :meth:`GDAPI.download_file`."""
+        self._logger.debug(u"Download file {0} to {1}".format(
+            file_id, file_path))
+        drive_file = await self.get_file_meta(file_id)
+        if drive_file is None:
+            return None
+        if drive_file.get('downloadUrl', None) is None:
+            self._logger.error("File has no download url: {0}"
+                               "".format(drive_file))
+            return None
+        status_code, resp = await self._googleapi.api_request(
+            'GET', drive_file['downloadUrl'], stream=True)
+        try:
+            if status_code == 200:
+                with open(file_path, 'wb') as f:
+                    async for data in resp.content.iter_chunked(8192):
+                        f.write(data)
+        finally:
+            resp.release()
+        return drive_file
+
+    async def request(self, method, url):
+        """https://docs.google.com/feeds/default/private/full"""
+        status_code, resp = await self._googleapi.api_request(
+            method, url)
+        self._logger.debug(status_code)
+        self._logger.debug(resp)
+        return resp
+
+    async def trash_file(self, file_id):
+        """Trash a file. See :meth:`GDAPI.trash_file`."""
+        try:
+            body = {
+                'labels': {'trashed': True},
+            }
+            status_code, drive_file = await self._googleapi.api_request(
+                'UPDATE',
+                '/drive/v2/files/{0}'.format(file_id),
+                data=body)
+            self._logger.debug("Trash result: {0}".format(
+                drive_file))
+        except Exception as error:
+            self._logger.exception(error)
+            drive_file = None
+        return drive_file
+
+    async def update_file(self, file_id, file_path, description=None,
+                          etag=None):
+        """Update a file. See :meth:`GDAPI.update_file`."""
+        self._logger.debug(u"Update file {0}".format(file_id))
+        if description:
+            body = {'description': description}
+        else:
+            body = None
+        return await self._googleapi.resumable_file_update(
+            file_id, file_path, body=body, etag=etag)
+
+    async def unshare(self, resource_id, perm_id=None):
+        """grab all perm and unshare all, except owner, anyone.
+        If perm_id specified, remove that perm."""
+        perms = await self.query_permission(resource_id)
+        if not perms:
+            return False
+        perm_ids = [x['id'] for x in perms]
+        if perm_id:
+            self._logger.debug(u"Try to remove perm {0} from file {1}"
+                               u"".format(perm_id, resource_id))
+            if perm_id in perm_ids:
+                status_code, _ = await self._googleapi.api_request(
+                    'DELETE', '/drive/v2/files/{0}/permissions/{1}'.format(
+                        resource_id, perm_id))
+                return True
+            return False
+        for perm in perms:
+            if perm['role'] == u'owner' or perm['role'] == u'anyone':
+                continue
+            status_code, _ = await self._googleapi.api_request(
+                'DELETE', '/drive/v2/files/{0}/permissions/{1}'.format(
+                    resource_id, perm['id']))
+        return True
+
+    async def make_domain_writer_for_file(self, file_id, domain,
+                                          with_link=True):
+        """The api for share file/folder with domain"""
+        return await self._make_role_for_file(
+            file_id, 'domain', domain, 'writer')
+
+    async def make_domain_reader_for_file(self, file_id, domain,
+                                          with_link=True):
+        """The api for share file/folder with domain"""
+        return await self._make_role_for_file(
+            file_id, 'domain', domain, 'reader', with_link)
+
+    async def make_public_reader_for_file(self, file_id, with_link=True):
+        """The api for share file/folder public"""
+        return await self._make_role_for_file(
+            file_id, 'anyone', 'N/A', 'reader', with_link)
+
+    async def make_user_writer_for_file(self, file_id, user_email):
+        """The api for share file/folder"""
+        return await self._make_role_for_file(
+            file_id, 'user', user_email, 'writer')
+
+    async def make_user_reader_for_file(self, file_id, user_email,
+                                        with_link=True):
+        """The api for share file/folder"""
+        return await self._make_role_for_file(
+            file_id, 'user', user_email, 'reader', with_link)
+
+    async def _make_role_for_file(self, file_id,
+                                  perm_type, value, role,
+                                  with_link=False):
+        self._logger.debug(u"Make file {0} {3} {2} by value {1}"
+                           "".format(file_id, value, role, perm_type))
+        data = {
+            'role': role,
+            'type': perm_type,
+            'value': value
+        }
+        if perm_type in ['domain', 'anyone']:
+            data.update({'withLink': with_link})
+        try:
+            # a server error here usually means an invalid account, so
+            # do not retry it
+            status_code, perm = await self._googleapi._api_call(
+                'POST',
+                '/drive/v2/files/{0}/permissions'.format(file_id),
+                params={'sendNotificationEmails': 'false'},
+                data=data,
+            )
+        except aiohttp.ClientConnectionError:
+            raise EmailInvalidError(
+                code=500,
+                message='Server Error or Invalid account'
+            )
+        self._logger.debug(perm)
+        return perm
+
+    async def query_permission(self, resource_id):
+        """Returns the permission list item for the Resource.
+        See :meth:`GDAPI.query_permission`."""
+        self._logger.debug('Query permission {0}'.format(resource_id))
+        status_code, perms = await self._googleapi.api_request(
+            'GET',
+            '/drive/v2/files/{0}/permissions'.format(resource_id),
+        )
+        self._logger.debug(perms)
+        try:
+            return perms.get('items', [])
+        except AttributeError:
+            return []
+
+    async def query_title(self, title, isSharedWithMe=False):
+        """Returns the file list item for specified title.
+        See :meth:`GDAPI.query_title`."""
+        self._logger.debug('Query title {0}'.format(title))
+        page_token = None
+        result = []
+        title = title.replace(u"'", u"\\'")
+        while True:
+            try:
+                query_string = u"trashed=false and title='{0}'".format(
+                    title)
+                if isSharedWithMe:
+                    query_string = u' '.join([query_string,
+                                              u"and sharedWithMe"])
+                param = {
+                    'q': query_string
+                }
+                if page_token:
+                    param['pageToken'] = page_token
+                status_code, files = await self._googleapi.api_request(
+                    'GET',
+                    '/drive/v2/files',
+                    params=param,
+                )
+                result.extend(files['items'])
+                page_token = files.get('nextPageToken')
+                if not page_token:
+                    break
+            except Exception as error:
+                self._logger.exception(error)
+                break
+        return result
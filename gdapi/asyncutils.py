@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import logging
+from asyncio import sleep
+from functools import wraps
+from .utils import RetryPolicy, RetryAttempts
+
+
+def async_retry(ExceptionToHandle, tries, delay=3, backoff=2,
+                logger_name=None, deadline=None):
+    '''Retries a coroutine function until it returns.
+
+    Same contract as :func:`gdapi.utils.retry`, but waits with
+    ``asyncio.sleep`` so the event loop keeps serving other calls.'''
+
+    policy = RetryPolicy(tries, delay, backoff, deadline=deadline)
+
+    if logger_name:
+        logger = logging.getLogger(logger_name)
+    else:
+        logger = logging.getLogger('gdapi.asyncutils.async_retry')
+
+    def deco_retry(f):
+        async def f_retry(*args, **kwargs):
+            attempts = RetryAttempts(policy, args[0] if args else None,
+                                     f.__name__, logger)
+            while attempts.left():
+                try:
+                    return await f(*args, **kwargs)
+                except ExceptionToHandle as e:
+                    wait = attempts.failed(e)
+                    if wait is None:
+                        break
+                    await sleep(wait)
+            return False  # Ran out of tries :-(
+
+        return wraps(f)(f_retry)  # true decorator -> decorated function
+    return deco_retry
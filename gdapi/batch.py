@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Helpers for Drive's ``multipart/mixed`` batch endpoint."""
+import json
+import uuid
+try:
+    from urlparse import urlsplit
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlsplit, urlencode  # 3.*
+
+MAX_BATCH_SIZE = 100
+
+
+def _path_of(resource):
+    """Returns the path and query of a resource or absolute url."""
+    if resource.startswith('http'):
+        parts = urlsplit(resource)
+        if parts.query:
+            return '{0}?{1}'.format(parts.path, parts.query)
+        return parts.path
+    return resource
+
+
+def encode_batch(calls, boundary=None):
+    """Encode sub-requests into one ``multipart/mixed`` body.
+
+    :param calls:
+        Sequence of ``(method, resource, params, data)``.
+    :type calls:
+        `list`
+
+    :param boundary:
+        (Optional) The multipart boundary, random if not given.
+    :type boundary:
+        `str`
+
+    :returns:
+        The content type and the body of the batch request.
+    :rtype:
+        `tuple`
+    """
+    if boundary is None:
+        boundary = 'batch_{0}'.format(uuid.uuid4().hex)
+    lines = []
+    for index, (method, resource, params, data) in enumerate(calls):
+        path = _path_of(resource)
+        if params:
+            separator = '&' if '?' in path else '?'
+            path = path + separator + urlencode(sorted(params.items()))
+        lines.append('--' + boundary)
+        lines.append('Content-Type: application/http')
+        lines.append('Content-ID: <item{0}>'.format(index))
+        lines.append('')
+        lines.append('{0} {1}'.format(method, path))
+        if data is not None:
+            payload = json.dumps(data)
+            lines.append('Content-Type: application/json')
+            lines.append('Content-Length: {0}'.format(len(payload)))
+            lines.append('')
+            lines.append(payload)
+        else:
+            lines.append('')
+    lines.append('--' + boundary + '--')
+    lines.append('')
+    content_type = 'multipart/mixed; boundary={0}'.format(boundary)
+    return content_type, '\r\n'.join(lines)
+
+
+def _boundary_of(content_type):
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary':
+            return value.strip('"')
+    raise ValueError('No boundary in {0}'.format(content_type))
+
+
+def parse_batch_response(content_type, content, headers=None):
+    """Split a ``multipart/mixed`` batch response into sub-responses.
+
+    :param content_type:
+        Content-Type header of the batch response.
+    :type content_type:
+        `str`
+
+    :param content:
+        Body of the batch response.
+    :type content:
+        `bytes`
+
+    :param headers:
+        (Optional) Filled with the headers of each sub-response, by
+        request index, lower-cased.
+    :type headers:
+        `dict`
+
+    :returns:
+        Mapping from request index to ``(status_code, json)``. The body is
+        the raw text when it is not JSON.
+    :rtype:
+        `dict`
+    """
+    boundary = _boundary_of(content_type)
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    content = content.replace('\r\n', '\n')
+    results = {}
+    for part in content.split('--' + boundary):
+        part = part.strip('\n')
+        if not part or part.startswith('--'):
+            continue
+        head, _, http = part.partition('\n\n')
+        index = None
+        for line in head.split('\n'):
+            key, _, value = line.partition(':')
+            if key.strip().lower() == 'content-id':
+                value = value.strip().strip('<>')
+                index = int(value.rsplit('item', 1)[-1])
+        status_line, _, rest = http.partition('\n')
+        sub_head, _, body = rest.partition('\n\n')
+        if headers is not None and index is not None:
+            headers[index] = dict(
+                (key.strip().lower(), value.strip())
+                for key, _, value in (line.partition(':')
+                                      for line in sub_head.split('\n'))
+                if key.strip())
+        status_code = int(status_line.split()[1])
+        body = body.strip('\n')
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+        results[index] = (status_code, body)
+    return results
+
+
+class BatchRequest(object):
+    """Collect API calls and send them through the batch endpoint.
+
+    >>> batch = BatchRequest(api)
+    >>> batch.add('DELETE', '/drive/v2/files/a/permissions/b')
+    >>> batch.execute()
+    [(204, '')]
+    """
+
+    def __init__(self, api):
+        """
+        :param api:
+            The client used to send the batch.
+        :type api:
+            :class:`gdapi.apirequest.APIRequest`
+        """
+        self._api = api
+        self._calls = []
+
+    def __len__(self):
+        return len(self._calls)
+
+    def add(self, method, resource, params=None, data=None):
+        """Queue one call; see :meth:`APIRequest.api_request`."""
+        self._calls.append((method, resource, params, data))
+
+    def execute(self):
+        """Send the queued calls and return their results in order."""
+        calls, self._calls = self._calls, []
+        return self._api.batch_request(calls)
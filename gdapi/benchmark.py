@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the upload, download, listing and sharing paths of
+:class:`gdapi.gdapi.GDAPI`, run against a local
+:class:`gdapi.emulator.DriveEmulator`.
+
+Every case runs in a new interpreter, so its peak RSS is the client's
+alone, while the emulator stays in the calling process.
+
+>>> results = run_benchmarks(sizes=[1 << 20], concurrency=[1, 4])
+>>> save_results(results, 'before.json')
+>>> print(format_comparison(load_results('before.json'), results))
+"""
+import os
+import sys
+import json
+import math
+import shutil
+import platform
+import tempfile
+import threading
+import multiprocessing
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
+from time import gmtime, strftime
+from .emulator import DriveEmulator, Faults
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OPERATIONS = ('upload', 'download', 'list', 'share')
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of values, None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(fraction * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies, seconds, transferred=0):
+    """Returns the throughput and latency figures of one case.
+
+    :param latencies:
+        Seconds taken by each operation.
+    :type latencies:
+        `list`
+
+    :param seconds:
+        Wall time of the whole case.
+    :type seconds:
+        `float`
+
+    :param transferred:
+        Bytes uploaded or downloaded by the case.
+    :type transferred:
+        `int`
+    """
+    return {
+        'ops': len(latencies),
+        'seconds': seconds,
+        'ops_per_second': len(latencies) / seconds if seconds else None,
+        'mb_per_second': (transferred / seconds / 1e6
+                          if seconds and transferred else None),
+        'latency': {
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'max': max(latencies) if latencies else None,
+        },
+    }
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes, or
+    None where unknown."""
+    try:
+        # unlike ru_maxrss, not inherited from the parent through exec
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _case_operation(api, case, work_dir):
+    """Returns the function running one operation of case, given its
+    index, and the bytes each operation transfers."""
+    operation = case['operation']
+    if operation == 'upload':
+        path = os.path.join(work_dir, 'upload.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(case['file_size']))
+
+        def upload(index):
+            if not api.create_file('root', path, 'upload-{0}'.format(index)):
+                raise RuntimeError('upload failed')
+        return upload, case['file_size']
+    if operation == 'download':
+        def download(index):
+            target = os.path.join(work_dir, 'download-{0}'.format(index))
+            if not api.download_file(case['file_id'], target):
+                raise RuntimeError('download failed')
+            os.unlink(target)
+        return download, case['file_size']
+    if operation == 'list':
+        def list_files(index):
+            query = u"trashed=false and '{0}' in parents".format(
+                case['folder_id'])
+            for _ in api.iter_files(query, page_size=case['page_size']):
+                pass
+        return list_files, 0
+    if operation == 'share':
+        def share(index):
+            file_id = case['file_ids'][index % len(case['file_ids'])]
+            api.make_user_reader_for_file(
+                file_id, 'user{0}@example.com'.format(index))
+            api.unshare(file_id)
+        return share, 0
+    raise ValueError(u'Unknown operation {0}'.format(operation))
+
+
+def run_case(case, api_url, token_url):
+    """Run one benchmark case in this process. See :func:`run_benchmarks`
+    for the keys of case."""
+    from .gdapi import GDAPI  # not imported by the parent process
+    work_dir = tempfile.mkdtemp(prefix='gdapi-bench-')
+    try:
+        cred_path = os.path.join(work_dir, 'cred.json')
+        with open(cred_path, 'w') as f:
+            json.dump({'access_token': 'benchmark'}, f)
+        concurrency = case['concurrency']
+        api = GDAPI(cred_path, api_url=api_url, token_url=token_url,
+                    pool_maxsize=max(10, concurrency))
+        run, size = _case_operation(api, case, work_dir)
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def timed(index):
+            start = timer()
+            try:
+                run(index)
+            except Exception as error:
+                with lock:
+                    errors.append(repr(error))
+                return
+            elapsed = timer() - start
+            with lock:
+                latencies.append(elapsed)
+
+        start = timer()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, range(case['ops'])))
+        seconds = timer() - start
+        api.close()
+        result = dict(case)
+        for key in ('file_id', 'file_ids', 'folder_id'):
+            result.pop(key, None)
+        result.update(summarize(latencies, seconds, size * len(latencies)))
+        result['errors'] = len(errors)
+        result['first_error'] = errors[0] if errors else None
+        result['peak_rss_bytes'] = peak_rss()
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _child(queue, case, api_url, token_url):
+    try:
+        queue.put(run_case(case, api_url, token_url))
+    except Exception as error:
+        queue.put({'operation': case['operation'], 'failed': repr(error)})
+
+
+def _run_isolated(case, api_url, token_url):
+    """Run case in a new interpreter and returns its result."""
+    try:
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:  # 2.*, forked children share our RSS
+        context = multiprocessing
+    queue = context.Queue()
+    process = context.Process(target=_child,
+                              args=(queue, case, api_url, token_url))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def make_cases(drive, operations=OPERATIONS, sizes=(64 * 1024, 1 << 20),
+               concurrency=(1, 4), page_sizes=(100, 1000), ops=20,
+               list_files=2000, share_files=20):
+    """Seed drive and returns the cases of the sweep."""
+    cases = []
+    if 'upload' in operations or 'download' in operations:
+        for size in sizes:
+            remote = drive.add_file('download.bin', os.urandom(size))
+            for workers in concurrency:
+                base = {'file_size': size, 'concurrency': workers,
+                        'ops': ops}
+                if 'upload' in operations:
+                    cases.append(dict(base, operation='upload'))
+                if 'download' in operations:
+                    cases.append(dict(base, operation='download',
+                                      file_id=remote['id']))
+    if 'list' in operations:
+        folder = drive.add_folder('list')
+        for i in range(list_files):
+            drive.add_file('file-{0}'.format(i), parent_id=folder['id'])
+        for page_size in page_sizes:
+            for workers in concurrency:
+                cases.append({'operation': 'list', 'page_size': page_size,
+                              'list_files': list_files,
+                              'folder_id': folder['id'],
+                              'concurrency': workers,
+                              'ops': max(1, ops // 10)})
+    if 'share' in operations:
+        file_ids = [drive.add_file('share-{0}'.format(i))['id']
+                    for i in range(share_files)]
+        for workers in concurrency:
+            cases.append({'operation': 'share', 'concurrency': workers,
+                          'ops': ops, 'file_ids': file_ids})
+    return cases
+
+
+def run_benchmarks(operations=OPERATIONS, sizes=(64 * 1024, 1 << 20),
+                   concurrency=(1, 4), page_sizes=(100, 1000), ops=20,
+                   latency=0.0, isolate=True, progress=None):
+    """Run the sweep of every operation against a new emulator.
+
+    :param operations:
+        Among ``'upload'``, ``'download'``, ``'list'`` and ``'share'``.
+    :type operations:
+        `list`
+
+    :param sizes:
+        File sizes in bytes of the upload and download cases.
+    :type sizes:
+        `list`
+
+    :param concurrency:
+        Numbers of threads running the operations of a case.
+    :type concurrency:
+        `list`
+
+    :param page_sizes:
+        Page sizes of the listing cases.
+    :type page_sizes:
+        `list`
+
+    :param ops:
+        Operations per case, a tenth of it for listings.
+    :type ops:
+        `int`
+
+    :param latency:
+        Seconds the emulator delays every response.
+    :type latency:
+        `float`
+
+    :param isolate:
+        Run each case in a new interpreter, for its own peak RSS.
+        Otherwise the peak RSS reported is the one of the whole run.
+    :type isolate:
+        `boolean`
+
+    :param progress:
+        (Optional) Called with the result of each case.
+    :type progress:
+        `callable`
+
+    :returns:
+        The run, ready for :func:`save_results`.
+    :rtype:
+        `dict`
+    """
+    run = {
+        'started': strftime('%Y-%m-%dT%H:%M:%SZ', gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'operations': list(operations), 'sizes': list(sizes),
+                   'concurrency': list(concurrency),
+                   'page_sizes': list(page_sizes), 'ops': ops,
+                   'latency': latency, 'isolate': isolate},
+        'results': [],
+    }
+    with DriveEmulator(Faults(latency=latency)) as drive:
+        for case in make_cases(drive, operations, sizes, concurrency,
+                               page_sizes, ops):
+            if isolate:
+                result = _run_isolated(case, drive.url, drive.token_url)
+            else:
+                result = run_case(case, drive.url, drive.token_url)
+            run['results'].append(result)
+            if progress is not None:
+                progress(result)
+    return run
+
+
+def save_results(run, path):
+    with open(path, 'w') as fout:
+        json.dump(run, fout, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path, 'r') as fin:
+        return json.load(fin)
+
+
+def case_key(result):
+    """Returns what identifies a case across runs."""
+    return (result.get('operation'), result.get('file_size'),
+            result.get('page_size'), result.get('concurrency'))
+
+
+def case_name(result):
+    operation, size, page_size, workers = case_key(result)
+    name = operation
+    if size is not None:
+        name += u' size={0}'.format(size)
+    if page_size is not None:
+        name += u' page={0}'.format(page_size)
+    return name + u' threads={0}'.format(workers)
+
+
+def format_result(result):
+    """Returns one line describing the result of a case."""
+    if 'failed' in result:
+        return u'{0}: failed {1}'.format(result['operation'],
+                                         result['failed'])
+    line = u'{0:<40} {1:>9.1f} ops/s'.format(case_name(result),
+                                             result['ops_per_second'] or 0)
+    if result.get('mb_per_second'):
+        line += u' {0:>8.1f} MB/s'.format(result['mb_per_second'])
+    latency = result['latency']
+    if latency['p50'] is not None:
+        line += u'  p50 {0:.1f}ms p99 {1:.1f}ms'.format(
+            latency['p50'] * 1000, latency['p99'] * 1000)
+    if result.get('peak_rss_bytes'):
+        line += u'  rss {0:.0f}MB'.format(result['peak_rss_bytes'] / 1e6)
+    if result.get('errors'):
+        line += u'  errors {0}'.format(result['errors'])
+    return line
+
+
+def format_comparison(before, after):
+    """Returns a table of the change of ops/s and p99 latency between
+    two runs, for the cases they have in common."""
+    previous = dict((case_key(r), r) for r in before['results']
+                    if 'failed' not in r)
+    lines = []
+    for result in after['results']:
+        old = previous.get(case_key(result))
+        if old is None or 'failed' in result:
+            continue
+        changes = []
+        for label, value in [
+                ('ops/s', lambda r: r['ops_per_second']),
+                ('p99', lambda r: r['latency']['p99'])]:
+            a, b = value(old), value(result)
+            if a and b is not None:
+                changes.append(u'{0} {1:+.1f}%'.format(
+                    label, (b - a) / a * 100))
+        lines.append(u'{0:<40} {1}'.format(case_name(result),
+                                           u', '.join(changes)))
+    return u'\n'.join(lines)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache whose entries go stale after ttl seconds.
+
+    Stale entries are kept until evicted, so the caller can still use
+    them to revalidate (e.g. with their etag).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param maxsize:
+            Maximum number of entries.
+        :type maxsize:
+            `int`
+
+        :param ttl:
+            (Optional) Seconds an entry stays fresh, forever if None.
+        :type ttl:
+            `float`
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def lookup(self, key):
+        """Returns a tuple of the value (None if missing) and whether it
+        is still fresh."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None, False
+            self._data[key] = entry  # most recently used
+        stored, value = entry
+        fresh = self._ttl is None or time() - stored < self._ttl
+        return value, fresh
+
+    def get(self, key, default=None):
+        """Returns the value if it is fresh, default otherwise."""
+        value, fresh = self.lookup(key)
+        return value if fresh else default
+
+    def set(self, key, value):
+        """Store value, or mark it fresh again if it is already stored."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time(), value)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def items(self):
+        """Returns the ``(key, value)`` pairs stored, stale or not."""
+        with self._lock:
+            return [(k, v) for k, (_, v) in self._data.items()]
+
+    def discard(self, predicate):
+        """Remove every entry for which predicate(key, value) is true."""
+        with self._lock:
+            for key in [k for k, (_, v) in self._data.items()
+                        if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
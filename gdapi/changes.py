@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Records and cursor for the Drive changes feed."""
+import os
+import json
+from collections import namedtuple
+from .utils import atomic_write_json
+
+
+class Change(namedtuple('Change', ['change_id', 'file_id', 'deleted',
+                                   'file', 'modification_date'])):
+    """One entry of the changes feed. file is the file resource, None
+    when the file was deleted."""
+    __slots__ = ()
+
+    @classmethod
+    def from_resource(cls, item):
+        return cls(
+            change_id=int(item['id']),
+            file_id=item.get('fileId'),
+            deleted=item.get('deleted', False),
+            file=item.get('file'),
+            modification_date=item.get('modificationDate'),
+        )
+
+
+class ChangeCursor(object):
+    """Where to continue the changes feed, persisted as a small JSON file.
+
+    The cursor holds either a ``pageToken`` from an unfinished listing or
+    the ``startChangeId`` of the next listing.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+            File to keep the cursor in.
+        :type path:
+            `unicode`
+        """
+        self.path = path
+
+    def load(self):
+        """Returns the saved cursor, or an empty dict."""
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as fin:
+                return json.load(fin)
+        except ValueError:
+            return {}
+
+    def save(self, cursor):
+        atomic_write_json(self.path, cursor)
+
+    def reset(self):
+        if os.path.isfile(self.path):
+            os.unlink(self.path)
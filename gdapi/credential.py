@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Credential file shared by several processes."""
+import os
+import json
+import threading
+from contextlib import contextmanager
+from .utils import atomic_write_json
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class CredentialStore(object):
+    """JSON credential file that can be shared by several processes.
+
+    Writes are atomic (temporary file then rename) and done under an
+    advisory lock on ``<path>.lock``, and :meth:`changed` tells when
+    another process saved the file, so a token refreshed by one process
+    is picked up by the others.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+            The credential file.
+        :type path:
+            `unicode`
+        """
+        self.path = path
+        self._mtime = None
+        self._thread_lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+
+    def _stat_mtime(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def changed(self):
+        """Returns whether the file changed since it was last loaded or
+        saved by this store."""
+        return self._stat_mtime() != self._mtime
+
+    @contextmanager
+    def lock(self):
+        """Hold the advisory lock, across threads and processes. The
+        lock is reentrant within a thread."""
+        with self._thread_lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_file = open(self.path + '.lock', 'a')
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def load(self):
+        """Returns the credential, or an empty dict if there is none."""
+        mtime = self._stat_mtime()
+        if mtime is None:
+            self._mtime = None
+            return {}
+        with open(self.path, 'r') as fin:
+            credential = json.load(fin)
+        self._mtime = mtime
+        return credential
+
+    def save(self, credential):
+        atomic_write_json(self.path, credential)
+        self._mtime = self._stat_mtime()
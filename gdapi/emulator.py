@@ -0,0 +1,775 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Drive v2 API, to test and measure the clients
+without network access.
+
+>>> with DriveEmulator(Faults(server_error_rate=0.1, seed=1)) as drive:
+...     api = GDAPI(path, api_url=drive.url, token_url=drive.token_url)
+...     api.create_file('root', 'a.txt', 'a.txt')
+"""
+import re
+import sys
+import json
+import errno
+import logging
+import uuid
+import random
+import hashlib
+import threading
+from time import sleep, gmtime, strftime
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qsl
+except ImportError:  # 3.*
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qsl
+
+logger = logging.getLogger('gdapi.emulator')
+
+FOLDER_TYPE = 'application/vnd.google-apps.folder'
+
+_ERRORS = {
+    400: ('badRequest', 'Bad Request'),
+    401: ('authError', 'Invalid Credentials'),
+    403: ('userRateLimitExceeded', 'User Rate Limit Exceeded'),
+    404: ('notFound', 'File not found'),
+    412: ('conditionNotMet', 'Precondition Failed'),
+    416: ('requestedRangeNotSatisfiable', 'Requested range not satisfiable'),
+    429: ('rateLimitExceeded', 'Rate Limit Exceeded'),
+    500: ('backendError', 'Backend Error'),
+    503: ('backendError', 'Service Unavailable'),
+}
+
+
+def error_body(code, message=None):
+    """Returns the body of an API error response."""
+    reason, default = _ERRORS.get(code, ('unknown', 'Error'))
+    message = message or default
+    return {'error': {'code': code, 'message': message,
+                      'errors': [{'domain': 'global', 'reason': reason,
+                                  'message': message}]}}
+
+
+class Faults(object):
+    """What the emulator does wrong, and how often. Rates are the
+    probability that a request gets the fault; at most one fault is
+    picked per request. The token endpoint only gets latency.
+
+    >>> faults = Faults(latency=0.05, rate_limit_rate=0.02, seed=42)
+    >>> faults.fail_next(503, count=2, path='/upload/')
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, server_error_rate=0.0,
+                 rate_limit_rate=0.0, too_many_requests_rate=0.0,
+                 unauthorized_rate=0.0, retry_after=None, seed=None):
+        """
+        :param latency:
+            Seconds every response is delayed.
+        :type latency:
+            `float`
+
+        :param jitter:
+            Up to this many seconds added to latency, at random.
+        :type jitter:
+            `float`
+
+        :param server_error_rate:
+            Fraction of the requests answered with a 503.
+        :type server_error_rate:
+            `float`
+
+        :param rate_limit_rate:
+            Fraction of the requests answered with a 403
+            userRateLimitExceeded.
+        :type rate_limit_rate:
+            `float`
+
+        :param too_many_requests_rate:
+            Fraction of the requests answered with a 429.
+        :type too_many_requests_rate:
+            `float`
+
+        :param unauthorized_rate:
+            Fraction of the requests answered with a 401.
+        :type unauthorized_rate:
+            `float`
+
+        :param retry_after:
+            (Optional) Retry-After seconds sent with 429 and 503.
+        :type retry_after:
+            `int`
+
+        :param seed:
+            (Optional) Seed of the random faults, for repeatable runs.
+        :type seed:
+            `int`
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rates = [(503, server_error_rate), (403, rate_limit_rate),
+                      (429, too_many_requests_rate),
+                      (401, unauthorized_rate)]
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._queued = []
+
+    def fail_next(self, status, count=1, path=None):
+        """Answer the next count requests whose path contains path (any
+        request if None) with status, before any random fault."""
+        with self._lock:
+            self._queued.append([status, count, path])
+
+    def delay(self):
+        """Returns the seconds to delay the next response."""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def pick(self, path):
+        """Returns the status of the fault of a request, or None."""
+        with self._lock:
+            for queued in self._queued:
+                status, count, match = queued
+                if match is None or match in path:
+                    queued[1] -= 1
+                    if queued[1] < 1:
+                        self._queued.remove(queued)
+                    return status
+            draw = self._random.random()
+            for status, rate in self.rates:
+                if draw < rate:
+                    return status
+                draw -= rate
+        return None
+
+
+def _now():
+    return strftime('%Y-%m-%dT%H:%M:%S.000Z', gmtime())
+
+
+def _split_and(q):
+    """Split a search query on the ``and`` outside of quotes."""
+    clauses, current, quoted, escaped = [], [], False, False
+    i = 0
+    while i < len(q):
+        c = q[i]
+        if escaped:
+            escaped = False
+        elif c == '\\' and quoted:
+            escaped = True
+        elif c == "'":
+            quoted = not quoted
+        elif not quoted and q[i:i + 5].lower() == ' and ':
+            clauses.append(''.join(current).strip())
+            current = []
+            i += 5
+            continue
+        current.append(c)
+        i += 1
+    clauses.append(''.join(current).strip())
+    return [clause for clause in clauses if clause]
+
+
+_STRING = r"'((?:[^'\\]|\\.)*)'"
+_CLAUSES = [
+    (re.compile(r'^trashed\s*=\s*(true|false)$', re.I),
+     lambda m: lambda f: f['labels']['trashed'] == (m.group(1).lower() ==
+                                                    'true')),
+    (re.compile(r'^(title|mimeType)\s*(!=|=)\s*' + _STRING + '$'),
+     lambda m: lambda f: (f.get(m.group(1)) == _unescape(m.group(3))) ==
+     (m.group(2) == '=')),
+    (re.compile(r'^title\s+contains\s+' + _STRING + '$'),
+     lambda m: lambda f: _unescape(m.group(1)) in f.get('title', '')),
+    (re.compile('^' + _STRING + r'\s+in\s+parents$'),
+     lambda m: lambda f: _unescape(m.group(1)) in
+     [p['id'] for p in f.get('parents', [])]),
+    (re.compile(r'^sharedWithMe$'),
+     lambda m: lambda f: f.get('sharedWithMe', False)),
+]
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def compile_query(q):
+    """Returns a predicate on file resources for a search query. Only the
+    clauses used by the clients are supported.
+
+    :raises: ValueError for other queries.
+    """
+    tests = []
+    for clause in _split_and(q or ''):
+        for pattern, build in _CLAUSES:
+            match = pattern.match(clause)
+            if match:
+                tests.append(build(match))
+                break
+        else:
+            raise ValueError(u'Unsupported query: {0}'.format(clause))
+    return lambda f: all(test(f) for test in tests)
+
+
+class DriveState(object):
+    """The files, permissions, changes and upload sessions of an
+    emulator. Every method must be called with :attr:`lock` held."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.base_url = ''
+        self.files = {}
+        self.contents = {}
+        self.permissions = {}
+        self.changes = []
+        self.sessions = {}
+        self.largest_change_id = 0
+        self.files['root'] = {
+            'kind': 'drive#file', 'id': 'root', 'title': 'My Drive',
+            'mimeType': FOLDER_TYPE, 'parents': [],
+            'labels': {'trashed': False}, 'etag': '"root"',
+            'createdDate': _now(), 'modifiedDate': _now(),
+        }
+
+    def _record_change(self, file_id, deleted=False):
+        self.largest_change_id += 1
+        resource = self.files.get(file_id)
+        self.changes.append({
+            'kind': 'drive#change',
+            'id': str(self.largest_change_id),
+            'fileId': file_id,
+            'deleted': deleted,
+            'file': dict(resource) if resource and not deleted else None,
+        })
+
+    def _touch(self, resource):
+        resource['modifiedDate'] = _now()
+        resource['etag'] = '"{0}"'.format(uuid.uuid4().hex)
+
+    def create(self, meta, content=None):
+        file_id = uuid.uuid4().hex[:28]
+        resource = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'title': 'Untitled',
+            'mimeType': 'application/octet-stream',
+            'parents': [{'id': 'root'}],
+            'labels': {'trashed': False},
+            'createdDate': _now(),
+        }
+        resource.update(meta or {})
+        resource['id'] = file_id
+        self.files[file_id] = resource
+        self.permissions[file_id] = [{
+            'kind': 'drive#permission', 'id': 'owner', 'role': 'owner',
+            'type': 'user'}]
+        if resource['mimeType'] != FOLDER_TYPE:
+            self.set_content(file_id, content or b'', record=False)
+        else:
+            self._touch(resource)
+        self._record_change(file_id)
+        return resource
+
+    def set_content(self, file_id, content, record=True):
+        resource = self.files[file_id]
+        content = bytes(content)
+        self.contents[file_id] = content
+        resource['fileSize'] = str(len(content))
+        resource['md5Checksum'] = hashlib.md5(content).hexdigest()
+        resource['downloadUrl'] = '{0}/drive/v2/files/{1}?alt=media'.format(
+            self.base_url, file_id)
+        self._touch(resource)
+        if record:
+            self._record_change(file_id)
+
+    def update(self, file_id, meta):
+        resource = self.files[file_id]
+        for key, value in (meta or {}).items():
+            if key == 'labels':
+                resource['labels'].update(value)
+            elif key not in ('id', 'kind'):
+                resource[key] = value
+        self._touch(resource)
+        self._record_change(file_id)
+        return resource
+
+    def delete(self, file_id):
+        if file_id not in self.files:
+            return  # went with its folder
+        for child_id, child in list(self.files.items()):
+            if file_id in [p['id'] for p in child.get('parents', [])]:
+                self.delete(child_id)
+        self.files.pop(file_id, None)
+        self.contents.pop(file_id, None)
+        self.permissions.pop(file_id, None)
+        self._record_change(file_id, deleted=True)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping their connection, e.g. on injected faults
+        error = sys.exc_info()[1]
+        if getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE):
+            return
+        logger.error(u'Error handling a request from %s', client_address,
+                     exc_info=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the real API
+    # headers and body are written apart, which Nagle would delay
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _handle(self):
+        body = self._read_body()
+        status, headers, content = self.server.emulator.handle(
+            self.command, self.path, self.headers, body)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+    do_UPDATE = _handle  # used by GDAPI.trash_file
+
+
+class DriveEmulator(object):
+    """Drive v2 API served on localhost, in a background thread.
+
+    It keeps files, content, permissions and changes in memory. It
+    implements the calls of the clients: file listing with the search
+    clauses they use, get, insert, update, copy, trash, delete, media,
+    multipart and resumable uploads, ranged downloads, permissions,
+    changes, batch, and the token endpoint. The ``fields`` parameter is
+    ignored and responses are never compressed. Any bearer token is
+    accepted; see :class:`Faults` to get 401s.
+    """
+
+    _ROUTES = [
+        ('token', r'/o/oauth2/token'),
+        ('about', r'/drive/v2/about'),
+        ('changes', r'/drive/v2/changes'),
+        ('batch', r'/batch/drive/v2'),
+        ('files', r'/drive/v2/files'),
+        ('file', r'/drive/v2/files/(?P<file_id>[^/]+)'),
+        ('copy', r'/drive/v2/files/(?P<file_id>[^/]+)/copy'),
+        ('trash', r'/drive/v2/files/(?P<file_id>[^/]+)/(?P<action>trash|'
+                  r'untrash)'),
+        ('permissions', r'/drive/v2/files/(?P<file_id>[^/]+)/permissions'),
+        ('permission', r'/drive/v2/files/(?P<file_id>[^/]+)/permissions/'
+                       r'(?P<perm_id>[^/]+)'),
+        ('upload', r'/upload/drive/v2/files(?:/(?P<file_id>[^/]+))?'),
+        ('session', r'/upload/session/(?P<session_id>[^/]+)'),
+    ]
+
+    def __init__(self, faults=None, host='127.0.0.1', port=0):
+        """
+        :param faults:
+            (Optional) Latency and errors to inject.
+        :type faults:
+            :class:`Faults`
+
+        :param host:
+            Interface to listen on.
+        :type host:
+            `str`
+
+        :param port:
+            Port to listen on, any free one if 0.
+        :type port:
+            `int`
+        """
+        self.faults = faults or Faults()
+        self.state = DriveState()
+        self._routes = [(name, re.compile('^' + pattern + '$'))
+                        for name, pattern in self._ROUTES]
+        self._stats_lock = threading.Lock()
+        self.stats = {}
+        self._server = _Server((host, port), _Handler)
+        self._server.emulator = self
+        self.state.base_url = 'http://{0}:{1}'.format(
+            host, self._server.server_port)
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to pass as ``api_url`` to the clients."""
+        return self.state.base_url + '/'
+
+    @property
+    def token_url(self):
+        """URL to pass as ``token_url`` to the clients."""
+        return self.state.base_url + '/o/oauth2/token'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.1,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def add_file(self, title, content=b'', parent_id='root', **meta):
+        """Create a file directly, without a request. Returns its
+        resource."""
+        meta.update({'title': title, 'parents': [{'id': parent_id}]})
+        with self.state.lock:
+            return dict(self.state.create(meta, content))
+
+    def add_folder(self, title, parent_id='root'):
+        return self.add_file(title, parent_id=parent_id,
+                             mimeType=FOLDER_TYPE)
+
+    def content(self, file_id):
+        """Returns the content of a file, or None."""
+        with self.state.lock:
+            return self.state.contents.get(file_id)
+
+    def _count(self, route, status):
+        with self._stats_lock:
+            key = (route, status)
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def handle(self, method, path, headers, body):
+        """Answer one request.
+
+        :returns:
+            A tuple of the status, the headers and the body.
+        :rtype:
+            `tuple`
+        """
+        delay = self.faults.delay()
+        if delay:
+            sleep(delay)
+        parts = urlsplit(path)
+        route, params = self._route(parts.path)
+        status = None
+        if route != 'token':
+            status = self.faults.pick(parts.path)
+        if status is not None:
+            response = self._error(status)
+            if status in (429, 503) and self.faults.retry_after is not None:
+                response[1]['Retry-After'] = str(self.faults.retry_after)
+        else:
+            response = self._dispatch(method, route, params,
+                                      dict(parse_qsl(parts.query)), headers,
+                                      body)
+        self._count(route, response[0])
+        return response
+
+    def _route(self, path):
+        for name, pattern in self._routes:
+            match = pattern.match(path)
+            if match:
+                return name, match.groupdict()
+        return None, {}
+
+    def _json(self, status, obj, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json; charset=UTF-8'
+        return status, headers, json.dumps(obj).encode('utf-8')
+
+    def _error(self, status, message=None):
+        return self._json(status, error_body(status, message))
+
+    def _dispatch(self, method, route, params, query, headers, body):
+        if route is None:
+            return self._error(404, 'No such endpoint')
+        handler = getattr(self, '_handle_' + route)
+        try:
+            if route == 'batch':  # its parts take the lock one by one
+                return handler(method, query, headers, body)
+            with self.state.lock:
+                return handler(method, query, headers, body, **params)
+        except KeyError:
+            return self._error(404)
+        except ValueError as error:
+            return self._error(400, str(error))
+
+    def _load(self, body):
+        if not body:
+            return {}
+        return json.loads(body.decode('utf-8'))
+
+    def _handle_token(self, method, query, headers, body):
+        return self._json(200, {
+            'access_token': 'emulator-{0}'.format(uuid.uuid4().hex),
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+        })
+
+    def _handle_about(self, method, query, headers, body):
+        return self._json(200, {
+            'kind': 'drive#about',
+            'rootFolderId': 'root',
+            'largestChangeId': str(self.state.largest_change_id),
+            'user': {'displayName': 'Emulator'},
+        })
+
+    def _page(self, items, query, default_size):
+        start = int(query.get('pageToken') or 0)
+        size = int(query.get('maxResults') or default_size)
+        page = {'items': items[start:start + size]}
+        if start + size < len(items):
+            page['nextPageToken'] = str(start + size)
+        return page
+
+    def _handle_changes(self, method, query, headers, body):
+        state = self.state
+        start = int(query.get('startChangeId') or 1)
+        changes = [c for c in state.changes if int(c['id']) >= start]
+        if query.get('includeDeleted') == 'false':
+            changes = [c for c in changes if not c['deleted']]
+        page = self._page(changes, query, 100)
+        page['kind'] = 'drive#changeList'
+        page['largestChangeId'] = str(state.largest_change_id)
+        return self._json(200, page)
+
+    def _handle_files(self, method, query, headers, body):
+        state = self.state
+        if method == 'POST':
+            return self._json(200, state.create(self._load(body)))
+        if method != 'GET':
+            return self._error(400, 'Unsupported method')
+        match = compile_query(query.get('q'))
+        items = [f for file_id, f in sorted(state.files.items())
+                 if file_id != 'root' and match(f)]
+        page = self._page(items, query, 100)
+        page['kind'] = 'drive#fileList'
+        return self._json(200, page)
+
+    def _handle_file(self, method, query, headers, body, file_id):
+        state = self.state
+        resource = state.files[file_id]
+        if method == 'GET':
+            if query.get('alt') == 'media':
+                return self._download(file_id, headers)
+            if headers.get('If-None-Match') == resource.get('etag'):
+                return 304, {'ETag': resource['etag']}, b''
+            return self._json(200, resource)
+        if method == 'DELETE':
+            state.delete(file_id)
+            return 204, {}, b''
+        if method in ('PUT', 'PATCH', 'UPDATE'):
+            return self._json(200, state.update(file_id, self._load(body)))
+        return self._error(400, 'Unsupported method')
+
+    def _download(self, file_id, headers):
+        content = self.state.contents[file_id]
+        ranged = re.match(r'^bytes=(\d+)-(\d*)$', headers.get('Range', ''))
+        if not ranged:
+            return 200, {'Content-Type': 'application/octet-stream'}, content
+        first = int(ranged.group(1))
+        last = int(ranged.group(2)) if ranged.group(2) else len(content) - 1
+        last = min(last, len(content) - 1)
+        if first > last:
+            return self._error(416)
+        return 206, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Range': 'bytes {0}-{1}/{2}'.format(first, last,
+                                                        len(content)),
+        }, content[first:last + 1]
+
+    def _handle_copy(self, method, query, headers, body, file_id):
+        state = self.state
+        source = state.files[file_id]
+        meta = dict((k, v) for k, v in source.items()
+                    if k in ('title', 'mimeType', 'parents', 'description'))
+        meta.update(self._load(body))
+        return self._json(200, state.create(meta, state.contents.get(file_id)))
+
+    def _handle_trash(self, method, query, headers, body, file_id, action):
+        return self._json(200, self.state.update(
+            file_id, {'labels': {'trashed': action == 'trash'}}))
+
+    def _handle_permissions(self, method, query, headers, body, file_id):
+        permissions = self.state.permissions[file_id]
+        if method == 'GET':
+            return self._json(200, {'kind': 'drive#permissionList',
+                                    'items': permissions})
+        perm = self._load(body)
+        if perm.get('type') in ('user', 'group') and \
+                '@' not in perm.get('value', ''):
+            # what Drive answers for an unknown account
+            return self._error(500)
+        perm.update({'kind': 'drive#permission',
+                     'id': 'perm-{0}'.format(uuid.uuid4().hex[:12])})
+        permissions.append(perm)
+        return self._json(200, perm)
+
+    def _handle_permission(self, method, query, headers, body, file_id,
+                           perm_id):
+        permissions = self.state.permissions[file_id]
+        for perm in permissions:
+            if perm['id'] == perm_id:
+                break
+        else:
+            return self._error(404, 'Permission not found')
+        if method == 'DELETE':
+            permissions.remove(perm)
+            return 204, {}, b''
+        return self._json(200, perm)
+
+    def _handle_upload(self, method, query, headers, body, file_id=None):
+        state = self.state
+        upload_type = query.get('uploadType', 'media')
+        if file_id is not None:
+            resource = state.files[file_id]
+            etag = headers.get('If-Match')
+            if etag and etag != resource.get('etag'):
+                return self._error(412)
+        if upload_type == 'media':
+            if file_id is None:
+                return self._json(200, state.create({}, body))
+            state.set_content(file_id, body)
+            return self._json(200, resource)
+        if upload_type == 'multipart':
+            meta, content = self._parse_related(
+                headers.get('Content-Type', ''), body)
+            if file_id is None:
+                return self._json(200, state.create(meta, content))
+            state.update(file_id, meta)
+            state.set_content(file_id, content)
+            return self._json(200, resource)
+        if upload_type == 'resumable':
+            session_id = uuid.uuid4().hex
+            state.sessions[session_id] = {
+                'meta': self._load(body), 'file_id': file_id,
+                'data': b'', 'result': None}
+            return 200, {
+                'Location': '{0}/upload/session/{1}'.format(state.base_url,
+                                                            session_id)}, b''
+        return self._error(400, 'Unknown uploadType')
+
+    def _parse_related(self, content_type, body):
+        match = re.search(r'boundary="?([^";]+)"?', content_type)
+        if not match:
+            raise ValueError('No boundary')
+        delimiter = b'--' + match.group(1).encode('ascii')
+        parts = []
+        for part in body.split(delimiter)[1:]:
+            if part.startswith(b'--'):
+                break
+            _, _, content = part.partition(b'\r\n\r\n')
+            if content.endswith(b'\r\n'):
+                content = content[:-2]
+            parts.append(content)
+        if len(parts) != 2:
+            raise ValueError('Expected metadata and media parts')
+        return json.loads(parts[0].decode('utf-8')), parts[1]
+
+    def _handle_session(self, method, query, headers, body, session_id):
+        state = self.state
+        session = state.sessions[session_id]
+        if session['result'] is not None:
+            return self._json(200, session['result'])
+        content_range = headers.get('Content-Range')
+        total = None
+        if content_range:
+            match = re.match(r'^bytes (\*|(\d+)-(\d+))/(\d+|\*)$',
+                             content_range)
+            if not match:
+                raise ValueError('Bad Content-Range')
+            if match.group(4) != '*':
+                total = int(match.group(4))
+            if match.group(2) is not None:
+                first = int(match.group(2))
+                if first > len(session['data']):
+                    return self._incomplete(session)  # a gap, resend
+                session['data'] = session['data'][:first] + body
+        else:
+            session['data'] = body
+            total = len(body)
+        if total is None or len(session['data']) < total:
+            return self._incomplete(session)
+        if session['file_id'] is None:
+            resource = state.create(session['meta'], session['data'])
+        else:
+            if session['meta']:
+                state.update(session['file_id'], session['meta'])
+            state.set_content(session['file_id'], session['data'])
+            resource = state.files[session['file_id']]
+        session['result'] = dict(resource)
+        session['data'] = b''
+        return self._json(200, session['result'])
+
+    def _incomplete(self, session):
+        headers = {}
+        if session['data']:
+            headers['Range'] = 'bytes=0-{0}'.format(len(session['data']) - 1)
+        return 308, headers, b''
+
+    def _handle_batch(self, method, query, headers, body):
+        match = re.search(r'boundary="?([^";]+)"?',
+                          headers.get('Content-Type', ''))
+        if not match:
+            raise ValueError('No boundary')
+        boundary = match.group(1)
+        text = body.decode('utf-8').replace('\r\n', '\n')
+        out = []
+        for part in text.split('--' + boundary):
+            part = part.strip('\n')
+            if not part or part.startswith('--'):
+                continue
+            head, _, http = part.partition('\n\n')
+            content_id = ''
+            for line in head.split('\n'):
+                key, _, value = line.partition(':')
+                if key.strip().lower() == 'content-id':
+                    content_id = value.strip().strip('<>')
+            request_line, _, rest = http.partition('\n')
+            _, _, payload = rest.partition('\n\n')
+            sub_method, sub_path = request_line.split()[:2]
+            status, _, content = self.handle(
+                sub_method, sub_path, {}, payload.strip('\n').encode('utf-8'))
+            out.extend([
+                '--' + boundary,
+                'Content-Type: application/http',
+                'Content-ID: <response-{0}>'.format(content_id),
+                '',
+                'HTTP/1.1 {0} {1}'.format(
+                    status, _Handler.responses.get(status, ('',))[0]),
+                'Content-Type: application/json; charset=UTF-8',
+                '',
+                content.decode('utf-8'),
+            ])
+        out.extend(['--' + boundary + '--', ''])
+        return 200, {'Content-Type': 'multipart/mixed; boundary={0}'.format(
+            boundary)}, '\r\n'.join(out).encode('utf-8')
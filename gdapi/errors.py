@@ -12,8 +12,8 @@ class GoogleApiError(Exception):
 
     def __str__(self):
         keys = {}
-        for k, v in self.__dict__.iteritems():
-            if isinstance(v, unicode):
+        for k, v in self.__dict__.items():
+            if sys.version_info[0] < 3 and isinstance(v, unicode):
                 v = v.encode(sys.getfilesystemencoding())
             keys[k] = v
         return str(self.default_message % keys)
@@ -32,3 +32,10 @@ class EmailInvalidError(GoogleApiError):
     """Catch permission insert's 500 status code"""
     def __init__(self, *args, **kwargs):
         super(EmailInvalidError, self).__init__(*args, **kwargs)
+
+
+class RetryLimitError(GoogleApiError):
+    """Retries given up before running out of tries, because the deadline
+    of the call passed or the retry budget of the client is spent"""
+    def __init__(self, *args, **kwargs):
+        super(RetryLimitError, self).__init__(*args, **kwargs)
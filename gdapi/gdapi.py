@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
+import os
 import logging
 import json
+import threading
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
+import requests
 from .apirequest import APIRequest
+from .batch import BatchRequest
+from .cache import LRUCache
+from .changes import Change, ChangeCursor
+from .index import FingerprintIndex
+from .errors import GoogleApiError, EmailInvalidError
+from .utils import pwrite, preallocate, atomic_write_json, md5sum
 
 
 class GDAPI(object):
@@ -9,34 +20,295 @@ class GDAPI(object):
 
     _ITEM_TYPE_FOLDER = 'application/vnd.google-apps.folder'
     _ITEM_TYPE_FILE = 'application/octet-stream'
+    _DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+    _PARTIAL_SUFFIX = '.gdapi-partial'
+    _MULTIPART_THRESHOLD = 5 * 1024 * 1024
+    # what download_file reads of the file meta, whatever the defaults
+    _DOWNLOAD_FIELDS = 'id,downloadUrl,fileSize,md5Checksum,etag'
+    # partial response per call site, see the default_fields argument
+    _DEFAULT_FIELDS = {
+        'create_folder': 'id',
+        'find_child': 'items(id,mimeType)',
+        'list_children': 'id,title,fileSize,md5Checksum',
+        'unshare': 'items(id,role)',
+    }
 
     def __init__(self,
-                 credential_path=None):
+                 credential_path=None,
+                 multipart_threshold=None,
+                 meta_cache_size=0,
+                 meta_cache_ttl=60,
+                 folder_cache_size=1024,
+                 folder_cache_ttl=600,
+                 index_path=None,
+                 default_fields=None,
+                 **kwargs):
         """
         :param credential_path:
             Authentication file to use.
         :type credential_path:
             `unicode`
+
+        :param multipart_threshold:
+            (Optional) Files up to this size are uploaded by
+            :meth:`create_file` in one multipart request instead of a
+            resumable session. Defaults to 5 MiB.
+        :type multipart_threshold:
+            `int`
+
+        :param meta_cache_size:
+            (Optional) Keep up to this many file metas from
+            :meth:`get_file_meta`. Disabled if 0.
+        :type meta_cache_size:
+            `int`
+
+        :param meta_cache_ttl:
+            (Optional) Seconds a cached file meta is used as is. After
+            that it is revalidated with its etag.
+        :type meta_cache_ttl:
+            `float`
+
+        :param folder_cache_size:
+            (Optional) Remember up to this many (parent id, title) to
+            folder id lookups. Disabled if 0.
+        :type folder_cache_size:
+            `int`
+
+        :param folder_cache_ttl:
+            (Optional) Seconds a folder lookup is trusted, in case the
+            folder is changed by someone else.
+        :type folder_cache_ttl:
+            `float`
+
+        :param index_path:
+            (Optional) SQLite file of the local fingerprint index. When
+            set, uploads of files whose MD5 matches the remote
+            md5Checksum are skipped, and local files are only hashed
+            again when their size or mtime changed.
+        :type index_path:
+            `unicode`
+
+        :param default_fields:
+            (Optional) Partial response to ask for when a method is
+            called without ``fields``, by method name, e.g.
+            ``{'get_file_meta': 'id,title,etag'}``. A None value asks for
+            the whole resource.
+        :type default_fields:
+            `dict`
+
+        :param kwargs:
+            Connection options passed to :class:`APIRequest`, e.g.
+            ``pool_maxsize`` or ``keep_alive``.
+        :type kwargs:
+            `dict`
         """
         self._logger = logging.getLogger(u"gdapi.%s" % self.__class__.__name__)
-        self._googleapi = APIRequest(credential_path)
+        self._googleapi = APIRequest(credential_path, **kwargs)
+        if multipart_threshold is not None:
+            self._MULTIPART_THRESHOLD = multipart_threshold
+        self._meta_cache = None
+        if meta_cache_size:
+            self._meta_cache = LRUCache(meta_cache_size, meta_cache_ttl)
+        self._folder_cache = None
+        if folder_cache_size:
+            self._folder_cache = LRUCache(folder_cache_size,
+                                          folder_cache_ttl)
+        self._folder_lock = threading.Lock()
+        self._index = None
+        if index_path is not None:
+            self._index = FingerprintIndex(index_path)
+        self._default_fields = dict(self._DEFAULT_FIELDS)
+        self._default_fields.update(default_fields or {})
+        self._change_cursor = None
+        if credential_path is not None:
+            self._change_cursor = ChangeCursor(credential_path + '.changes')
+
+    def close(self):
+        """Close the pooled connections of the underlying API client."""
+        self._googleapi.close()
+        if self._index is not None:
+            self._index.close()
+
+    @property
+    def metrics(self):
+        """The :class:`gdapi.metrics.MetricsRegistry` of the client."""
+        return self._googleapi.metrics
 
-    def about(self):
+    def _fields_param(self, site, fields, params=None, wrap=u'{0}'):
+        """Returns params with the partial response of a call site.
+
+        :param fields:
+            Fields asked by the caller, the default of site if None.
+        :type fields:
+            `unicode`
+
+        :param wrap:
+            Format of the ``fields`` parameter, e.g. ``items({0})`` for
+            the fields of each item of a list.
+        :type wrap:
+            `unicode`
+        """
+        if fields is None:
+            fields = self._default_fields.get(site)
+        if not fields:
+            return params
+        params = dict(params or {})
+        params['fields'] = wrap.format(fields)
+        return params
+
+    def _meta_fields(self, site, fields, required):
+        """Returns the fields of an internal lookup at site: the whole
+        resource unless the caller or the default of site selects some,
+        plus the required ones. Never None, so the defaults of the
+        methods called do not apply."""
+        params = self._fields_param(site, fields)
+        if not params:
+            return u''  # the whole resource
+        return u'{0},{1}'.format(params['fields'], required)
+
+    def _local_md5(self, file_path):
+        if self._index is not None:
+            return self._index.md5(file_path)
+        return md5sum(file_path)
+
+    def new_batch(self):
+        """Returns a :class:`BatchRequest` collecting calls to be sent
+        through the batch endpoint."""
+        return BatchRequest(self._googleapi)
+
+    def about(self, fields=None):
         status_code, about = self._googleapi.api_request(
             'GET',
             '/drive/v2/about',
+            params=self._fields_param('about', fields),
         )
         return about
 
-    def get_file_meta(self, file_id):
+    def get_start_change_id(self):
+        """Returns the change id the next change will have."""
+        return int(self.about()['largestChangeId']) + 1
+
+    def iter_changes(self, start_change_id=None, max_results=1000,
+                     include_deleted=True, save_cursor=True, fields=None):
+        """Yields the changes since the saved cursor, page by page.
+
+        The cursor is saved next to the credential file after each page
+        has been consumed, so an interrupted sync repeats at most one
+        page. Without a saved cursor the feed starts from now.
+
+        :param start_change_id:
+            (Optional) Start from this change id instead of the saved
+            cursor.
+        :type start_change_id:
+            `int`
+
+        :param max_results:
+            (Optional) Page size.
+        :type max_results:
+            `int`
+
+        :param include_deleted:
+            (Optional) Also yield removed files.
+        :type include_deleted:
+            `boolean`
+
+        :param save_cursor:
+            (Optional) Save where to continue next time.
+        :type save_cursor:
+            `boolean`
+
+        :param fields:
+            (Optional) Fields of each change resource, e.g.
+            ``'id,fileId,deleted,file(id,title)'``.
+        :type fields:
+            `unicode`
+
+        :returns:
+            Iterator of :class:`gdapi.changes.Change`.
+        :rtype:
+            `generator`
+        :raises: GoogleApiError.
+        """
+        cursor = {}
+        if start_change_id is not None:
+            cursor = {'startChangeId': start_change_id}
+        elif self._change_cursor is not None:
+            cursor = self._change_cursor.load()
+        if not cursor:
+            cursor = {'startChangeId': self.get_start_change_id()}
+        while True:
+            param = {
+                'maxResults': max_results,
+                'includeDeleted': 'true' if include_deleted else 'false',
+            }
+            if cursor.get('pageToken'):
+                param['pageToken'] = cursor['pageToken']
+            else:
+                param['startChangeId'] = cursor['startChangeId']
+            param = self._fields_param(
+                'iter_changes', fields, param,
+                u'nextPageToken,largestChangeId,items({0})')
+            status_code, changes = self._googleapi.api_request(
+                'GET',
+                '/drive/v2/changes',
+                params=param,
+            )
+            if status_code != 200 or not isinstance(changes, dict):
+                raise GoogleApiError(code=status_code, message=changes)
+            for item in changes.get('items', []):
+                yield Change.from_resource(item)
+            page_token = changes.get('nextPageToken')
+            if page_token:
+                cursor = {'pageToken': page_token}
+            else:
+                cursor = {
+                    'startChangeId': int(changes['largestChangeId']) + 1}
+            if save_cursor and self._change_cursor is not None:
+                self._change_cursor.save(cursor)
+            if not page_token:
+                break
+
+    def get_file_meta(self, file_id, fields=None):
         self._logger.debug(file_id)
+        params = self._fields_param('get_file_meta', fields)
+        if self._meta_cache is None:
+            status_code, drive_file = self._googleapi.api_request(
+                'GET',
+                '/drive/v2/files/{0}'.format(file_id),
+                params=params,
+            )
+            return drive_file
+        # partial metas are cached apart from the whole one
+        key = file_id if not params else (file_id, params['fields'])
+        cached, fresh = self._meta_cache.lookup(key)
+        if fresh:
+            return dict(cached)
+        headers = None
+        if cached is not None and cached.get('etag'):
+            headers = {'If-None-Match': cached['etag']}
         status_code, drive_file = self._googleapi.api_request(
             'GET',
             '/drive/v2/files/{0}'.format(file_id),
+            params=params,
+            headers=headers,
         )
+        if status_code == 304:  # not modified
+            self._meta_cache.set(key, cached)
+            return dict(cached)
+        if status_code == 200 and isinstance(drive_file, dict):
+            self._meta_cache.set(key, drive_file)
+            return dict(drive_file)
+        self._meta_cache.pop(key)
         return drive_file
 
-    def copy_file(self, file_id):
+    def _invalidate_meta(self, file_id):
+        """Forget the cached meta of a file we just changed."""
+        if self._meta_cache is not None:
+            self._meta_cache.discard(
+                lambda key, value: key == file_id or
+                (isinstance(key, tuple) and key[0] == file_id))
+
+    def copy_file(self, file_id, fields=None):
         """Copy a file.
 
         :param file_id:
@@ -44,6 +316,11 @@ class GDAPI(object):
         :type file_id:
             `unicode`
 
+        :param fields:
+            (Optional) Fields of the copy to return, e.g. ``'id,title'``.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -52,7 +329,8 @@ class GDAPI(object):
         try:
             status_code, drive_file = self._googleapi.api_request(
                 'POST',
-                '/drive/v2/files/{0}/copy'.format(file_id))
+                '/drive/v2/files/{0}/copy'.format(file_id),
+                params=self._fields_param('copy_file', fields))
             self._logger.debug("COPY result: {0}".format(
                 drive_file))
         except Exception as error:
@@ -61,7 +339,9 @@ class GDAPI(object):
         return drive_file
 
     def create_file(self, parent_id, file_path, title,
-                    description=None, mime_type=None):
+                    description=None, mime_type=None,
+                    chunk_size=None, state_path=None, upload_type=None,
+                    fields=None):
         """Upload a file.
 
         :param parent_id:
@@ -89,6 +369,30 @@ class GDAPI(object):
         :type mime_type:
             `unicode`
 
+        :param chunk_size:
+            (Optional) Upload in chunks of this many bytes, a multiple of
+            256 KiB.
+        :type chunk_size:
+            `int`
+
+        :param state_path:
+            (Optional) With chunk_size, file to save the upload progress
+            to, so a later call resumes an interrupted upload.
+        :type state_path:
+            `unicode`
+
+        :param upload_type:
+            (Optional) 'multipart' or 'resumable'. By default files up to
+            the multipart threshold are sent in one multipart request.
+        :type upload_type:
+            `str`
+
+        :param fields:
+            (Optional) Fields of the created file to return, e.g.
+            ``'id,md5Checksum'``.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -107,11 +411,21 @@ class GDAPI(object):
             body.update({'description': description})
         self._logger.debug(json.dumps(body))
 
-#        return self._googleapi.multipart_file_upload(
+        if upload_type is None:
+            upload_type = 'resumable'
+            if (chunk_size is None and not hasattr(file_path, 'read') and
+                    os.path.getsize(file_path) <= self._MULTIPART_THRESHOLD):
+                upload_type = 'multipart'
+        params = self._fields_param('create_file', fields)
+        fields = params['fields'] if params else None
+        if upload_type == 'multipart':
+            return self._googleapi.multipart_file_upload(
+                file_path, body, fields=fields)
         return self._googleapi.resumable_file_upload(
-            file_path, body)
+            file_path, body, chunk_size=chunk_size, state_path=state_path,
+            fields=fields)
 
-    def create_folder(self, parent_id, title):
+    def create_folder(self, parent_id, title, fields=None):
         """Create a folder. If the same title already exists, just
         return the id of that folder.
 
@@ -125,6 +439,12 @@ class GDAPI(object):
         :type title:
             `unicode`.
 
+        :param fields:
+            (Optional) Fields of the created folder to ask for, which
+            must include ``id``.
+        :type fields:
+            `unicode`
+
         :returns:
             Folder id None if failed.
         :rtype:
@@ -132,37 +452,142 @@ class GDAPI(object):
         """
         self._logger.debug(u"Create folder {0} "
                            "under folder {1}".format(title, parent_id))
+        folder_id = self._find_child(parent_id, title)
+        if folder_id is not None:
+            return folder_id
+        # avoid two threads creating the same folder twice
+        with self._folder_lock:
+            if self._folder_cache is not None:
+                # created by another thread meanwhile
+                folder_id = self._folder_cache.get((parent_id, title))
+                if folder_id is not None:
+                    return folder_id
+            body = {
+                'title': title,
+                'parents': [{'id': parent_id}],  # gd allow multi-parent
+                'mimeType': self._ITEM_TYPE_FOLDER,
+            }
+            self._logger.debug(json.dumps(body))
+
+            status_code, drive_file = self._googleapi.api_request(
+                'POST',
+                '/drive/v2/files',
+                params=self._fields_param('create_folder', fields),
+                data=body,
+            )
+            folder_id = drive_file.get('id', None)
+            if folder_id is not None and self._folder_cache is not None:
+                self._folder_cache.set((parent_id, title), folder_id)
+        return folder_id
+
+    def _escape_query(self, value):
+        return value.replace(u"\\", u"\\\\").replace(u"'", u"\\'")
+
+    def _find_child(self, parent_id, title, folder=True):
+        """Returns the id of the item titled title under parent_id, or
+        None. Folders found are remembered in the folder cache.
+
+        :param folder:
+            Only look for a folder.
+        :type folder:
+            `boolean`
+        """
+        if self._folder_cache is not None:
+            folder_id = self._folder_cache.get((parent_id, title))
+            if folder_id is not None:
+                return folder_id
+        query = u"trashed=false and title='{0}' and '{1}' in parents".format(
+            self._escape_query(title), parent_id)
+        if folder:
+            query += u" and mimeType='{0}'".format(self._ITEM_TYPE_FOLDER)
         param = {
-            'q': u"trashed=false and title='{0}' and "
-            "'{1}' in parents and mimeType='{2}'".format(
-                title, parent_id, self._ITEM_TYPE_FOLDER),
+            'q': query,
             'maxResults': 1,  # only query top 1
         }
-        status_code, folders = self._googleapi.api_request(
+        status_code, files = self._googleapi.api_request(
             'GET',
             '/drive/v2/files',
-            params=param,
+            params=self._fields_param('find_child', None, param),
         )
-        if not folders.get('items', []):
-            # no such folder
-            pass
-        else:
-            return folders['items'][0]['id']
-        body = {
-            'title': title,
-            'parents': [{'id': parent_id}],  # gd allow multi-parent
-            'mimeType': self._ITEM_TYPE_FOLDER,
-        }
-        self._logger.debug(json.dumps(body))
+        try:
+            item = files['items'][0]
+        except (TypeError, KeyError, IndexError):
+            return None
+        if (self._folder_cache is not None and
+                (folder or item.get('mimeType') == self._ITEM_TYPE_FOLDER)):
+            self._folder_cache.set((parent_id, title), item['id'])
+        return item['id']
 
-        status_code, drive_file = self._googleapi.api_request(
-            'POST',
-            '/drive/v2/files',
-            data=body,
-        )
-        return drive_file.get('id', None)
+    def _forget_folder(self, file_id):
+        """Forget the cached lookups of a folder we just removed, and of
+        everything under it at any depth."""
+        if self._folder_cache is None:
+            return
+        removed = set([file_id])
+        while True:
+            under = set(value for key, value in self._folder_cache.items()
+                        if key[0] in removed) - removed
+            if not under:
+                break
+            removed |= under
+        self._folder_cache.discard(
+            lambda key, value: value in removed or key[0] in removed)
+
+    def resolve_path(self, path, root_id='root'):
+        """Returns the id of the file or folder at path.
+
+        :param path:
+            Slash separated titles, e.g. ``/a/b/c``.
+        :type path:
+            `unicode`
+
+        :param root_id:
+            (Optional) The id of the folder path starts from.
+        :type root_id:
+            `unicode`
+
+        :returns:
+            The id, or None if some level does not exist.
+        :rtype:
+            `unicode`
+        """
+        titles = [title for title in path.split(u'/') if title]
+        item_id = root_id
+        for index, title in enumerate(titles):
+            last = index == len(titles) - 1
+            item_id = self._find_child(item_id, title, folder=not last)
+            if item_id is None:
+                return None
+        return item_id
+
+    def makedirs(self, path, parent_id='root'):
+        """Create the folders of path that do not exist yet, like
+        ``mkdir -p``.
+
+        :param path:
+            Slash separated folder titles, e.g. ``a/b/c``.
+        :type path:
+            `unicode`
+
+        :param parent_id:
+            (Optional) The id of the folder path starts from.
+        :type parent_id:
+            `unicode`
+
+        :returns:
+            The id of the last folder, or None if failed.
+        :rtype:
+            `unicode`
+        """
+        folder_id = parent_id
+        for title in [title for title in path.split(u'/') if title]:
+            folder_id = self.create_folder(folder_id, title)
+            if folder_id is None:
+                return None
+        return folder_id
 
-    def create_meta_file(self, parent_id, title, description=None):
+    def create_meta_file(self, parent_id, title, description=None,
+                         fields=None):
         """Create a meta-only file.
 
         :param parent_id:
@@ -180,6 +605,11 @@ class GDAPI(object):
         :type description:
             `unicode`
 
+        :param fields:
+            (Optional) Fields of the created file to return.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -198,18 +628,27 @@ class GDAPI(object):
         status_code, drive_file = self._googleapi.api_request(
             'POST',
             '/drive/v2/files',
+            params=self._fields_param('create_meta_file', fields),
             data=body,
         )
         return drive_file
 
     def create_or_update_file(self, parent_id, file_path, title,
-                              description=None, etag=None):
-        """Upload new file or update file."""
+                              description=None, etag=None,
+                              chunk_size=None, state_path=None, fields=None):
+        """Upload new file or update file. fields selects the fields of
+        the file to return, see :meth:`create_file`."""
         param = {
             'q': u"trashed=false and title='{0}' and "
             "'{1}' in parents".format(title, parent_id),
             'maxResults': 1,  # only query top 1
         }
+        # the id is needed for the index
+        fields = self._meta_fields('create_or_update_file', fields, 'id')
+        if fields:
+            # the lookup also needs what decides to skip the upload
+            param['fields'] = u'items({0},md5Checksum,description)'.format(
+                fields)
         status_code, files = self._googleapi.api_request(
             'GET',
             '/drive/v2/files',
@@ -217,10 +656,128 @@ class GDAPI(object):
         )
         if not files.get('items', []):
             # no such file
-            return self.create_file(parent_id, file_path, title, description)
+            drive_file = self.create_file(parent_id, file_path, title,
+                                          description,
+                                          chunk_size=chunk_size,
+                                          state_path=state_path,
+                                          fields=fields)
+        else:
+            remote = files['items'][0]
+            if (self._index is not None and
+                    remote.get('md5Checksum') and
+                    description in (None, remote.get('description')) and
+                    self._index.md5(file_path) == remote['md5Checksum']):
+                self._logger.debug(u"Skip unchanged file {0}".format(
+                    file_path))
+                self._index.set_file_id(file_path, remote['id'])
+                return remote
+            drive_file = self.update_file(remote['id'], file_path,
+                                          description, etag,
+                                          chunk_size=chunk_size,
+                                          state_path=state_path,
+                                          fields=fields)
+        if self._index is not None and isinstance(drive_file, dict) \
+                and drive_file.get('id'):
+            self._index.set_file_id(file_path, drive_file['id'])
+        return drive_file
+
+    def _list_children(self, folder_id):
+        """Returns the files (not folders) directly under folder_id,
+        keyed by title."""
+        query = u"trashed=false and '{0}' in parents and " \
+            u"mimeType!='{1}'".format(folder_id, self._ITEM_TYPE_FOLDER)
+        children = {}
+        for item in self.iter_files(
+                query, fields=self._default_fields.get('list_children')):
+            children.setdefault(item['title'], item)
+        return children
+
+    def _upload_tree_file(self, folder_id, local_path, title, remote):
+        """Upload one file of upload_tree unless remote has the same
+        content. Returns the action taken and the bytes sent."""
+        size = os.path.getsize(local_path)
+        if remote is not None:
+            if (int(remote.get('fileSize', -1)) == size and
+                    remote.get('md5Checksum') == self._local_md5(local_path)):
+                return 'skipped', 0
+            drive_file = self.update_file(remote['id'], local_path)
         else:
-            return self.update_file(files['items'][0]['id'], file_path,
-                                    description, etag)
+            drive_file = self.create_file(folder_id, local_path, title)
+        if not drive_file:
+            return 'failed', 0
+        return 'uploaded', size
+
+    def upload_tree(self, local_dir, parent_id='root', workers=4):
+        """Mirror a local directory under a Drive folder.
+
+        The folder structure is created first, then files are uploaded
+        on a worker pool. Files whose remote copy has the same size and
+        md5Checksum are skipped.
+
+        :param local_dir:
+            The local directory to upload.
+        :type local_dir:
+            `unicode`
+
+        :param parent_id:
+            (Optional) The id of the folder to upload into.
+        :type parent_id:
+            `unicode`
+
+        :param workers:
+            (Optional) Number of files uploaded at the same time.
+        :type workers:
+            `int`
+
+        :returns:
+            Summary with ``files_uploaded``, ``files_skipped``,
+            ``files_failed``, ``folders``, ``bytes_uploaded`` and
+            ``elapsed`` seconds.
+        :rtype:
+            `dict`
+        """
+        start = timer()
+        summary = {
+            'files_uploaded': 0,
+            'files_skipped': 0,
+            'files_failed': 0,
+            'folders': 0,
+            'bytes_uploaded': 0,
+        }
+        local_dir = os.path.abspath(local_dir)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for dirpath, dirnames, filenames in os.walk(local_dir):
+                dirnames.sort()
+                relpath = os.path.relpath(dirpath, local_dir)
+                if relpath == os.curdir:
+                    folder_id = parent_id
+                else:
+                    folder_id = self.makedirs(
+                        relpath.replace(os.sep, u'/'), parent_id)
+                    summary['folders'] += 1
+                if folder_id is None:
+                    self._logger.error(u"Cannot create folder for "
+                                       u"{0}".format(dirpath))
+                    summary['files_failed'] += len(filenames)
+                    del dirnames[:]  # nothing to put the subfolders in
+                    continue
+                remote = self._list_children(folder_id)
+                for filename in sorted(filenames):
+                    futures.append(pool.submit(
+                        self._upload_tree_file, folder_id,
+                        os.path.join(dirpath, filename), filename,
+                        remote.get(filename)))
+            for future in futures:
+                try:
+                    action, size = future.result()
+                except Exception as error:
+                    self._logger.exception(error)
+                    action, size = 'failed', 0
+                summary['files_' + action] += 1
+                summary['bytes_uploaded'] += size
+        summary['elapsed'] = timer() - start
+        return summary
 
     def delete_file(self, file_id):
         """Permanently remove the file.
@@ -240,11 +797,14 @@ class GDAPI(object):
         status_code, drive_file = self._googleapi.api_request(
             'DELETE',
             '/drive/v2/files/{0}'.format(file_id))
+        self._invalidate_meta(file_id)
+        self._forget_folder(file_id)
         if status_code != 204:  # no content
             return False
         return True
 
-    def download_file(self, file_id, file_path):
+    def download_file(self, file_id, file_path, workers=1, part_size=None,
+                      resume=False, fields=None):
         """Download a file.
 
         :param file_id:
@@ -257,6 +817,31 @@ class GDAPI(object):
         :type file_path:
             `unicode`.
 
+        :param workers:
+            (Optional) Fetch byte ranges of the file over this many
+            connections at the same time. Keep it within the
+            ``pool_maxsize`` of the client.
+        :type workers:
+            `int`
+
+        :param part_size:
+            (Optional) Size of each byte range in parallel mode.
+        :type part_size:
+            `int`
+
+        :param resume:
+            (Optional) Continue a partial file left by an interrupted
+            download, if the remote file has not changed since. Only
+            used by the single connection mode.
+        :type resume:
+            `boolean`
+
+        :param fields:
+            (Optional) Fields of the file meta to return. The ones the
+            download needs are always asked for.
+        :type fields:
+            `unicode`
+
         :returns:
             The file meta, or None if failed.
         :rtype:
@@ -264,24 +849,172 @@ class GDAPI(object):
         """
         self._logger.debug(u"Download file {0} to {1}".format(
             file_id, file_path))
-        drive_file = self.get_file_meta(file_id)
+        drive_file = self.get_file_meta(file_id, fields=self._meta_fields(
+            'download_file', fields, self._DOWNLOAD_FIELDS))
         if drive_file is None:
             return None
         if drive_file.get('downloadUrl', None) is None:
             self._logger.error("File has no download url: {0}"
                                "".format(drive_file))
             return None
+        size = int(drive_file.get('fileSize', 0))
+        part_size = part_size or self._DOWNLOAD_PART_SIZE
+        if workers > 1 and size > part_size:
+            done = self._download_ranges(drive_file['downloadUrl'],
+                                         file_path, size, workers,
+                                         part_size)
+            if done:
+                return drive_file
+            if done is False:
+                return None
+            # the server does not serve ranges: in one stream then
+        offset = 0
+        # media as is: compressing it gains little, and Range offsets and
+        # the bytes written must both refer to the stored content
+        headers = {'Accept-Encoding': 'identity'}
+        if resume:
+            partial_path = file_path + self._PARTIAL_SUFFIX
+            offset = self._partial_offset(drive_file, file_path,
+                                          partial_path)
+            if offset and offset == size:
+                os.unlink(partial_path)
+                return drive_file
+            if offset:
+                self._logger.debug(u"Resume download at {0}".format(offset))
+                headers['Range'] = 'bytes={0}-'.format(offset)
+            else:
+                atomic_write_json(partial_path, {
+                    'id': drive_file.get('id'),
+                    'md5Checksum': drive_file.get('md5Checksum'),
+                    'etag': drive_file.get('etag'),
+                })
         status_code, resp = self._googleapi.api_request(
-            'GET', drive_file['downloadUrl'], stream=True)
-        if self._googleapi.error['code'] == 200:
-            with open(file_path, 'wb') as f:
-                while True:
-                    data = resp.raw.read(8192)
-                    if not data:
-                        break
+            'GET', drive_file['downloadUrl'], stream=True, headers=headers)
+        if status_code == 200 or (offset and status_code == 206):
+            # a 200 means the server sent the whole file anyway
+            with open(file_path, 'ab' if status_code == 206 else 'wb') as f:
+                # decoded once, should the server compress anyway
+                for data in resp.iter_content(65536):
                     f.write(data)
+            if resume:
+                os.unlink(partial_path)
         return drive_file
 
+    def _partial_offset(self, drive_file, file_path, partial_path):
+        """Returns the size of the partial file if it was downloaded from
+        the same remote content, 0 otherwise."""
+        if not (os.path.isfile(file_path) and os.path.isfile(partial_path)):
+            return 0
+        try:
+            with open(partial_path, 'r') as fin:
+                partial = json.load(fin)
+        except ValueError:
+            return 0
+        if partial.get('id') != drive_file.get('id'):
+            return 0
+        # md5Checksum identifies the content; etag also changes with meta
+        for key in ('md5Checksum', 'etag'):
+            if drive_file.get(key):
+                if partial.get(key) != drive_file[key]:
+                    self._logger.debug(u"Remote file changed, restart "
+                                       u"download of {0}".format(file_path))
+                    return 0
+                break
+        else:
+            return 0
+        offset = os.path.getsize(file_path)
+        if offset > int(drive_file.get('fileSize', 0)):
+            return 0
+        return offset
+
+    def _range_request(self, url, start, end):
+        """Returns the status code and the unread response of a request
+        of bytes start..end of url."""
+        result = self._googleapi.api_request(
+            'GET', url, stream=True, headers={
+                'Range': 'bytes={0}-{1}'.format(start, end),
+                'Accept-Encoding': 'identity',
+            })
+        if not result:  # out of tries
+            raise GoogleApiError(
+                message='Range request failed: {0}'.format(url))
+        return result
+
+    def _download_range(self, url, fd, start, end, tries=3, first=None):
+        """Write bytes start..end of url at the same offset of fd. A
+        broken transfer resumes from the last byte written. first is the
+        response of the first request, if already made."""
+        offset = start
+        while offset <= end:
+            if first is not None:
+                (status_code, resp), first = first, None
+            else:
+                status_code, resp = self._range_request(url, offset, end)
+            if status_code != 206:  # partial content
+                raise GoogleApiError(
+                    code=status_code,
+                    message='Range request failed: {0}'.format(url))
+            try:
+                for data in resp.iter_content(65536):
+                    pwrite(fd, data, offset)
+                    offset += len(data)
+            except requests.RequestException as error:
+                self._logger.debug(u'Range %d-%d broken at %d: %r',
+                                   start, end, offset, error)
+            finally:
+                resp.close()
+            if offset <= end:
+                tries -= 1
+                if tries < 1:
+                    raise GoogleApiError(
+                        code=status_code,
+                        message='Incomplete range {0}-{1}'.format(
+                            start, end))
+        return end - start + 1
+
+    def _download_ranges(self, url, file_path, size, workers, part_size):
+        """Fetch url into file_path as byte ranges on a worker pool.
+
+        :returns:
+            If success, None if the server does not serve ranges. The
+            file is removed unless success.
+        :rtype:
+            `boolean`
+        """
+        ranges = [(start, min(start + part_size, size) - 1)
+                  for start in range(0, size, part_size)]
+        self._logger.debug(u"Download {0} bytes in {1} ranges".format(
+            size, len(ranges)))
+        fd = None
+        try:
+            first = self._range_request(url, *ranges[0])
+            if first[0] == 200:  # the whole file, Range was ignored
+                first[1].close()
+                self._logger.debug(u"No ranges served for {0}".format(url))
+                return None
+            fd = os.open(file_path,
+                         os.O_WRONLY | os.O_CREAT |
+                         getattr(os, 'O_BINARY', 0), 0o666)
+            preallocate(fd, size)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self._download_range, url, fd,
+                                       start, end,
+                                       first=first if n == 0 else None)
+                           for n, (start, end) in enumerate(ranges)]
+                for future in futures:
+                    future.result()
+        except (GoogleApiError, requests.RequestException,
+                EnvironmentError) as error:
+            self._logger.exception(error)
+            if fd is not None:
+                os.close(fd)
+                # zero-filled gaps must not pass for content, e.g. on
+                # resume
+                os.unlink(file_path)
+            return False
+        os.close(fd)
+        return True
+
     def request(self, method, url):
         """https://docs.google.com/feeds/default/private/full"""
         status_code, resp = self._googleapi.api_request(
@@ -290,7 +1023,7 @@ class GDAPI(object):
         self._logger.debug(resp)
         return resp
 
-    def trash_file(self, file_id):
+    def trash_file(self, file_id, fields=None):
         """Trash a file.
 
         :param file_id:
@@ -298,6 +1031,11 @@ class GDAPI(object):
         :type file_id:
             `unicode`
 
+        :param fields:
+            (Optional) Fields of the trashed file to return.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -310,7 +1048,10 @@ class GDAPI(object):
             status_code, drive_file = self._googleapi.api_request(
                 'UPDATE',
                 '/drive/v2/files/{0}'.format(file_id),
+                params=self._fields_param('trash_file', fields),
                 data=body)
+            self._invalidate_meta(file_id)
+            self._forget_folder(file_id)
             self._logger.debug("Trash result: {0}".format(
                 drive_file))
         except Exception as error:
@@ -318,7 +1059,8 @@ class GDAPI(object):
             drive_file = None
         return drive_file
 
-    def update_file(self, file_id, file_path, description=None, etag=None):
+    def update_file(self, file_id, file_path, description=None, etag=None,
+                    chunk_size=None, state_path=None, fields=None):
         """Upload a file.
 
         :param file_id:
@@ -341,6 +1083,23 @@ class GDAPI(object):
         :type etag:
             `unicode`
 
+        :param chunk_size:
+            (Optional) Upload in chunks of this many bytes, a multiple of
+            256 KiB.
+        :type chunk_size:
+            `int`
+
+        :param state_path:
+            (Optional) With chunk_size, file to save the upload progress
+            to, so a later call resumes an interrupted upload.
+        :type state_path:
+            `unicode`
+
+        :param fields:
+            (Optional) Fields of the updated file to return.
+        :type fields:
+            `unicode`
+
         :returns:
             Response from the API call.
         :rtype:
@@ -352,13 +1111,21 @@ class GDAPI(object):
             body = {'description': description}
         else:
             body = None
-        return self._googleapi.resumable_file_update(
-            file_id, file_path, body=body, etag=etag)
+        try:
+            params = self._fields_param('update_file', fields)
+            return self._googleapi.resumable_file_update(
+                file_id, file_path, body=body, etag=etag,
+                chunk_size=chunk_size, state_path=state_path,
+                fields=params['fields'] if params else None)
+        finally:
+            self._invalidate_meta(file_id)
 
     def unshare(self, resource_id, perm_id=None):
         """grab all perm and unshare all, except owner, anyone.
-        If perm_id specified, remove that perm."""
-        perms = self.query_permission(resource_id)
+        If perm_id specified, remove that perm. Returns False if a
+        permission could not be removed."""
+        perms = self.query_permission(
+            resource_id, fields=self._default_fields.get('unshare'))
         if not perms:
             return False
         perm_ids = [x['id'] for x in perms]
@@ -371,42 +1138,59 @@ class GDAPI(object):
                         resource_id, perm_id))
                 return True
             return False
-        for perm in perms:
-            if perm['role'] == u'owner' or perm['role'] == u'anyone':
-                continue
-            status_code, _ = self._googleapi.api_request(
-                'DELETE', '/drive/v2/files/{0}/permissions/{1}'.format(
-                    resource_id, perm['id']))
-        return True
+        calls = [
+            ('DELETE', '/drive/v2/files/{0}/permissions/{1}'.format(
+                resource_id, perm['id']), None, None)
+            for perm in perms
+            if perm['role'] != u'owner' and perm['role'] != u'anyone'
+        ]
+        unshared = True
+        if calls:
+            results = self._googleapi.batch_request(calls)
+            for (_, url, _, _), (status_code, _) in zip(calls, results):
+                # already removed permissions are fine
+                if status_code is None or (
+                        self._googleapi._is_failed_status_code(status_code)
+                        and status_code != 404):
+                    self._logger.warning(u'Failed to remove %s: %s', url,
+                                         status_code)
+                    unshared = False
+        return unshared
 
-    def make_domain_writer_for_file(self, file_id, domain, with_link=True):
+    def make_domain_writer_for_file(self, file_id, domain, with_link=True,
+                                    fields=None):
         """The api for share file/folder with domain"""
         return self._make_role_for_file(
-            file_id, 'domain', domain, 'writer')
+            file_id, 'domain', domain, 'writer', fields=fields)
 
-    def make_domain_reader_for_file(self, file_id, domain, with_link=True):
+    def make_domain_reader_for_file(self, file_id, domain, with_link=True,
+                                    fields=None):
         """The api for share file/folder with domain"""
         return self._make_role_for_file(
-            file_id, 'domain', domain, 'reader', with_link)
+            file_id, 'domain', domain, 'reader', with_link, fields)
 
-    def make_public_reader_for_file(self, file_id, with_link=True):
+    def make_public_reader_for_file(self, file_id, with_link=True,
+                                    fields=None):
         """The api for share file/folder public"""
         return self._make_role_for_file(
-            file_id, 'anyone', 'N/A', 'reader', with_link)
+            file_id, 'anyone', 'N/A', 'reader', with_link, fields)
 
-    def make_user_writer_for_file(self, file_id, user_email):
+    def make_user_writer_for_file(self, file_id, user_email, fields=None):
         """The api for share file/folder"""
         return self._make_role_for_file(
-            file_id, 'user', user_email, 'writer')
+            file_id, 'user', user_email, 'writer', fields=fields)
 
-    def make_user_reader_for_file(self, file_id, user_email, with_link=True):
+    def make_user_reader_for_file(self, file_id, user_email, with_link=True,
+                                  fields=None):
         """The api for share file/folder"""
         return self._make_role_for_file(
-            file_id, 'user', user_email, 'reader', with_link)
+            file_id, 'user', user_email, 'reader', with_link, fields)
 
     def _make_role_for_file(self, file_id,
                             perm_type, value, role,
-                            with_link=False):
+                            with_link=False, fields=None):
+        """Insert a permission. fields selects the partial response,
+        the ``make_role_for_file`` default if None."""
         self._logger.debug(u"Make file {0} {3} {2} by value {1}"
                            "".format(file_id, value, role, perm_type))
         data = {
@@ -416,16 +1200,23 @@ class GDAPI(object):
         }
         if perm_type in ['domain', 'anyone']:
             data.update({'withLink': with_link})
-        status_code, perm = self._googleapi.api_request(
-            'POST',
-            '/drive/v2/files/{0}/permissions'.format(file_id),
-            params={'sendNotificationEmails': 'false'},
-            data=data,
-        )
+        try:
+            # a server error here means an invalid account, do not retry
+            status_code, perm = self._googleapi._api_call(
+                'POST',
+                '/drive/v2/files/{0}/permissions'.format(file_id),
+                params=self._fields_param(
+                    'make_role_for_file', fields,
+                    {'sendNotificationEmails': 'false'}),
+                data=data,
+            )
+        except requests.ConnectionError:
+            raise EmailInvalidError(code=500,
+                                    message='Server Error or Invalid account')
         self._logger.debug(perm)
         return perm
 
-    def query_permission(self, resource_id):
+    def query_permission(self, resource_id, fields=None):
         """Returns the permission list item for the Resource.
 
         :param resource_id:
@@ -433,6 +1224,12 @@ class GDAPI(object):
         :type resource_id:
             `unicode`
 
+        :param fields:
+            (Optional) Fields of the permission list to return, e.g.
+            ``'items(id,role)'``.
+        :type fields:
+            `unicode`
+
         :returns:
             List of permission resource (folder).
         :rtype:
@@ -442,6 +1239,7 @@ class GDAPI(object):
         status_code, perms = self._googleapi.api_request(
             'GET',
             '/drive/v2/files/{0}/permissions'.format(resource_id),
+            params=self._fields_param('query_permission', fields),
         )
         self._logger.debug(perms)
         try:
@@ -449,7 +1247,81 @@ class GDAPI(object):
         except AttributeError:
             return []
 
-    def query_title(self, title, isSharedWithMe=False):
+    def _list_page(self, params, page_token=None):
+        """Returns one page of a file listing."""
+        if page_token:
+            params = dict(params, pageToken=page_token)
+        status_code, files = self._googleapi.api_request(
+            'GET',
+            '/drive/v2/files',
+            params=params,
+        )
+        if not isinstance(files, dict) or \
+                self._googleapi._is_failed_status_code(status_code):
+            raise GoogleApiError(code=status_code, message=files)
+        return files
+
+    def iter_files(self, q=None, page_size=1000, fields=None,
+                   prefetch=True):
+        """Yields the file resources matching a query, page by page. The
+        next page is fetched in the background while the caller handles
+        the current one.
+
+        >>> for item in api.iter_files("trashed=false", fields='id,title'):
+        ...     print(item['title'])
+
+        :param q:
+            (Optional) The search query, every file if None.
+        :type q:
+            `unicode`
+
+        :param page_size:
+            Files per page, at most 1000.
+        :type page_size:
+            `int`
+
+        :param fields:
+            (Optional) Fields of each file resource to return, e.g.
+            ``'id,title'``. All of them if None.
+        :type fields:
+            `unicode`
+
+        :param prefetch:
+            If fetch the next page while the current one is consumed.
+        :type prefetch:
+            `boolean`
+
+        :returns:
+            Generator of file resources.
+        :rtype:
+            `generator`
+        """
+        params = {'maxResults': page_size}
+        if q:
+            params['q'] = q
+        params = self._fields_param('iter_files', fields, params,
+                                    u'nextPageToken,items({0})')
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = self._list_page(params)
+            while True:
+                page_token = page.get('nextPageToken')
+                future = None
+                if page_token and pool is not None:
+                    future = pool.submit(self._list_page, params, page_token)
+                for item in page.get('items', []):
+                    yield item
+                if not page_token:
+                    break
+                if future is not None:
+                    page = future.result()
+                else:
+                    page = self._list_page(params, page_token)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False)
+
+    def query_title(self, title, isSharedWithMe=False, fields=None):
         """Returns the file list item for specified title.
 
         :param title:
@@ -462,39 +1334,29 @@ class GDAPI(object):
         :type isSharedWithMe:
             `boolean`
 
+        :param fields:
+            (Optional) Fields of each file resource to return.
+        :type fields:
+            `unicode`
+
         :returns:
             List of file resource.
         :rtype:
             `list`
         """
         self._logger.debug('Query title {0}'.format(title))
-        page_token = None
+        title = title.replace(u"'", u"\\'")
+        query_string = u"trashed=false and title='{0}'".format(title)
+        if isSharedWithMe:
+            query_string = u' '.join([query_string, u"and sharedWithMe"])
         result = []
-        while True:
-            try:
-                title = title.replace(u"'", u"\\'")
-                query_string = u"trashed=false and title='{0}'".format(
-                    title)
-                if isSharedWithMe:
-                    query_string = u' '.join([query_string,
-                                              u"and sharedWithMe"])
-                param = {
-                    'q': query_string
-                }
-                if page_token:
-                    param['pageToken'] = page_token
-                status_code, files = self._googleapi.api_request(
-                    'GET',
-                    '/drive/v2/files',
-                    params=param,
-                )
-                result.extend(files['items'])
-                page_token = files.get('nextPageToken')
-                if not page_token:
-                    break
-            except Exception as error:
-                self._logger.exception(error)
-                break
+        try:
+            if fields is None:
+                fields = self._default_fields.get('query_title')
+            for item in self.iter_files(query_string, fields=fields):
+                result.append(item)
+        except Exception as error:
+            self._logger.exception(error)
         return result
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Local fingerprint index, to avoid hashing and uploading unchanged
+files again."""
+import os
+import sqlite3
+import threading
+from .utils import md5sum
+
+
+class FingerprintIndex(object):
+    """SQLite table mapping a local path and its (size, mtime) to the
+    MD5 of its content and the Drive file id it was uploaded to."""
+
+    def __init__(self, path):
+        """
+        :param path:
+            The SQLite database file, created if missing.
+        :type path:
+            `unicode`
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprint ('
+                ' path TEXT PRIMARY KEY,'
+                ' size INTEGER NOT NULL,'
+                ' mtime REAL NOT NULL,'
+                ' md5 TEXT NOT NULL,'
+                ' file_id TEXT)')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, local_path):
+        """Returns ``(md5, file_id)`` recorded for local_path if the file
+        size and mtime did not change since, ``(None, None)`` otherwise.
+        """
+        local_path = os.path.abspath(local_path)
+        stat = os.stat(local_path)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime, md5, file_id FROM fingerprint '
+                'WHERE path = ?', (local_path,)).fetchone()
+        if row is None or row[0] != stat.st_size or \
+                row[1] != stat.st_mtime:
+            return None, None
+        return row[2], row[3]
+
+    def md5(self, local_path):
+        """Returns the MD5 of local_path, hashing it only if its size or
+        mtime changed since the last time."""
+        md5, _ = self.lookup(local_path)
+        if md5 is not None:
+            return md5
+        local_path = os.path.abspath(local_path)
+        stat = os.stat(local_path)
+        md5 = md5sum(local_path)
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO fingerprint '
+                    '(path, size, mtime, md5, file_id) VALUES (?, ?, ?, ?, '
+                    '(SELECT file_id FROM fingerprint WHERE path = ?))',
+                    (local_path, stat.st_size, stat.st_mtime, md5,
+                     local_path))
+        return md5
+
+    def set_file_id(self, local_path, file_id):
+        """Record the Drive file id local_path was uploaded to."""
+        md5 = self.md5(local_path)
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'UPDATE fingerprint SET file_id = ? '
+                    'WHERE path = ? AND md5 = ?',
+                    (file_id, os.path.abspath(local_path), md5))
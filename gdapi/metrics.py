@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Request metrics of a client."""
+import re
+import threading
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+# path segments followed by the id of an item of that collection
+_COLLECTIONS = frozenset(['files', 'permissions', 'children', 'parents',
+                          'revisions', 'comments', 'replies', 'properties',
+                          'changes', 'apps', 'teamdrives', 'drives'])
+
+
+def endpoint_of(url):
+    """Returns the path of url with item ids replaced by ``{id}``, so
+    calls to the same endpoint share their metrics.
+
+    >>> endpoint_of('https://www.googleapis.com/drive/v2/files/abc/copy')
+    '/drive/v2/files/{id}/copy'
+    """
+    parts = urlsplit(url)
+    if parts.netloc.endswith('googleusercontent.com'):
+        return 'download'  # signed, one of a kind URLs of the content
+    segments = parts.path.split('/')
+    for index in range(1, len(segments)):
+        if segments[index - 1] in _COLLECTIONS and segments[index] and \
+                segments[index] not in _COLLECTIONS:
+            segments[index] = '{id}'
+    return '/'.join(segments) or '/'
+
+
+class Histogram(object):
+    """Cumulative histogram, as in the Prometheus exposition format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """Returns count, sum, and the cumulative count per upper bound
+        (``'+Inf'`` for the last one)."""
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+
+class _EndpointStats(object):
+
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = {}
+
+
+class MetricsRegistry(object):
+    """Thread-safe request metrics of a client: latency histogram, bytes
+    sent and received and status codes per endpoint, and counters such as
+    retries and token refreshes.
+
+    Bytes received are those of the decoded bodies, as the caller reads
+    them, so compression does not change them.
+
+    >>> api = APIRequest(path)
+    >>> api.metrics.snapshot()['counters']['retries']
+    >>> print(prometheus_text(api.metrics))
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._counters = {}
+
+    def observe_request(self, method, url, status, seconds,
+                        request_bytes=0, response_bytes=0):
+        """Record one HTTP request.
+
+        :param status:
+            The status code, or ``'error'`` if no response came.
+        :type status:
+            `int`
+        """
+        key = (method, endpoint_of(url))
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = _EndpointStats(self._buckets)
+            stats.latency.observe(seconds)
+            stats.request_bytes += request_bytes or 0
+            stats.response_bytes += response_bytes or 0
+            status = str(status)
+            stats.status[status] = stats.status.get(status, 0) + 1
+
+    def incr(self, name, value=1, **labels):
+        """Add value to the counter name with the given labels."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counter = self._counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def snapshot(self):
+        """Returns a copy of the metrics::
+
+            {'requests': {(method, endpoint): {
+                 'latency': {'count': .., 'sum': .., 'buckets': [..]},
+                 'request_bytes': .., 'response_bytes': ..,
+                 'status': {'200': ..}}},
+             'counters': {name: {((label, value), ..): count}}}
+        """
+        with self._lock:
+            return {
+                'requests': dict(
+                    (key, {
+                        'latency': stats.latency.snapshot(),
+                        'request_bytes': stats.request_bytes,
+                        'response_bytes': stats.response_bytes,
+                        'status': dict(stats.status),
+                    }) for key, stats in self._endpoints.items()),
+                'counters': dict((name, dict(counter)) for name, counter
+                                 in self._counters.items()),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._counters.clear()
+
+
+def _escape(value):
+    return re.sub(r'(["\\])', r'\\\1', str(value)).replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def prometheus_text(registry, prefix='gdapi'):
+    """Returns the metrics of registry in the Prometheus text exposition
+    format.
+
+    :param registry:
+        The metrics to export.
+    :type registry:
+        :class:`MetricsRegistry`
+
+    :param prefix:
+        Prefix of every metric name.
+    :type prefix:
+        `unicode`
+    """
+    snap = registry.snapshot()
+    requests = sorted(snap['requests'].items())
+    lines = []
+
+    name = prefix + '_request_duration_seconds'
+    lines.append('# HELP {0} Latency of the HTTP requests.'.format(name))
+    lines.append('# TYPE {0} histogram'.format(name))
+    for (method, endpoint), stats in requests:
+        labels = [('method', method), ('endpoint', endpoint)]
+        latency = stats['latency']
+        for bound, count in latency['buckets']:
+            le = bound if bound == '+Inf' else _number(float(bound))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _labels(labels + [('le', le)]), count))
+        lines.append('{0}_sum{1} {2}'.format(name, _labels(labels),
+                                             _number(latency['sum'])))
+        lines.append('{0}_count{1} {2}'.format(name, _labels(labels),
+                                               latency['count']))
+
+    name = prefix + '_requests_total'
+    lines.append('# HELP {0} HTTP requests by status code.'.format(name))
+    lines.append('# TYPE {0} counter'.format(name))
+    for (method, endpoint), stats in requests:
+        for status, count in sorted(stats['status'].items()):
+            lines.append('{0}{1} {2}'.format(name, _labels([
+                ('method', method), ('endpoint', endpoint),
+                ('status', status)]), count))
+
+    for key, help_text in [('request_bytes', 'Bytes sent in bodies.'),
+                           ('response_bytes',
+                            'Bytes received in decoded bodies.')]:
+        name = '{0}_{1}_total'.format(prefix, key)
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} counter'.format(name))
+        for (method, endpoint), stats in requests:
+            lines.append('{0}{1} {2}'.format(name, _labels([
+                ('method', method), ('endpoint', endpoint)]), stats[key]))
+
+    for counter, values in sorted(snap['counters'].items()):
+        name = '{0}_{1}_total'.format(prefix, counter)
+        lines.append('# TYPE {0} counter'.format(name))
+        for labels, value in sorted(values.items()):
+            lines.append('{0}{1} {2}'.format(name, _labels(labels),
+                                             _number(value)))
+    return '\n'.join(lines) + '\n'
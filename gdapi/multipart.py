@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Streaming ``multipart/related`` body for one-request uploads."""
+import os
+import json
+import uuid
+
+
+class MultipartRelatedStream(object):
+    """File-like body made of the JSON metadata part and the raw media
+    part. The media is read from the file as the body is sent, so memory
+    use does not depend on the file size.
+
+    >>> with open(path, 'rb') as f:
+    ...     stream = MultipartRelatedStream({'title': 'a'}, f)
+    ...     requests.post(url, data=stream, headers={
+    ...         'content-type': stream.content_type})
+    """
+
+    def __init__(self, body, fp, mime_type=None, boundary=None,
+                 chunk_size=65536):
+        """
+        :param body:
+            The file metadata.
+        :type body:
+            `dict`
+
+        :param fp:
+            The media, read from its current position to the end.
+        :type fp:
+            `file object`
+
+        :param mime_type:
+            (Optional) Content type of the media part.
+        :type mime_type:
+            `unicode`
+        """
+        if boundary is None:
+            boundary = 'gdapi_{0}'.format(uuid.uuid4().hex)
+        if mime_type is None:
+            mime_type = body.get('mimeType', 'application/octet-stream')
+        self.boundary = boundary
+        self.content_type = 'multipart/related; boundary="{0}"'.format(
+            boundary)
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._head = '\r\n'.join([
+            '--' + boundary,
+            'Content-Type: application/json; charset=UTF-8',
+            '',
+            json.dumps(body),
+            '--' + boundary,
+            'Content-Type: {0}'.format(mime_type),
+            '',
+            '',
+        ]).encode('utf-8')
+        self._tail = '\r\n--{0}--\r\n'.format(boundary).encode('utf-8')
+        start = fp.tell()
+        fp.seek(0, os.SEEK_END)
+        self._media_size = fp.tell() - start
+        fp.seek(start)
+        self._parts = [self._head, None, self._tail]  # None is the media
+        self._remaining = self._media_size
+
+    def __len__(self):
+        return len(self._head) + self._media_size + len(self._tail)
+
+    def read(self, size=-1):
+        """Returns up to size bytes of the body, all of it if size < 0."""
+        result = []
+        while self._parts and (size < 0 or size > 0):
+            part = self._parts[0]
+            if part is None:
+                want = self._remaining if size < 0 else min(size,
+                                                            self._remaining)
+                data = self._fp.read(want) if want else b''
+                self._remaining -= len(data)
+                if not data:
+                    if self._remaining:
+                        raise IOError('media ended before {0} bytes'.format(
+                            self._media_size))
+                    self._parts.pop(0)
+                    continue
+            else:
+                data = part if size < 0 else part[:size]
+                if len(data) == len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[len(data):]
+            result.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(result)
+
+    def __iter__(self):
+        while True:
+            data = self.read(self._chunk_size)
+            if not data:
+                break
+            yield data
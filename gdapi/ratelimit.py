@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Client-side rate limiting."""
+import threading
+from time import sleep
+try:
+    from time import monotonic
+except ImportError:  # 2.*
+    from time import time as monotonic
+
+
+class RateLimiter(object):
+    """Token bucket shared by every thread of a client.
+
+    The rate adapts to the quota (AIMD): it is multiplied by ``decrease``
+    when the server throttles us, at most once per ``cooldown`` seconds,
+    and raised by ``increase`` after every successful call, up to the
+    configured rate.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=None, increase=None,
+                 decrease=0.5, cooldown=1.0):
+        """
+        :param rate:
+            Maximum requests per second.
+        :type rate:
+            `float`
+
+        :param burst:
+            (Optional) Requests allowed back to back, ``max(1, rate)`` by
+            default.
+        :type burst:
+            `float`
+
+        :param min_rate:
+            (Optional) The rate never goes below this, ``rate / 20`` by
+            default.
+        :type min_rate:
+            `float`
+
+        :param increase:
+            (Optional) Requests per second added after each success,
+            ``rate / 100`` by default.
+        :type increase:
+            `float`
+        """
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.burst = float(burst or max(1.0, self.max_rate))
+        self.min_rate = float(min_rate or self.max_rate / 20)
+        self.increase = float(increase or self.max_rate / 100)
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._stamp = monotonic()
+        self._throttled_at = None
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket and returns how many seconds to
+        wait before using them."""
+        with self._lock:
+            self._refill(monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available. Returns the seconds waited."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def throttled(self):
+        """The server rejected a call for exceeding the quota."""
+        with self._lock:
+            now = monotonic()
+            if self._throttled_at is not None and \
+                    now - self._throttled_at < self.cooldown:
+                return
+            self._throttled_at = now
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def succeeded(self):
+        """A call went through."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(monotonic())
+                self.rate = min(self.max_rate, self.rate + self.increase)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Record the HTTP traffic of a client, and play it back against a local
+stand-in server to reproduce a production load pattern offline.
+
+>>> api = GDAPI(path, recorder=TrafficRecorder('traffic.ndjson'))
+>>> ...
+>>> with ReplayServer(load_traffic('traffic.ndjson')) as server:
+...     client = APIRequest(path, api_url=server.url)
+...     print(replay(server.entries, client, speed=10, concurrency=16))
+"""
+import json
+import threading
+from time import sleep
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from .emulator import DriveEmulator
+from .benchmark import percentile
+try:
+    from urlparse import urlsplit, urljoin
+except ImportError:  # 3.*
+    from urllib.parse import urlsplit, urljoin
+
+REPLAY_HEADER = 'X-Gdapi-Replay'
+
+
+class TrafficRecorder(object):
+    """Append one JSON line per HTTP request of a client: when it
+    started, method, URL with its query, status (``'error'`` if no
+    response came), bytes sent and received, seconds taken, the phase
+    timings if the client collects them, and the thread.
+
+    Headers and bodies are not recorded, but URLs hold file ids and
+    search queries.
+    """
+
+    def __init__(self, path_or_file):
+        """
+        :param path_or_file:
+            File to append to, or a file object open for writing text.
+        :type path_or_file:
+            `unicode` or `file object`
+        """
+        self._own = not hasattr(path_or_file, 'write')
+        self._file = open(path_or_file, 'a') if self._own else path_or_file
+        self._lock = threading.Lock()
+
+    def record(self, started, method, url, status, elapsed, request_bytes=0,
+               response_bytes=0, params=None, timing=None):
+        """Write one request.
+
+        :param started:
+            Epoch seconds when the request was sent.
+        :type started:
+            `float`
+
+        :param params:
+            (Optional) Query parameters not yet part of url.
+        :type params:
+            `dict`
+
+        :param timing:
+            (Optional) The phase timings of the request.
+        :type timing:
+            :class:`gdapi.timing.RequestTiming`
+        """
+        if params:
+            url = requests.Request(method, url, params=params).prepare().url
+        entry = {
+            'ts': started,
+            'method': method,
+            'url': url,
+            'status': status,
+            'elapsed': elapsed,
+            'request_bytes': request_bytes,
+            'response_bytes': response_bytes,
+            'thread': threading.current_thread().name,
+        }
+        if timing is not None:
+            entry['timing'] = dict(
+                (key, value) for key, value in timing.as_dict().items()
+                if key not in ('method', 'url', 'status'))
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        if self._own:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_traffic(path):
+    """Returns the recorded requests of an NDJSON log, in the order they
+    were sent."""
+    entries = []
+    with open(path, 'r') as fin:
+        for line in fin:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
+
+
+class ReplayServer(DriveEmulator):
+    """Stand-in server answering each replayed request with the status
+    and the response size that were recorded for it. Requests without
+    the replay header get the emulator's answers."""
+
+    def __init__(self, entries, server_delay=True, **kwargs):
+        """
+        :param entries:
+            The recorded requests, see :func:`load_traffic`.
+        :type entries:
+            `list`
+
+        :param server_delay:
+            Wait the recorded time to first byte before answering, when
+            the recording has it.
+        :type server_delay:
+            `boolean`
+        """
+        super(ReplayServer, self).__init__(**kwargs)
+        self.entries = entries
+        self.server_delay = server_delay
+
+    def handle(self, method, path, headers, body):
+        index = headers.get(REPLAY_HEADER)
+        if index is None:
+            return super(ReplayServer, self).handle(method, path, headers,
+                                                    body)
+        entry = self.entries[int(index)]
+        if self.server_delay and entry.get('timing'):
+            sleep(entry['timing'].get('ttfb') or 0)
+        status = entry['status']
+        if status == 'error':  # no response was recorded
+            status = 503
+        # a JSON body of the recorded size
+        size = max(0, int(entry.get('response_bytes') or 0) - 14)
+        content = u'{{"padding":"{0}"}}'.format(u'x' * size).encode('utf-8')
+        self._count('replay', status)
+        if status in (204, 304):
+            content = b''
+        return status, {'Content-Type': 'application/json'}, content
+
+
+def _replay_url(base_url, url):
+    parts = urlsplit(url)
+    path = parts.path
+    if parts.query:
+        path += '?' + parts.query
+    return urljoin(base_url, path)
+
+
+def replay(entries, api, speed=1.0, concurrency=8, progress=None):
+    """Send the recorded requests again through api, at the recorded
+    pace sped up by speed, from up to concurrency threads. Each recorded
+    attempt is sent once, retries included, so nothing is retried.
+
+    :param api:
+        Client whose ``api_url`` is a :class:`ReplayServer` serving the
+        same entries.
+    :type api:
+        :class:`gdapi.apirequest.APIRequest`
+
+    :param speed:
+        How many times faster than recorded, 0 for as fast as possible.
+    :type speed:
+        `float`
+
+    :param progress:
+        (Optional) Called with the index, the status and the seconds of
+        each replayed request.
+    :type progress:
+        `callable`
+
+    :returns:
+        Summary of the replay: ``sent``, ``status`` counts, ``errors``,
+        ``seconds``, ``requests_per_second``, ``latency`` p50 and p99,
+        and ``max_lag``, how late the most delayed request was sent.
+    :rtype:
+        `dict`
+    """
+    base_url = api._API_URL
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    lags = [0.0]
+
+    def send(index, due):
+        entry = entries[index]
+        lag = timer() - due
+        headers = dict(api._default_headers)
+        headers[REPLAY_HEADER] = str(index)
+        data = None
+        if entry.get('request_bytes'):
+            data = b'\0' * entry['request_bytes']
+        start = timer()
+        try:
+            resp = api._api_request(
+                entry['method'], _replay_url(base_url, entry['url']),
+                headers=headers, data=data, stream=True)
+            for _ in resp.iter_content(65536):
+                pass
+            status = resp.status_code
+        except requests.RequestException:
+            status = 'error'
+        elapsed = timer() - start
+        with lock:
+            latencies.append(elapsed)
+            key = str(status)
+            statuses[key] = statuses.get(key, 0) + 1
+            lags[0] = max(lags[0], lag)
+        if progress is not None:
+            progress(index, status, elapsed)
+
+    start = timer()
+    if entries:
+        first = entries[0]['ts']
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for index, entry in enumerate(entries):
+                due = start
+                if speed:
+                    due += (entry['ts'] - first) / float(speed)
+                wait = due - timer()
+                if wait > 0:
+                    sleep(wait)
+                pool.submit(send, index, due)
+    seconds = timer() - start
+    return {
+        'sent': len(latencies),
+        'status': statuses,
+        'errors': statuses.get('error', 0),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'latency': {'p50': percentile(latencies, 0.5),
+                    'p99': percentile(latencies, 0.99)},
+        'max_lag': lags[0],
+    }
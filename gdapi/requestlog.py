@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Request log lines that cost nothing unless they are emitted."""
+import json
+
+REDACTED = '<redacted>'
+# headers and form or query fields carrying credentials
+SECRET_HEADERS = frozenset(['authorization', 'proxy-authorization', 'cookie',
+                            'set-cookie'])
+SECRET_FIELDS = frozenset(['access_token', 'refresh_token', 'client_secret',
+                           'code', 'password'])
+
+
+def redact_headers(headers):
+    """Returns a copy of headers without the credentials."""
+    if not headers:
+        return headers
+    return dict((key, REDACTED if key.lower() in SECRET_HEADERS else value)
+                for key, value in headers.items())
+
+
+def redact_fields(fields):
+    """Returns a copy of a params or form dict without the credentials."""
+    if not isinstance(fields, dict):
+        return fields
+    return dict((key, REDACTED if key in SECRET_FIELDS else value)
+                for key, value in fields.items())
+
+
+def truncate(text, limit):
+    if limit is None or len(text) <= limit:
+        return text
+    return u'{0}...({1} more)'.format(text[:limit], len(text) - limit)
+
+
+def summarize_body(data, limit):
+    """Describe a request body in at most about limit characters. Streams
+    and files are named, never read.
+
+    :param limit:
+        Characters of the body to keep, None for all of it, 0 for none.
+    :type limit:
+        `int`
+    """
+    if data is None:
+        return u'-'
+    if isinstance(data, dict):
+        data = json.dumps(redact_fields(data), sort_keys=True)
+    if isinstance(data, bytes):
+        if limit == 0:
+            return u'<{0} bytes>'.format(len(data))
+        if limit is None or len(data) <= limit:
+            return repr(data)
+        return u'{0}...({1} more bytes)'.format(repr(data[:limit]),
+                                                len(data) - limit)
+    if not isinstance(data, type(u'')):
+        return u'<{0}>'.format(getattr(data, 'name', None) or
+                               type(data).__name__)
+    if limit == 0:
+        return u'<{0} chars>'.format(len(data))
+    return truncate(data, limit)
+
+
+class RequestLogMessage(object):
+    """Message of one request log line, formatted only if a handler emits
+    it. The fields are also passed to handlers as ``record.gdapi_request``
+    for structured logging, with the body left out."""
+
+    __slots__ = ('fields', 'headers', 'params', 'data', 'body_limit')
+
+    def __init__(self, method, url, status, elapsed, headers=None,
+                 params=None, data=None, body_limit=None):
+        self.fields = {'method': method, 'url': url, 'status': status,
+                       'elapsed': elapsed}
+        self.headers = headers
+        self.params = params
+        self.data = data
+        self.body_limit = body_limit
+
+    def __str__(self):
+        return u'{method} {url} {status} {elapsed:.3f}s headers {0} ' \
+            u'params {1} data {2}'.format(
+                redact_headers(self.headers), redact_fields(self.params),
+                summarize_body(self.data, self.body_limit), **self.fields)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Per-phase timing of HTTP requests, measured inside the transport."""
+import socket
+import threading
+from timeit import default_timer as timer
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+_local = threading.local()
+
+
+class RequestTiming(object):
+    """Seconds spent in each phase of one request.
+
+    ``dns``, ``connect`` (TCP) and ``tls`` are 0 when a pooled
+    connection was reused. ``send`` is writing the request, ``ttfb`` is
+    waiting for the response headers, and ``transfer`` is reading the
+    body (None if a streamed body was closed unread).
+    """
+    __slots__ = ('method', 'url', 'status', 'reused', 'dns', 'connect',
+                 'tls', 'send', 'ttfb', 'transfer', 'total', 'bytes')
+
+    def __init__(self, method=None, url=None):
+        self.method = method
+        self.url = url
+        self.status = None
+        self.reused = True
+        self.dns = self.connect = self.tls = 0.0
+        self.send = self.ttfb = 0.0
+        self.transfer = None
+        self.total = None
+        self.bytes = None
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return '<RequestTiming {0}>'.format(self.as_dict())
+
+
+def current_timing():
+    """Returns the timing being recorded in this thread, or None."""
+    return getattr(_local, 'timing', None)
+
+
+class recording(object):
+    """Record the phases of the requests made in this thread into timing.
+
+    >>> with recording(RequestTiming('GET', url)) as timing:
+    ...     session.get(url)
+    """
+
+    def __init__(self, timing):
+        self.timing = timing
+
+    def __enter__(self):
+        self._previous = current_timing()
+        _local.timing = self.timing
+        return self.timing
+
+    def __exit__(self, *exc_info):
+        _local.timing = self._previous
+
+
+class _TimedConnectionMixin(object):
+
+    def _new_conn(self):
+        timing = current_timing()
+        if timing is None:
+            return super(_TimedConnectionMixin, self)._new_conn()
+        timing.reused = False
+        host = self._dns_host
+        start = timer()
+        addresses = []
+        try:
+            # resolve apart to tell DNS from TCP connect; errors are left
+            # to the normal connect to report
+            for info in socket.getaddrinfo(host.strip('[]'), self.port,
+                                           allowed_gai_family(),
+                                           socket.SOCK_STREAM):
+                if info[4][0] not in addresses:
+                    addresses.append(info[4][0])
+        except socket.error:
+            pass
+        resolved = timer()
+        timing.dns += resolved - start
+        try:
+            if not addresses:
+                return super(_TimedConnectionMixin, self)._new_conn()
+            # every address in turn, as urllib3 does when it resolves
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super(_TimedConnectionMixin, self)._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if address == addresses[-1]:
+                        raise
+        finally:
+            self._dns_host = host
+            timing.connect += timer() - resolved
+
+    def request(self, *args, **kwargs):
+        timing = current_timing()
+        if timing is None:
+            return super(_TimedConnectionMixin, self).request(*args, **kwargs)
+        before = timing.dns + timing.connect + timing.tls
+        start = timer()
+        try:
+            return super(_TimedConnectionMixin, self).request(*args, **kwargs)
+        finally:
+            # plain HTTP connects lazily, while sending
+            timing.send += max(0.0, timer() - start -
+                               (timing.dns + timing.connect + timing.tls -
+                                before))
+
+    def getresponse(self, *args, **kwargs):
+        timing = current_timing()
+        if timing is None:
+            return super(_TimedConnectionMixin, self).getresponse(
+                *args, **kwargs)
+        start = timer()
+        try:
+            return super(_TimedConnectionMixin, self).getresponse(
+                *args, **kwargs)
+        finally:
+            timing.ttfb += timer() - start
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        timing = current_timing()
+        if timing is None:
+            return super(_TimedHTTPSConnection, self).connect()
+        before = timing.dns + timing.connect
+        start = timer()
+        try:
+            return super(_TimedHTTPSConnection, self).connect()
+        finally:
+            # what the socket setup does not explain is the handshake
+            timing.tls += max(0.0, timer() - start -
+                              (timing.dns + timing.connect - before))
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record their phases into the
+    :class:`RequestTiming` of the current thread, see :class:`recording`.
+    Requests made outside of :class:`recording` are not measured."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
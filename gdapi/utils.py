@@ -1,24 +1,204 @@
 # -*- coding: utf-8 -*-
-import sys
+import os
+import json
+import hashlib
 import logging
+import tempfile
+import threading
 from functools import wraps
 from math import floor
-from time import sleep
-from random import randint
+from time import sleep, time
+from random import randint, uniform
+from email.utils import parsedate_tz, mktime_tz
+try:
+    from time import monotonic
+except ImportError:  # 2.*
+    from time import time as monotonic
+from .errors import RetryLimitError
 
 
-def retry(ExceptionToHandle, tries, delay=3, backoff=2, logger_name=None):
-    '''Retries a function or method until it returns True.
+class RetryBudget(object):
+    """Retries allowed across every call of a client, so that an outage
+    does not turn into a retry storm.
+
+    Each first attempt earns ``ratio`` retry, and ``min_per_second``
+    retries are earned per second; each retry spends one.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._stamp = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = monotonic()
+        amount += (now - self._stamp) * self.min_per_second
+        self._stamp = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        """A first attempt was made."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Returns whether a retry is allowed, and spends it."""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """How long to wait between attempts, and when to give up.
+
+    Waits use full jitter: a random delay between 0 and
+    ``min(max_delay, delay * backoff ** n)``, or the ``Retry-After`` of
+    the response when the server sent one.
+    """
+
+    def __init__(self, tries, delay=3, backoff=2, max_delay=600,
+                 deadline=None):
+        """
+        :param tries:
+            Attempts at most, at least 0.
+        :type tries:
+            `int`
+
+        :param delay:
+            Upper bound of the first wait in seconds, greater than 0.
+        :type delay:
+            `float`
+
+        :param deadline:
+            (Optional) Give up when the next attempt would start more
+            than this many seconds after the first.
+        :type deadline:
+            `float`
+        """
+        tries = floor(tries)
+        if tries < 0:
+            raise ValueError("tries must be 0 or greater")
+        if delay <= 0:
+            raise ValueError("delay must be greater than 0")
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def wait_time(self, attempt, error=None):
+        """Seconds to wait after the failed attempt (counted from 0)."""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return uniform(0, min(self.max_delay,
+                              self.delay * self.backoff ** attempt))
+
+
+def retry_after_seconds(error):
+    """Returns the Retry-After of the response attached to error, in
+    seconds, or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, mktime_tz(parsedate_tz(value)) - time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class RetryAttempts(object):
+    """The attempts of one call of a function decorated by :func:`retry`
+    or :func:`gdapi.asyncutils.async_retry`, which only differ in how
+    they wait.
+
+    The ``_retry_budget`` (a :class:`RetryBudget`), ``_retry_deadline``
+    and ``_metrics`` attributes of owner, if set, limit the retries of
+    every call of that instance and count them.
+    """
+
+    def __init__(self, policy, owner, name, logger):
+        self._policy = policy
+        self._budget = getattr(owner, '_retry_budget', None)
+        self._limit = getattr(owner, '_retry_deadline', None) or \
+            policy.deadline
+        self._metrics = getattr(owner, '_metrics', None)
+        self._name = name
+        self._logger = logger
+        self._start = monotonic()
+        self.attempt = 0
+        if self._budget is not None:
+            self._budget.deposit()
+
+    def left(self):
+        """Returns whether another attempt may be made."""
+        return self.attempt < self._policy.tries
+
+    def failed(self, error):
+        """Returns the seconds to wait before the next attempt, or None
+        when out of tries.
+
+        :raises: RetryLimitError when the deadline or the retry budget
+            stops the retries.
+        """
+        self.attempt += 1
+        if not self.left():
+            return None
+        if 'socket.gaierror' in repr(error):  # no network
+            wait = 9.5 + randint(0, 1000) / 1000
+        else:
+            wait = self._policy.wait_time(self.attempt - 1, error)
+        reason = None
+        if self._limit is not None and \
+                monotonic() - self._start + wait > self._limit:
+            reason = 'deadline'
+        elif self._budget is not None and not self._budget.withdraw():
+            reason = 'retry budget exhausted'
+        if reason is not None:
+            self._logger.debug("Give up %s after %d tries: %s",
+                               self._name, self.attempt, reason)
+            response = getattr(error, 'response', None)
+            raise RetryLimitError(
+                code=getattr(response, 'status_code',
+                             getattr(response, 'status', None)),
+                message=u'Gave up {0} after {1} tries: {2}, last error '
+                        u'{3!r}'.format(self._name, self.attempt, reason,
+                                        error))
+        self._logger.debug("Retrying %s in %.2f seconds... %d Reason: %r",
+                           self._name, wait,
+                           self._policy.tries - self.attempt, error)
+        if self._metrics is not None:
+            self._metrics.incr('retries', function=self._name)
+        return wait
+
+
+def retry(ExceptionToHandle, tries, delay=3, backoff=2, logger_name=None,
+          deadline=None):
+    '''Retries a function or method until it returns, or returns False
+    once out of tries.
 
     delay sets the initial delay in seconds. tries must be at least 0,
-    and delay greater than 0.'''
+    and delay greater than 0. See :class:`RetryPolicy`.
 
-    tries = floor(tries)
-    if tries < 0:
-        raise ValueError("tries must be 0 or greater")
+    When decorating a method, the retries of every call of the instance
+    may be limited by its retry budget and deadline, see
+    :class:`RetryAttempts`. RetryLimitError is raised when they stop
+    the retries.
+    '''
 
-    if delay <= 0:
-        raise ValueError("delay must be greater than 0")
+    policy = RetryPolicy(tries, delay, backoff, deadline=deadline)
 
     if logger_name:
         logger = logging.getLogger(logger_name)
@@ -27,35 +207,74 @@ def retry(ExceptionToHandle, tries, delay=3, backoff=2, logger_name=None):
 
     def deco_retry(f):
         def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay  # make mutable
-
-            while mtries >= 1:
+            attempts = RetryAttempts(policy, args[0] if args else None,
+                                     f.__name__, logger)
+            while attempts.left():
                 try:
-                    return f(*args, **kwargs)  # first attempt
+                    return f(*args, **kwargs)
                 except ExceptionToHandle as e:
-                    from traceback import format_tb, extract_stack
-                    if 'socket.gaierror' in repr(e):  # no network
-                        sleep(9.5 + randint(0, 1000) / 1000)
-                        msg = "No network, retry in 10 sec"
-                        logger.debug(msg)
-                    else:
-                        msg = ("Retrying {0} in {1} seconds... "
-                               "{2} Reason: {3}, {4}".format(
-                                   f, mdelay, mtries, repr(e),
-                                   repr(format_tb(sys.exc_info()[2]))))
-                        logger.debug(msg)
-                        stack = extract_stack()
-                        last_func_before_retry = stack[-2][2]
-                        if last_func_before_retry == '_make_role_for_file':
-                            from .errors import EmailInvalidError
-                            raise EmailInvalidError(
-                                code=500,
-                                message='Server Error or Invalid account'
-                                )
-                        mtries -= 1      # consume an attempt
-                        sleep(mdelay)  # wait...
-                        mdelay = min(mdelay * backoff, 600)  # max 10 mins
+                    wait = attempts.failed(e)
+                    if wait is None:
+                        break
+                    sleep(wait)
             return False  # Ran out of tries :-(
 
         return wraps(f)(f_retry)  # true decorator -> decorated function
     return deco_retry
+
+
+def atomic_write_json(path, obj):
+    '''Write obj as JSON to path, so readers see either the old or the
+    new content but never a partial file.'''
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=dirname, prefix='.gdapi-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f, indent=2)
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, path)
+        else:  # 2.*
+            os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+_pwrite_lock = threading.Lock()
+
+
+def pwrite(fd, data, offset):
+    '''Write all of data to fd at offset without moving a shared file
+    position, so several threads can fill one file.'''
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:  # no pwrite on this platform
+            with _pwrite_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def preallocate(fd, size):
+    '''Reserve size bytes for fd, falling back to a sparse file.'''
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:  # not supported by the filesystem
+            pass
+    os.ftruncate(fd, size)
+
+
+def md5sum(path, block_size=1024 * 1024):
+    '''Returns the hex MD5 of the file at path, as Drive's md5Checksum.'''
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import os
+import sys
+import argparse
+
+path = os.getcwd()
+if path not in sys.path:
+    sys.path.append(path)
+
+from gdapi.benchmark import OPERATIONS, run_benchmarks, save_results, \
+    load_results, format_result, format_comparison
+
+
+def int_list(value):
+    return [int(x) for x in value.split(',')]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Benchmark GDAPI against a local Drive emulator.')
+    parser.add_argument('--operations', default=','.join(OPERATIONS),
+                        help='comma separated, among %(default)s')
+    parser.add_argument('--sizes', type=int_list, default=[65536, 1048576],
+                        help='file sizes in bytes')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4],
+                        help='threads per case')
+    parser.add_argument('--page-sizes', type=int_list, default=[100, 1000])
+    parser.add_argument('--ops', type=int, default=20,
+                        help='operations per case')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run the cases in this process')
+    parser.add_argument('--output', help='save the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args(argv[1:])
+
+    def progress(result):
+        print(format_result(result))
+
+    run = run_benchmarks(operations=args.operations.split(','),
+                         sizes=args.sizes, concurrency=args.concurrency,
+                         page_sizes=args.page_sizes, ops=args.ops,
+                         latency=args.latency, isolate=not args.no_isolate,
+                         progress=progress)
+    if args.output:
+        save_results(run, args.output)
+    if args.compare:
+        print('')
+        print(format_comparison(load_results(args.compare), run))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
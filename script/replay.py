@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+path = os.getcwd()
+if path not in sys.path:
+    sys.path.append(path)
+
+from gdapi.apirequest import APIRequest
+from gdapi.recorder import ReplayServer, load_traffic, replay
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=argv[0],
+        description='Play a recorded traffic log back against a local '
+        'stand-in server.')
+    parser.add_argument('log', help='NDJSON log of a TrafficRecorder')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='times faster than recorded, 0 for no pauses')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--no-server-delay', action='store_true',
+                        help='answer at once instead of after the '
+                        'recorded time to first byte')
+    args = parser.parse_args(argv[1:])
+
+    entries = load_traffic(args.log)
+    work_dir = tempfile.mkdtemp(prefix='gdapi-replay-')
+    try:
+        cred_path = os.path.join(work_dir, 'cred.json')
+        with open(cred_path, 'w') as f:
+            json.dump({'access_token': 'replay'}, f)
+        with ReplayServer(entries,
+                          server_delay=not args.no_server_delay) as server:
+            api = APIRequest(cred_path, api_url=server.url,
+                             token_url=server.token_url,
+                             pool_maxsize=max(10, args.concurrency))
+            summary = replay(entries, api, speed=args.speed,
+                             concurrency=args.concurrency)
+            api.close()
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
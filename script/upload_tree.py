@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import os
+import sys
+import logging
+
+path = os.getcwd()
+if path not in sys.path:
+    sys.path.append(path)
+
+from gdapi.gdapi import GDAPI
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.exit("Usage: {0} <dir> [parent_id]".format(argv[0]))
+    local_dir = argv[1]
+    if not os.path.isdir(local_dir):
+        sys.exit("Directory is not exist")
+    parent_id = argv[2] if len(argv) > 2 else 'root'
+
+    logger = logging.getLogger('gdapi')
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    ga = GDAPI('./cred.json')
+    print(ga.upload_tree(local_dir, parent_id))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -13,7 +13,8 @@ config = {
     'author_email': 'clsung@gmail.com',
     'version': '0.2.3',
     'test_requires': test_requirements,
-    'install_requires': ['requests'],
+    'install_requires': ['requests', 'futures; python_version < "3"'],
+    'extras_require': {'async': ['aiohttp']},
     'packages': ['gdapi'],
     'scripts': ['script/download_to_somewhere.py',
                 'script/upload_to_root.py'],
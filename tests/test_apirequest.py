@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
+import io
 import os
+import gzip
 import unittest
 from mock import patch
 # mock the retry decorator before any module loads it
-patch('gdapi.utils.retry', lambda x, y, delay: lambda z: z).start()
-from gdapi.apirequest import APIRequest
-from gdapi.errors import GoogleApiError
+with patch('gdapi.utils.retry', lambda x, y, delay: lambda z: z):
+    from gdapi.apirequest import APIRequest
+from gdapi.errors import GoogleApiError, RetryLimitError
+from gdapi.utils import retry, RetryBudget
 import requests
 import tempfile
 from testfixtures import compare, ShouldRaise
 import httpretty
 import json
+from time import sleep
 from mock import mock_open
 
 
@@ -204,13 +208,19 @@ class Test_bugfix(unittest.TestCase):
             os.close(fd)  # we use temp_path only
             self.ar.simple_media_upload(temp_path, body=body)
             m.assert_called_once_with(temp_path, 'rb')
-            expected = [call('POST', 'https://www.googleapis.com/upload/drive/v2/files',
+            expected = [call('POST', 'https://www.googleapis.com/upload'
+                                     '/drive/v2/files',
                              params={'uploadType': 'media'},
-                             headers=ANY, verify=False, data=m()),
-                        call('PUT', 'https://www.googleapis.com/drive/v2/files/abc',
-                            headers=ANY,
-                             verify=False, data=json.dumps(body)),]
+                             headers=ANY, verify=False, data=m(),
+                             files=None, stream=None),
+                        call('PUT',
+                             'https://www.googleapis.com/drive/v2/files/abc',
+                             params=None, headers=ANY,
+                             verify=False, data=json.dumps(body),
+                             files=None, stream=None)]
             mock_sess.assert_has_calls(expected)
+        compare(['POST', 'PUT'], sorted(
+            method for method, _ in self.ar.metrics.snapshot()['requests']))
 
     @patch.object(requests.Session, 'request')
     @patch('requests.Response')
@@ -267,3 +277,632 @@ class Test_bugfix(unittest.TestCase):
         mock_sess.assert_called_with(
             'PUT', 'https://hello.content/object2', params=None,
             files=None, headers=None, stream=None, verify=False, data=f)
+
+
+class Test_session(unittest.TestCase):
+    """Test the pooled session shared by every call"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.temp_path = temp_path
+
+    def test_pool_options(self):
+        ar = APIRequest(self.temp_path, pool_connections=3, pool_maxsize=7)
+        adapter = ar._session.get_adapter('https://www.googleapis.com/')
+        compare(3, adapter._pool_connections)
+        compare(7, adapter._pool_maxsize)
+        compare('keep-alive', ar._session.headers['Connection'])
+        ar = APIRequest(self.temp_path, keep_alive=False)
+        compare('close', ar._session.headers['Connection'])
+
+    def test_gzip_negotiation(self):
+        ar = APIRequest(self.temp_path)
+        compare('gzip', ar._session.headers['Accept-Encoding'])
+        compare(True, '(gzip)' in ar._session.headers['User-Agent'])
+        ar = APIRequest(self.temp_path, compress=False)
+        compare('identity', ar._session.headers['Accept-Encoding'])
+
+    @httpretty.activate
+    def test_gzip_response(self):
+        import gzip
+        body = json.dumps({'items': [{'id': str(i)} for i in range(100)]})
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(body.encode('utf-8'))
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/files',
+            body=buf.getvalue(), status=200,
+            adding_headers={'Content-Encoding': 'gzip'})
+        ar = APIRequest(self.temp_path)
+        compare((200, json.loads(body)),
+                ar.api_request('GET', '/drive/v2/files'))
+        compare('gzip', httpretty.last_request().headers['Accept-Encoding'])
+
+    @httpretty.activate
+    def test_api_request_reuse_session(self):
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            body='{"name": "me"}', status=200)
+        ar = APIRequest(self.temp_path)
+        with patch.object(ar._session, 'request',
+                          wraps=ar._session.request) as req:
+            compare((200, {'name': 'me'}),
+                    ar.api_request('GET', '/drive/v2/about'))
+            compare((200, {'name': 'me'}),
+                    ar.api_request('GET', '/drive/v2/about'))
+            compare(2, req.call_count)
+
+
+def _batch_response(boundary, parts):
+    lines = []
+    for index, status, body in parts:
+        lines.extend([
+            '--' + boundary,
+            'Content-Type: application/http',
+            'Content-ID: <response-item{0}>'.format(index),
+            '',
+            'HTTP/1.1 {0} X'.format(status),
+            'Content-Type: application/json',
+            '',
+            json.dumps(body) if body is not None else '',
+        ])
+    lines.append('--' + boundary + '--')
+    return '\r\n'.join(lines)
+
+
+class Test_batch(unittest.TestCase):
+    """Test the batch request engine"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path)
+
+    @httpretty.activate
+    @patch('gdapi.utils.uniform', side_effect=lambda a, b: b)
+    @patch('gdapi.apirequest.sleep')
+    def test_batch_retry_failed_only(self, mock_sleep, _):
+        url = 'https://www.googleapis.com/batch/drive/v2'
+        rate_limit = {'error': {'code': 403, 'errors': [
+            {'reason': 'userRateLimitExceeded'}]}}
+        ctype = 'multipart/mixed; boundary=resp'
+        httpretty.register_uri(
+            httpretty.POST, url,
+            responses=[
+                httpretty.Response(body=_batch_response('resp', [
+                    (0, 204, None),
+                    (1, 503, None),
+                    (2, 403, rate_limit),
+                    (3, 404, {'error': {'code': 404}}),
+                ]), status=200, content_type=ctype),
+                httpretty.Response(body=_batch_response('resp', [
+                    (0, 200, {'id': 'b'}),
+                    (1, 204, None),
+                ]), status=200, content_type=ctype),
+            ])
+        calls = [
+            ('DELETE', '/drive/v2/files/f/permissions/a', None, None),
+            ('GET', '/drive/v2/files/b', {'fields': 'id'}, None),
+            ('DELETE', '/drive/v2/files/f/permissions/c', None, None),
+            ('POST', '/drive/v2/files/f/permissions', None, {'role': 'x'}),
+        ]
+        results = self.ar.batch_request(calls)
+        compare([(204, ''), (200, {'id': 'b'}), (204, ''),
+                 (404, {'error': {'code': 404}})], results)
+        mock_sleep.assert_called_once_with(1)
+        second = httpretty.last_request().body.decode('utf-8')
+        compare(True, 'GET /drive/v2/files/b?fields=id' in second)
+        compare(True, 'permissions/c' in second)
+        compare(False, 'permissions/a' in second)
+
+    @patch.object(APIRequest, '_batch_call', return_value=False)
+    def test_batch_out_of_tries(self, mock_call):
+        calls = [('DELETE', '/drive/v2/files/{0}'.format(x), None, None)
+                 for x in range(2)]
+        compare([(None, None)] * 2, self.ar.batch_request(calls))
+
+    @patch.object(APIRequest, '_batch_call')
+    def test_batch_split(self, mock_call):
+        mock_call.side_effect = lambda calls, verify, sub_headers: dict(
+            (n, (204, '')) for n in range(len(calls)))
+        calls = [('DELETE', '/drive/v2/files/{0}'.format(x), None, None)
+                 for x in range(250)]
+        compare([(204, '')] * 250, self.ar.batch_request(calls))
+        compare([100, 100, 50],
+                [len(c[0][0]) for c in mock_call.call_args_list])
+
+    @patch('gdapi.utils.uniform', side_effect=lambda a, b: b)
+    @patch('gdapi.apirequest.sleep')
+    @patch.object(APIRequest, '_batch_call')
+    def test_batch_retry_policy(self, mock_call, mock_sleep, mock_uniform):
+        def unavailable(calls, verify, sub_headers):
+            if mock_call.call_count == 1:
+                sub_headers[1] = {'retry-after': '3600'}
+            return {0: (503, None), 1: (503, None)}
+        mock_call.side_effect = unavailable
+        self.ar._retry_budget = RetryBudget(ratio=0, min_per_second=0,
+                                            max_tokens=2)
+        calls = [('DELETE', '/drive/v2/files/{0}'.format(x), None, None)
+                 for x in range(2)]
+        compare([(503, None)] * 2, self.ar.batch_request(calls))
+        # Retry-After capped, then jittered backoff, then out of budget
+        compare([((600,),), ((2,),)], mock_sleep.call_args_list)
+        compare([((0, 2),), ((0, 4),)], mock_uniform.call_args_list)
+        compare(3, mock_call.call_count)
+
+
+class FakeUploadSession(object):
+    """Resumable upload session answering chunked PUTs"""
+    def __init__(self, fail_at=None, retry_after=None):
+        self.received = b''
+        self.fail_at = set(fail_at or [])
+        self.retry_after = retry_after or {}
+        self.ranges = []
+
+    def __call__(self, request, uri, response_headers):
+        content_range = request.headers['Content-Range']
+        self.ranges.append(content_range)
+        if len(self.ranges) in self.fail_at:
+            if len(self.ranges) in self.retry_after:
+                response_headers['Retry-After'] = \
+                    self.retry_after[len(self.ranges)]
+            return (503, response_headers, 'Backend Error')
+        spec, total = content_range.split(' ')[1].split('/')
+        if spec != '*':
+            start = int(spec.split('-')[0])
+            self.received = self.received[:start] + request.body
+        if len(self.received) == int(total):
+            return (200, response_headers, json.dumps({'id': 'new'}))
+        if self.received:
+            response_headers['range'] = 'bytes=0-{0}'.format(
+                len(self.received) - 1)
+        return (308, response_headers, '')
+
+
+class Test_chunked_upload(unittest.TestCase):
+    """Test chunked, resumable uploads"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path)
+        fd, self.src = tempfile.mkstemp()
+        self.content = os.urandom(600 * 1024)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.content)
+        self.state_path = self.src + '.upload'
+        self.session_url = 'https://upload.example/session'
+        httpretty.enable()
+        httpretty.register_uri(
+            httpretty.POST, 'https://www.googleapis.com/upload/drive/v2/files',
+            status=200, adding_headers={'Location': self.session_url})
+
+    def tearDown(self):
+        httpretty.disable()
+        httpretty.reset()
+        os.unlink(self.src)
+
+    def test_chunk_size(self):
+        with ShouldRaise(ValueError):
+            self.ar.resumable_file_upload(self.src, {}, chunk_size=1000)
+
+    @patch('gdapi.apirequest.sleep')
+    def test_chunked_upload_retry_chunk(self, mock_sleep):
+        session = FakeUploadSession(fail_at=[2])
+        httpretty.register_uri(httpretty.PUT, self.session_url, body=session)
+        drive_file = self.ar.resumable_file_upload(
+            self.src, {'title': 'a'}, chunk_size=256 * 1024,
+            state_path=self.state_path)
+        compare({'id': 'new'}, drive_file)
+        compare(self.content, session.received)
+        compare(['bytes 0-262143/614400',
+                 'bytes 262144-524287/614400',  # failed
+                 'bytes */614400',
+                 'bytes 262144-524287/614400',
+                 'bytes 524288-614399/614400'], session.ranges)
+        compare(False, os.path.exists(self.state_path))
+
+    @patch('gdapi.utils.uniform', side_effect=lambda a, b: b)
+    @patch('gdapi.apirequest.sleep')
+    def test_chunk_retry_policy(self, mock_sleep, mock_uniform):
+        session = FakeUploadSession(fail_at=[2, 4, 6],
+                                    retry_after={2: '3600'})
+        httpretty.register_uri(httpretty.PUT, self.session_url, body=session)
+        self.ar._retry_budget = RetryBudget(ratio=0, min_per_second=0,
+                                            max_tokens=2)
+        with ShouldRaise(RetryLimitError):
+            self.ar.resumable_file_upload(
+                self.src, {'title': 'a'}, chunk_size=256 * 1024,
+                state_path=self.state_path)
+        # Retry-After capped, then jittered backoff, then out of budget
+        compare([((600,),), ((2,),)], mock_sleep.call_args_list)
+        compare([((0, 2),), ((0, 4),)], mock_uniform.call_args_list)
+        compare(6, len(session.ranges))
+        compare(True, os.path.exists(self.state_path))
+
+    @patch('gdapi.apirequest.sleep')
+    def test_resume_from_state(self, mock_sleep):
+        session = FakeUploadSession()
+        session.received = self.content[:256 * 1024]
+        httpretty.register_uri(httpretty.PUT, self.session_url, body=session)
+        key = self.ar._upload_state_key(self.src, None)
+        self.ar._save_upload_state(self.state_path, key, self.session_url,
+                                   256 * 1024)
+        drive_file = self.ar.resumable_file_upload(
+            self.src, {'title': 'a'}, chunk_size=512 * 1024,
+            state_path=self.state_path)
+        compare({'id': 'new'}, drive_file)
+        compare(self.content, session.received)
+        compare(['bytes */614400', 'bytes 262144-614399/614400'],
+                session.ranges)
+        compare(0, len([r for r in httpretty.latest_requests()
+                        if r.method == 'POST']))
+
+
+    def test_state_key_of_file_object(self):
+        key = self.ar._upload_state_key(io.BytesIO(b'a' * 1000), None)
+        compare(key, self.ar._upload_state_key(io.BytesIO(b'a' * 1000),
+                                               None))
+        other = self.ar._upload_state_key(io.BytesIO(b'b' * 1000), None)
+        compare(1000, other['size'])
+        compare(False, key == other)
+
+
+class Test_multipart_upload(unittest.TestCase):
+    """Test the streamed multipart upload"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path)
+
+    @patch.object(APIRequest, '_api_request')
+    def test_multipart_file_upload(self, mock_request):
+        sent = {}
+
+        def fake_request(method, url, params=None, headers=None, data=None,
+                         verify=None):
+            sent['headers'] = dict(headers)
+            sent['body'] = data.read()
+            sent['length'] = len(data)
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = b'{"id": "abc"}'
+            return resp
+        mock_request.side_effect = fake_request
+        content = os.urandom(300000)
+        fd, temp_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        compare({'id': 'abc'},
+                self.ar.multipart_file_upload(temp_path, {'title': 'a'}))
+        os.unlink(temp_path)
+        compare(True, sent['headers']['content-type'].startswith(
+            'multipart/related; boundary='))
+        compare(True, content in sent['body'])
+        compare(len(sent['body']), sent['length'])
+        compare('application/json',
+                self.ar._default_headers['content-type'])
+
+    @patch('gdapi.utils.sleep')
+    @patch.object(APIRequest, '_api_request')
+    def test_connection_lost_mid_upload(self, mock_request, mock_sleep):
+        sent = []
+
+        def fake_request(method, url, params=None, headers=None, data=None,
+                         verify=None):
+            if not sent:
+                sent.append(data.read(1000))
+                raise requests.ConnectionError('connection reset')
+            sent.append(data.read())
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = b'{"id": "abc"}'
+            return resp
+        mock_request.side_effect = fake_request
+        content = os.urandom(300000)
+        f = io.BytesIO(b'skipped' + content)
+        f.seek(7)
+        # the real retry loop, which the tests of this module replace
+        upload = retry(requests.ConnectionError, 2, delay=1)(
+            APIRequest._multipart_file_upload)
+        with patch.object(APIRequest, '_multipart_file_upload', upload):
+            compare({'id': 'abc'},
+                    self.ar.multipart_file_upload(f, {'title': 'a'}))
+        compare(2, len(sent))
+        compare(True, content in sent[1])
+        compare(False, b'skipped' in sent[1])
+
+
+class Test_token_refresh(unittest.TestCase):
+    """Test the proactive, single-flight token refresh"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.temp_path = temp_path
+        self.ar = APIRequest(temp_path)
+        self.ar._credential.update({
+            'access_token': 'OLD', 'refresh_token': 'R',
+            'client_id': 'C', 'client_secret': 'S',
+        })
+
+    def tearDown(self):
+        for path in [self.temp_path, self.temp_path + '.lock']:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    @httpretty.activate
+    @patch('gdapi.apirequest.time', return_value=1000.0)
+    def test_expires_at_saved(self, _):
+        httpretty.register_uri(
+            httpretty.POST, 'https://accounts.google.com/o/oauth2/token',
+            body='{"access_token": "NEW", "expires_in": 3600}', status=200)
+        compare(True, self.ar._refresh_access_token())
+        compare(4600.0, self.ar._credential['expires_at'])
+        with open(self.temp_path) as fin:
+            compare(4600.0, json.load(fin)['expires_at'])
+
+    @httpretty.activate
+    def test_refresh_before_expiry(self):
+        httpretty.register_uri(
+            httpretty.POST, 'https://accounts.google.com/o/oauth2/token',
+            body='{"access_token": "NEW", "expires_in": 3600}', status=200)
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            body='{"name": "me"}', status=200)
+        self.ar._credential['expires_at'] = 10  # long expired
+        compare((200, {'name': 'me'}),
+                self.ar.api_request('GET', '/drive/v2/about'))
+        reqs = httpretty.latest_requests()
+        compare('POST', reqs[0].method)
+        compare('GET', reqs[-1].method)
+        compare('Bearer NEW', reqs[-1].headers['Authorization'])
+
+    @httpretty.activate
+    def test_no_refresh_when_valid(self):
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            body='{"name": "me"}', status=200)
+        import time
+        self.ar._credential['expires_at'] = time.time() + 3600
+        self.ar.api_request('GET', '/drive/v2/about')
+        compare(['GET'], [r.method for r in httpretty.latest_requests()])
+
+    def test_single_flight(self):
+        import threading
+        calls = []
+        entered = threading.Event()
+        release = threading.Event()
+
+        def fake_oauth(method, data=None):
+            calls.append(data)
+            entered.set()
+            release.wait(5)
+            return 200, {'access_token': 'NEW'}
+        results = []
+        with patch.object(self.ar, '_oauth_api_request',
+                          side_effect=fake_oauth):
+            threads = [threading.Thread(
+                target=lambda: results.append(
+                    self.ar._refresh_access_token()))
+                for _ in range(5)]
+            threads[0].start()
+            entered.wait(5)
+            for t in threads[1:]:
+                t.start()
+            sleep(0.1)  # let them queue on the lock
+            release.set()
+            for t in threads:
+                t.join()
+        compare(1, len(calls))
+        compare([True] * 5, results)
+        compare('Bearer NEW', self.ar._default_headers['Authorization'])
+
+
+class Test_shared_credential(unittest.TestCase):
+    """Test the credential file shared by several clients"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'access_token': 'OLD', 'refresh_token': 'R',
+                'client_id': 'C', 'client_secret': 'S',
+            }, f)
+        self.temp_path = temp_path
+        self.first = APIRequest(temp_path)
+        self.second = APIRequest(temp_path)
+
+    def tearDown(self):
+        for path in [self.temp_path, self.temp_path + '.lock']:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_reuse_refreshed_token(self):
+        with patch.object(self.first, '_oauth_api_request',
+                          return_value=(200, {'access_token': 'NEW'})):
+            compare(True, self.first._refresh_access_token())
+        with patch.object(self.second, '_oauth_api_request') as oauth:
+            compare(True, self.second._refresh_access_token())
+            compare(0, oauth.call_count)
+        compare('Bearer NEW', self.second._default_headers['Authorization'])
+
+    @httpretty.activate
+    def test_request_picks_up_new_token(self):
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            body='{"name": "me"}', status=200)
+        with patch.object(self.first, '_oauth_api_request',
+                          return_value=(200, {'access_token': 'NEW'})):
+            self.first._refresh_access_token()
+        self.second.api_request('GET', '/drive/v2/about')
+        compare('Bearer NEW',
+                httpretty.last_request().headers['Authorization'])
+
+
+class Test_rate_limit(unittest.TestCase):
+    """Test the client-side rate limiter hooks"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path, max_qps=10)
+
+    @httpretty.activate
+    def test_quota_error_lowers_rate(self):
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            responses=[
+                httpretty.Response(body=json.dumps({'error': {
+                    'code': 403, 'message': 'Rate',
+                    'errors': [{'reason': 'userRateLimitExceeded'}]}}),
+                    status=403),
+                httpretty.Response(body='{"name": "me"}', status=200),
+            ])
+        with patch.object(self.ar._rate_limiter, 'acquire') as acquire:
+            compare(403, self.ar.api_request('GET', '/drive/v2/about')[0])
+            compare(5.0, self.ar._rate_limiter.rate)
+            compare((200, {'name': 'me'}),
+                    self.ar.api_request('GET', '/drive/v2/about'))
+            compare(2, acquire.call_count)
+        compare(5.1, round(self.ar._rate_limiter.rate, 6))
+
+    @httpretty.activate
+    def test_too_many_requests(self):
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/about',
+            body='', status=429)
+        resp = self.ar._api_request(
+            'GET', 'https://www.googleapis.com/drive/v2/about',
+            headers={})
+        compare(429, resp.status_code)
+        compare(5.0, self.ar._rate_limiter.rate)
+
+    def test_disabled_by_default(self):
+        compare(None, APIRequest(self.ar._credential_path)._rate_limiter)
+
+
+class Test_metrics(unittest.TestCase):
+    """Test the request metrics of the client"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path)
+
+    @httpretty.activate
+    def test_request_metrics(self):
+        httpretty.register_uri(
+            httpretty.POST, 'https://www.googleapis.com/drive/v2/files',
+            body='{"id": "abc"}', status=200)
+        self.ar.api_request('POST', '/drive/v2/files', data={'title': 'a'})
+        stats = self.ar.metrics.snapshot()['requests'][
+            ('POST', '/drive/v2/files')]
+        compare({'200': 1}, stats['status'])
+        compare(len(json.dumps({'title': 'a'})), stats['request_bytes'])
+        compare(len('{"id": "abc"}'), stats['response_bytes'])
+        compare(1, stats['latency']['count'])
+
+    @httpretty.activate
+    def test_compressed_bytes(self):
+        content = b'{"items": []}' * 100
+        httpretty.register_uri(
+            httpretty.GET, 'https://www.googleapis.com/drive/v2/files',
+            body=gzip.compress(content), status=200,
+            adding_headers={'Content-Encoding': 'gzip'})
+        for stream in (False, True):
+            self.ar._api_request('GET',
+                                 'https://www.googleapis.com/drive/v2/files',
+                                 stream=stream)
+        stats = self.ar.metrics.snapshot()['requests'][
+            ('GET', '/drive/v2/files')]
+        compare(len(content), stats['response_bytes'])  # streamed: unknown
+
+    @patch.object(requests.Session, 'request')
+    def test_connection_error(self, mock_request):
+        mock_request.side_effect = requests.ConnectionError
+        with ShouldRaise(requests.ConnectionError):
+            self.ar._api_request('GET', 'https://www.googleapis.com/x')
+        compare({'error': 1}, self.ar.metrics.snapshot()['requests'][
+            ('GET', '/x')]['status'])
+
+    def test_refresh_counter(self):
+        self.ar._credential.update({'refresh_token': 'R', 'client_id': 'C',
+                                    'client_secret': 'S'})
+        with patch.object(self.ar, '_oauth_api_request',
+                          return_value=(400, {})):
+            self.ar._refresh_access_token()
+        compare({(('result', 'failed'),): 1},
+                self.ar.metrics.snapshot()['counters']['token_refreshes'])
+
+
+class Test_request_log(unittest.TestCase):
+    """Test the INFO line of every request"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.ar = APIRequest(temp_path, log_sample_rate=0.1)
+        self.ar._credential['access_token'] = 'SECRET'
+        self.ar._set_default_headers()
+
+    def test_not_enabled(self):
+        with patch.object(self.ar._logger, 'isEnabledFor',
+                          return_value=False), \
+                patch.object(self.ar._logger, 'info') as mock_info:
+            self.ar._log_request('GET', 'https://x', 200, 0.1)
+        compare(False, mock_info.called)
+
+    def test_redacted(self):
+        with patch.object(self.ar._logger, 'isEnabledFor',
+                          return_value=True), \
+                patch.object(self.ar._logger, 'info') as mock_info:
+            self.ar._log_request('POST', 'https://x', 500, 0.1,
+                                 self.ar._default_headers, None,
+                                 'x' * 100000)
+        message = mock_info.call_args[0][1]
+        compare(500, mock_info.call_args[1]['extra']['gdapi_request'][
+            'status'])
+        compare(False, 'SECRET' in str(message))
+        compare(True, len(str(message)) < 1000)
+
+    @patch.object(requests.Session, 'request')
+    def test_simple_media_upload(self, mock_request):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = b'{"id": "abc"}'
+        resp.headers['Authorization'] = 'Bearer SECRET'
+        resp.request = requests.Request(
+            'POST', 'https://x',
+            headers=self.ar._default_headers).prepare()
+        mock_request.return_value = resp
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, temp_path)
+        with patch.object(self.ar._logger, 'isEnabledFor',
+                          return_value=True), \
+                patch.object(self.ar._logger, 'debug') as mock_debug, \
+                patch.object(self.ar._logger, 'info') as mock_info:
+            self.ar.simple_media_upload(
+                temp_path,
+                headers={'Authorization': 'Bearer SECRET'})
+        for call_args in mock_debug.call_args_list + \
+                mock_info.call_args_list:
+            args = call_args[0]
+            message = args[0] % args[1:] if len(args) > 1 else args[0]
+            compare(False, 'SECRET' in str(message))
+
+    @patch('gdapi.apirequest.random')
+    def test_sampled(self, mock_random):
+        mock_random.return_value = 0.5
+        with patch.object(self.ar._logger, 'isEnabledFor',
+                          return_value=True), \
+                patch.object(self.ar._logger, 'info') as mock_info:
+            self.ar._log_request('GET', 'https://x', 200, 0.1)
+            compare(0, mock_info.call_count)
+            self.ar._log_request('GET', 'https://x', 404, 0.1)
+            compare(1, mock_info.call_count)  # failures are always logged
+            mock_random.return_value = 0.05
+            self.ar._log_request('GET', 'https://x', 200, 0.1)
+            compare(2, mock_info.call_count)
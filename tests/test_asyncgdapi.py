@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import tempfile
+import unittest
+import threading
+from time import sleep
+from mock import patch, AsyncMock
+from testfixtures import compare
+from aiohttp import web
+from gdapi.asyncgdapi import AsyncGDAPI
+from gdapi.credential import CredentialStore
+
+
+class FakeDrive(object):
+    """A tiny Drive v2 stand-in served by aiohttp on localhost"""
+    def __init__(self):
+        self.files = {}
+        self.uploads = {}
+        # status codes, or (status code, headers), to answer before
+        # succeeding
+        self.fail_next = []
+        self.refreshed = 0
+        self.app = web.Application()
+        self.app.add_routes([
+            web.post('/token', self.token),
+            web.get('/drive/v2/files/{file_id}', self.get_file),
+            web.get('/download/{file_id}', self.download),
+            web.post('/upload/drive/v2/files', self.start_upload),
+            web.post('/session/{session_id}', self.finish_upload),
+        ])
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = 'http://127.0.0.1:{0}/'.format(port)
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def _check(self, request):
+        if self.fail_next:
+            failure = self.fail_next.pop(0)
+            status, headers = failure if isinstance(failure, tuple) \
+                else (failure, None)
+            return web.Response(status=status, headers=headers)
+        if request.headers.get('Authorization') != 'Bearer ACCESS':
+            return web.Response(status=401)
+        return None
+
+    async def token(self, request):
+        self.refreshed += 1
+        return web.json_response({'access_token': 'ACCESS',
+                                  'expires_in': 3600})
+
+    async def get_file(self, request):
+        failed = self._check(request)
+        if failed is not None:
+            return failed
+        file_id = request.match_info['file_id']
+        return web.json_response({
+            'id': file_id,
+            'downloadUrl': self.url + 'download/' + file_id,
+        })
+
+    async def download(self, request):
+        failed = self._check(request)
+        if failed is not None:
+            return failed
+        return web.Response(body=self.files[request.match_info['file_id']])
+
+    async def start_upload(self, request):
+        failed = self._check(request)
+        if failed is not None:
+            return failed
+        session_id = str(len(self.uploads))
+        self.uploads[session_id] = await request.json()
+        return web.Response(
+            headers={'Location': self.url + 'session/' + session_id})
+
+    async def finish_upload(self, request):
+        body = self.uploads[request.match_info['session_id']]
+        file_id = 'id{0}'.format(len(self.files))
+        self.files[file_id] = await request.read()
+        return web.json_response({'id': file_id, 'title': body['title']})
+
+
+@patch('gdapi.asyncutils.sleep', new_callable=AsyncMock)
+class Test_async_gdapi(unittest.IsolatedAsyncioTestCase):
+    """Test AsyncGDAPI against a local fake server"""
+    async def asyncSetUp(self):
+        self.server = FakeDrive()
+        await self.server.start()
+        fd, self.cred_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'access_token': 'EXPIRED',
+                'refresh_token': 'REFRESH',
+                'client_id': 'ID',
+                'client_secret': 'SECRET',
+            }, f)
+        self.gd = AsyncGDAPI(self.cred_path)
+        self.gd._googleapi._API_URL = self.server.url
+        self.gd._googleapi._TOKEN_URL = self.server.url + 'token'
+
+    async def asyncTearDown(self):
+        await self.gd.close()
+        await self.server.stop()
+        os.unlink(self.cred_path)
+
+    async def test_refresh_and_retry(self, mock_sleep):
+        self.server.fail_next = [503]
+        drive_file = await self.gd.get_file_meta('abc')
+        compare('abc', drive_file['id'])
+        compare(1, self.server.refreshed)
+        compare(2, mock_sleep.call_count)
+        with open(self.cred_path) as f:
+            compare('ACCESS', json.load(f)['access_token'])
+
+    async def test_refreshed_by_other_process(self, mock_sleep):
+        other = CredentialStore(self.cred_path)
+        credential = other.load()
+        locked = threading.Event()
+
+        def refresh():
+            with other.lock():
+                locked.set()
+                sleep(0.2)
+                other.save(dict(credential, access_token='ACCESS'))
+        thread = threading.Thread(target=refresh)
+        thread.start()
+        locked.wait()
+        drive_file = await self.gd.get_file_meta('abc')
+        thread.join()
+        compare('abc', drive_file['id'])
+        compare(0, self.server.refreshed)  # the new token was picked up
+
+    async def test_retry_after(self, mock_sleep):
+        self.gd._googleapi._default_headers['Authorization'] = 'Bearer ACCESS'
+        self.server.fail_next = [(429, {'Retry-After': '3'}), 503]
+        drive_file = await self.gd.get_file_meta('abc')
+        compare('abc', drive_file['id'])
+        compare(2, mock_sleep.call_count)
+        compare(3.0, mock_sleep.call_args_list[0][0][0])
+
+    async def test_upload_and_download(self, mock_sleep):
+        fd, src = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'x' * 100000)
+        self.gd._googleapi._default_headers['Authorization'] = 'Bearer ACCESS'
+        drive_file = await self.gd.create_file('root', src, 'big.bin')
+        compare('big.bin', drive_file['title'])
+
+        fd, dst = tempfile.mkstemp()
+        os.close(fd)
+        await self.gd.download_file(drive_file['id'], dst)
+        with open(dst, 'rb') as f:
+            compare(b'x' * 100000, f.read())
+        os.unlink(src)
+        os.unlink(dst)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import unittest
+import tempfile
+from testfixtures import compare
+from gdapi.benchmark import percentile, summarize, run_benchmarks, \
+    save_results, load_results, format_comparison
+
+
+class Test_stats(unittest.TestCase):
+    """Test the figures of a case"""
+    def test_percentile(self):
+        values = list(range(1, 101))
+        compare(50, percentile(values, 0.5))
+        compare(99, percentile(values, 0.99))
+        compare(100, percentile(values, 1))
+        compare(3, percentile([3], 0.99))
+        compare(None, percentile([], 0.5))
+
+    def test_summarize(self):
+        result = summarize([0.1, 0.3], 0.5, transferred=2000000)
+        compare(2, result['ops'])
+        compare(4.0, result['ops_per_second'])
+        compare(4.0, result['mb_per_second'])
+        compare(0.1, result['latency']['p50'])
+        compare(0.3, result['latency']['p99'])
+        compare(None, summarize([0.1], 1.0)['mb_per_second'])
+
+    def test_comparison(self):
+        case = {'operation': 'share', 'concurrency': 1,
+                'latency': {'p99': 0.2}}
+        before = {'results': [dict(case, ops_per_second=100.0)]}
+        after = {'results': [dict(case, ops_per_second=150.0,
+                                  latency={'p99': 0.1})]}
+        compare(u'share threads=1'.ljust(40) + u' ops/s +50.0%, p99 -50.0%',
+                format_comparison(before, after))
+
+
+class Test_run(unittest.TestCase):
+    """Test a small sweep against the emulator"""
+    def test_run(self):
+        run = run_benchmarks(sizes=[1024], concurrency=[2],
+                             page_sizes=[500], ops=4, isolate=False)
+        compare(['upload', 'download', 'list', 'share'],
+                [r['operation'] for r in run['results']])
+        for result in run['results']:
+            compare(0, result['errors'])
+            compare(True, result['ops_per_second'] > 0)
+        compare(1024 * 4, int(round(run['results'][0]['mb_per_second'] *
+                                    1e6 * run['results'][0]['seconds'])))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            save_results(run, path)
+            compare(json.loads(json.dumps(run)), load_results(path))
+        finally:
+            os.unlink(path)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from time import sleep
+from testfixtures import compare
+from gdapi.credential import CredentialStore
+
+
+class Test_credential_store(unittest.TestCase):
+    """Test the credential file shared by several processes"""
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cred.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_missing(self):
+        store = CredentialStore(self.path)
+        compare({}, store.load())
+        compare(False, store.changed())
+
+    def test_save_load(self):
+        store = CredentialStore(self.path)
+        store.save({'access_token': 'A'})
+        compare(False, store.changed())
+        compare({'access_token': 'A'}, CredentialStore(self.path).load())
+        compare(['cred.json'], os.listdir(self.temp_dir))
+
+    def test_changed_by_other(self):
+        store = CredentialStore(self.path)
+        store.save({'access_token': 'A'})
+        CredentialStore(self.path).save({'access_token': 'B'})
+        compare(True, store.changed())
+        compare({'access_token': 'B'}, store.load())
+        compare(False, store.changed())
+
+    def test_lock_excludes_other_store(self):
+        first, second = CredentialStore(self.path), CredentialStore(self.path)
+        events = []
+
+        def other():
+            with second.lock():
+                events.append('second')
+        with first.lock():
+            with first.lock():  # reentrant
+                thread = threading.Thread(target=other)
+                thread.start()
+                sleep(0.1)
+                events.append('first')
+        thread.join()
+        compare(['first', 'second'], events)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import errno
+import shutil
+import unittest
+import tempfile
+import requests
+from mock import patch
+from testfixtures import compare, ShouldRaise
+from gdapi.gdapi import GDAPI
+from gdapi.errors import EmailInvalidError
+from gdapi.emulator import DriveEmulator, Faults, compile_query, \
+    FOLDER_TYPE, _Server
+
+
+class Test_query(unittest.TestCase):
+    """Test the search queries understood by the emulator"""
+    def setUp(self):
+        self.files = [
+            {'id': 'a', 'title': "it's", 'mimeType': FOLDER_TYPE,
+             'parents': [{'id': 'root'}], 'labels': {'trashed': False}},
+            {'id': 'b', 'title': 'b and c', 'mimeType': 'text/plain',
+             'parents': [{'id': 'a'}], 'labels': {'trashed': True}},
+        ]
+
+    def ids(self, q):
+        match = compile_query(q)
+        return [f['id'] for f in self.files if match(f)]
+
+    def test_clauses(self):
+        compare(['a'], self.ids(u"trashed=false"))
+        compare(['a'], self.ids(u"title='it\\'s' and 'root' in parents"))
+        compare(['b'], self.ids(u"title='b and c'"))
+        compare(['b'], self.ids(u"'a' in parents and mimeType!='{0}'"
+                                u"".format(FOLDER_TYPE)))
+        compare(['a', 'b'], self.ids(None))
+
+    def test_unsupported(self):
+        with ShouldRaise(ValueError):
+            compile_query(u"modifiedDate > '2012-06-04'")
+
+
+class Test_server(unittest.TestCase):
+    """Test the errors of the request threads"""
+    def handle(self, error):
+        try:
+            raise error
+        except Exception:
+            _Server.handle_error(None, None, ('127.0.0.1', 1))
+
+    @patch('gdapi.emulator.logger')
+    def test_handle_error(self, mock_logger):
+        self.handle(IOError(errno.ECONNRESET, 'reset'))
+        self.handle(IOError(errno.EPIPE, 'broken pipe'))
+        compare(0, mock_logger.error.call_count)
+        self.handle(ValueError('bug'))
+        compare(1, mock_logger.error.call_count)
+
+
+class Test_emulator(unittest.TestCase):
+    """Test the clients against the emulator"""
+    def setUp(self):
+        self.faults = Faults()
+        self.drive = DriveEmulator(self.faults).start()
+        self.temp_dir = tempfile.mkdtemp()
+        cred_path = os.path.join(self.temp_dir, 'cred.json')
+        with open(cred_path, 'w') as f:
+            json.dump({'access_token': 'A', 'refresh_token': 'R',
+                       'client_id': 'C', 'client_secret': 'S'}, f)
+        self.api = GDAPI(cred_path,
+                         api_url=self.drive.url,
+                         token_url=self.drive.token_url)
+
+    def tearDown(self):
+        self.api.close()
+        self.drive.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def local_file(self, name, content):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_files(self):
+        folder_id = self.api.create_folder('root', 'docs')
+        compare(folder_id, self.api.create_folder('root', 'docs'))
+        path = self.local_file('a.txt', b'hello')
+        drive_file = self.api.create_file(folder_id, path, 'a.txt')
+        compare(b'hello', self.drive.content(drive_file['id']))
+        compare('5', drive_file['fileSize'])
+        compare([drive_file['id']],
+                [f['id'] for f in self.api.query_title('a.txt')])
+        self.api.trash_file(drive_file['id'])
+        compare([], self.api.query_title('a.txt'))
+        compare(True, self.api.delete_file(drive_file['id']))
+        compare(404, self.api._googleapi.api_request(
+            'GET', '/drive/v2/files/{0}'.format(drive_file['id']))[0])
+
+    def test_resumable_upload(self):
+        content = os.urandom(256 * 1024 * 2 + 10)
+        path = self.local_file('big.bin', content)
+        self.faults.fail_next(503, path='/upload/session/')
+        drive_file = self.api.create_file(
+            'root', path, 'big.bin', chunk_size=256 * 1024)
+        compare(content, self.drive.content(drive_file['id']))
+        compare(1, self.drive.stats[('session', 503)])
+
+    def test_update(self):
+        remote = self.drive.add_file('a.txt', b'old')
+        path = self.local_file('a.txt', b'new content')
+        self.api.update_file(remote['id'], path, etag=remote['etag'])
+        compare(b'new content', self.drive.content(remote['id']))
+
+    def test_download(self):
+        content = os.urandom(100000)
+        remote = self.drive.add_file('a.bin', content)
+        path = os.path.join(self.temp_dir, 'a.bin')
+        self.api.download_file(remote['id'], path)
+        with open(path, 'rb') as f:
+            compare(content, f.read())
+        os.unlink(path)
+        self.api.download_file(remote['id'], path, workers=3,
+                               part_size=30000)
+        with open(path, 'rb') as f:
+            compare(content, f.read())
+        compare(4, self.drive.stats[('file', 206)])
+
+    def test_changes(self):
+        start = self.api.get_start_change_id()
+        remote = self.drive.add_file('a.txt')
+        self.drive.add_file('b.txt')
+        changes = list(self.api.iter_changes(start, max_results=1,
+                                             save_cursor=False))
+        compare(2, len(changes))
+        compare(remote['id'], changes[0].file_id)
+
+    def test_sharing(self):
+        remote = self.drive.add_file('a.txt')
+        self.api.make_user_reader_for_file(remote['id'], 'a@example.com')
+        self.api.make_public_reader_for_file(remote['id'])
+        compare(3, len(self.api.query_permission(remote['id'])))
+        with ShouldRaise(EmailInvalidError):
+            self.api.make_user_reader_for_file(remote['id'], 'nobody')
+        # a throttled sub-request of the batch is sent again
+        self.faults.fail_next(403, count=1, path='/permissions/')
+        compare(True, self.api.unshare(remote['id']))
+        compare(['owner'], [p['role'] for p in
+                            self.api.query_permission(remote['id'])])
+
+    def test_faults(self):
+        self.faults.fail_next(503)
+        with ShouldRaise(requests.ConnectionError):
+            self.api._googleapi._api_call('GET', '/drive/v2/about')
+        self.faults.fail_next(401)
+        with ShouldRaise(requests.ConnectionError):  # retry, once renewed
+            self.api._googleapi._api_call('GET', '/drive/v2/about')
+        compare(True, self.api._googleapi._credential[
+            'access_token'].startswith('emulator-'))
+        self.faults.fail_next(403)
+        status_code, about = self.api._googleapi._api_call(
+            'GET', '/drive/v2/about')
+        compare('userRateLimitExceeded',
+                about['error']['errors'][0]['reason'])
+        compare(200, self.api._googleapi._api_call(
+            'GET', '/drive/v2/about')[0])
+
+    def test_random_faults(self):
+        faults = Faults(server_error_rate=0.5, seed=1)
+        picked = [faults.pick('/x') for _ in range(1000)]
+        compare(True, 400 < picked.count(503) < 600)
+        compare(set([None, 503]), set(picked))
+
+    def test_latency(self):
+        from timeit import default_timer as timer
+        self.faults.latency = 0.2
+        start = timer()
+        self.api.about()
+        compare(True, timer() - start >= 0.2)
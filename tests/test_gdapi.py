@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
+import io
+import os
+import json
+import hashlib
+import tempfile
 import unittest
+import requests
 from mock import patch
 # mock the retry decorator before any module loads it
-patch('gdapi.utils.retry', lambda x, y, delay: lambda z: z).start()
-from gdapi.gdapi import GDAPI
+with patch('gdapi.utils.retry', lambda x, y, delay: lambda z: z):
+    from gdapi.gdapi import GDAPI
+    from gdapi.apirequest import APIRequest
+from gdapi.changes import Change
+from gdapi.errors import GoogleApiError
+from gdapi.utils import md5sum
+from testfixtures import compare, ShouldRaise
 
 
 class Test_upload_file(unittest.TestCase):
@@ -14,3 +25,672 @@ class Test_upload_file(unittest.TestCase):
 
     def tearDown(self):
         pass
+
+
+class Test_unshare(unittest.TestCase):
+    """Test unshare goes through the batch endpoint"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+
+    @patch.object(APIRequest, 'batch_request')
+    @patch.object(APIRequest, 'api_request')
+    def test_unshare_all(self, mock_api, mock_batch):
+        mock_api.return_value = (200, {'items': [
+            {'id': 'p0', 'role': 'owner'},
+            {'id': 'p1', 'role': 'reader'},
+            {'id': 'p2', 'role': 'writer'},
+        ]})
+        mock_batch.return_value = [(204, ''), (404, {})]
+        compare(True, self.gd.unshare('f'))
+        mock_batch.assert_called_once_with([
+            ('DELETE', '/drive/v2/files/f/permissions/p1', None, None),
+            ('DELETE', '/drive/v2/files/f/permissions/p2', None, None),
+        ])
+
+    @patch.object(APIRequest, 'batch_request')
+    @patch.object(APIRequest, 'api_request')
+    def test_unshare_failed(self, mock_api, mock_batch):
+        mock_api.return_value = (200, {'items': [
+            {'id': 'p1', 'role': 'reader'},
+            {'id': 'p2', 'role': 'writer'},
+        ]})
+        mock_batch.return_value = [(204, ''), (403, {'error': {}})]
+        compare(False, self.gd.unshare('f'))
+        mock_batch.return_value = [(None, None), (204, '')]
+        compare(False, self.gd.unshare('f'))
+
+
+class FakeRangeResponse(object):
+    def __init__(self, content, broken_at=None):
+        self.content = content
+        self.broken_at = broken_at
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), 100):
+            if self.broken_at is not None and start >= self.broken_at:
+                raise requests.ConnectionError('connection reset')
+            yield self.content[start:start + 100]
+
+    def close(self):
+        self.closed = True
+
+
+class Test_download_file(unittest.TestCase):
+    """Test parallel ranged downloads"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+        fd, self.dst = tempfile.mkstemp()
+        os.close(fd)
+        self.content = os.urandom(10000)
+        self.ranges = []
+
+    def tearDown(self):
+        if os.path.exists(self.dst):
+            os.unlink(self.dst)
+
+    def fake_api_request(self, method, resource, params=None, headers=None,
+                         stream=False):
+        if resource == '/drive/v2/files/abc':
+            return 200, {'id': 'abc', 'fileSize': str(len(self.content)),
+                         'downloadUrl': 'https://dl/abc'}
+        spec = headers['Range'].split('=')[1]
+        start, end = [int(x) for x in spec.split('-')]
+        self.ranges.append((start, end))
+        broken_at = None
+        if start % 3000 == 0:  # break the first attempt of each range
+            broken_at = 300
+        return 206, FakeRangeResponse(self.content[start:end + 1],
+                                      broken_at)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_parallel_download(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        drive_file = self.gd.download_file('abc', self.dst, workers=4,
+                                           part_size=3000)
+        compare('abc', drive_file['id'])
+        with open(self.dst, 'rb') as f:
+            compare(self.content, f.read())
+        compare([(0, 2999), (300, 2999), (3000, 5999), (3300, 5999),
+                 (6000, 8999), (6300, 8999), (9000, 9999), (9300, 9999)],
+                sorted(self.ranges))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_ranges_not_served(self, mock_api):
+        def api_request(method, resource, **kwargs):
+            if resource == '/drive/v2/files/abc':
+                return self.fake_api_request(method, resource, **kwargs)
+            self.ranges.append(kwargs['headers'].get('Range'))
+            return 200, FakeRangeResponse(self.content)
+        mock_api.side_effect = api_request
+        compare('abc', self.gd.download_file('abc', self.dst, workers=4,
+                                             part_size=3000)['id'])
+        with open(self.dst, 'rb') as f:
+            compare(self.content, f.read())
+        compare(['bytes=0-2999', None], self.ranges)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_range_failed(self, mock_api):
+        def api_request(method, resource, **kwargs):
+            if '3000-' in kwargs.get('headers', {}).get('Range', ''):
+                return 404, FakeRangeResponse(b'')
+            return self.fake_api_request(method, resource, **kwargs)
+        mock_api.side_effect = api_request
+        compare(None, self.gd.download_file('abc', self.dst, workers=4,
+                                            part_size=3000))
+        compare(False, os.path.exists(self.dst))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_range_out_of_tries(self, mock_api):
+        def api_request(method, resource, **kwargs):
+            if resource == '/drive/v2/files/abc':
+                return self.fake_api_request(method, resource, **kwargs)
+            return False
+        mock_api.side_effect = api_request
+        compare(None, self.gd.download_file('abc', self.dst, workers=4,
+                                            part_size=3000))
+
+
+class FakeRawResponse(object):
+    def __init__(self, content):
+        self.raw = io.BytesIO(content)
+
+    def iter_content(self, chunk_size=1):
+        return iter(lambda: self.raw.read(chunk_size), b'')
+
+
+class Test_resume_download(unittest.TestCase):
+    """Test resuming a partial download"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+        fd, self.dst = tempfile.mkstemp()
+        self.content = os.urandom(10000)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.content[:4000])
+        self.meta = {'id': 'abc', 'fileSize': '10000', 'md5Checksum': 'm1',
+                     'downloadUrl': 'https://dl/abc'}
+        self.partial_path = self.dst + GDAPI._PARTIAL_SUFFIX
+        with open(self.partial_path, 'w') as f:
+            json.dump({'id': 'abc', 'md5Checksum': 'm1'}, f)
+        self.headers = []
+
+    def tearDown(self):
+        if os.path.exists(self.dst):
+            os.unlink(self.dst)
+
+    def fake_api_request(self, method, resource, params=None, headers=None,
+                         stream=False):
+        if resource == '/drive/v2/files/abc':
+            return 200, dict(self.meta)
+        self.headers.append(headers)
+        if 'Range' in headers:
+            start = int(headers['Range'].split('=')[1].rstrip('-'))
+            return 206, FakeRawResponse(self.content[start:])
+        return 200, FakeRawResponse(self.content)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_resume(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        self.gd.download_file('abc', self.dst, resume=True)
+        with open(self.dst, 'rb') as f:
+            compare(self.content, f.read())
+        compare('bytes=4000-', self.headers[0]['Range'])
+        compare(False, os.path.exists(self.partial_path))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_remote_changed(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        self.meta['md5Checksum'] = 'm2'
+        self.gd.download_file('abc', self.dst, resume=True)
+        with open(self.dst, 'rb') as f:
+            compare(self.content, f.read())
+        compare([{'Accept-Encoding': 'identity'}], self.headers)
+        compare(False, os.path.exists(self.partial_path))
+
+
+class Test_download_encoding(unittest.TestCase):
+    """Test media downloads are written as stored"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+        fd, self.dst = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.dst)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_compressed_anyway(self, mock_api):
+        import gzip
+        from urllib3 import HTTPResponse
+        content = os.urandom(5000)
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(content)
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.raw = HTTPResponse(body=io.BytesIO(buf.getvalue()),
+                                headers={'Content-Encoding': 'gzip'},
+                                preload_content=False)
+        mock_api.side_effect = [
+            (200, {'id': 'abc', 'fileSize': '5000',
+                   'downloadUrl': 'https://dl/abc'}),
+            (200, resp),
+        ]
+        self.gd.download_file('abc', self.dst)
+        compare({'Accept-Encoding': 'identity'},
+                mock_api.call_args[1]['headers'])
+        with open(self.dst, 'rb') as f:
+            compare(content, f.read())
+
+
+class Test_create_file(unittest.TestCase):
+    """Test create_file picks the upload type by size"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path, multipart_threshold=100)
+        fd, self.src = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.src)
+
+    @patch.object(APIRequest, 'resumable_file_upload')
+    @patch.object(APIRequest, 'multipart_file_upload')
+    def test_upload_type(self, mock_multipart, mock_resumable):
+        with open(self.src, 'wb') as f:
+            f.write(b'x' * 100)
+        self.gd.create_file('root', self.src, 'a')
+        compare(1, mock_multipart.call_count)
+        compare(0, mock_resumable.call_count)
+        with open(self.src, 'wb') as f:
+            f.write(b'x' * 101)
+        self.gd.create_file('root', self.src, 'a')
+        compare(1, mock_resumable.call_count)
+        self.gd.create_file('root', self.src, 'a', upload_type='multipart')
+        compare(2, mock_multipart.call_count)
+
+
+class Test_meta_cache(unittest.TestCase):
+    """Test the conditional-GET metadata cache"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path, meta_cache_size=2, meta_cache_ttl=60)
+        self.meta = {'id': 'abc', 'etag': '"e1"', 'title': 'a'}
+
+    @patch('gdapi.cache.time')
+    @patch.object(APIRequest, 'api_request')
+    def test_revalidate(self, mock_api, mock_time):
+        mock_time.return_value = 1000
+        mock_api.return_value = (200, dict(self.meta))
+        compare(self.meta, self.gd.get_file_meta('abc'))
+        compare(self.meta, self.gd.get_file_meta('abc'))  # fresh
+        compare(1, mock_api.call_count)
+
+        mock_time.return_value = 1061  # stale
+        mock_api.return_value = (304, b'')
+        compare(self.meta, self.gd.get_file_meta('abc'))
+        mock_api.assert_called_with('GET', '/drive/v2/files/abc',
+                                    params=None,
+                                    headers={'If-None-Match': '"e1"'})
+        compare(self.meta, self.gd.get_file_meta('abc'))  # fresh again
+        compare(2, mock_api.call_count)
+
+    @patch.object(APIRequest, 'resumable_file_update')
+    @patch.object(APIRequest, 'api_request')
+    def test_invalidate_on_write(self, mock_api, mock_update):
+        mock_api.return_value = (200, dict(self.meta))
+        self.gd.get_file_meta('abc')
+        self.gd.update_file('abc', '/dev/null')
+        self.gd.get_file_meta('abc')
+        compare(2, mock_api.call_count)
+        mock_api.assert_called_with('GET', '/drive/v2/files/abc',
+                                    params=None, headers=None)
+        mock_api.return_value = (204, b'')
+        self.gd.delete_file('abc')
+        compare(False, 'abc' in self.gd._meta_cache)
+
+    def test_lru(self):
+        cache = self.gd._meta_cache
+        for key in ('a', 'b', 'a', 'c'):
+            cache.set(key, key)
+        compare(['a', 'c'], sorted(cache._data))
+
+
+class Test_path(unittest.TestCase):
+    """Test path resolution and makedirs with the folder cache"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+        self.folders = {('root', 'a'): 'id_a'}
+        self.calls = []
+
+    def fake_api_request(self, method, resource, params=None, data=None):
+        self.calls.append(method)
+        if method == 'POST':
+            folder_id = 'id_' + data['title']
+            self.folders[(data['parents'][0]['id'], data['title'])] = \
+                folder_id
+            return 200, {'id': folder_id}
+        if method == 'DELETE':
+            return 204, b''
+        for (parent_id, title), folder_id in self.folders.items():
+            if (u"title='{0}'".format(title) in params['q'] and
+                    u"'{0}' in parents".format(parent_id) in params['q']):
+                return 200, {'items': [{
+                    'id': folder_id, 'mimeType': GDAPI._ITEM_TYPE_FOLDER}]}
+        return 200, {'items': []}
+
+    @patch.object(APIRequest, 'api_request')
+    def test_makedirs(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        compare('id_c', self.gd.makedirs('a/b/c'))
+        compare(['GET', 'GET', 'POST', 'GET', 'POST'], self.calls)
+        self.calls = []
+        compare('id_d', self.gd.makedirs('/a/b/c/d'))
+        compare(['GET', 'POST'], self.calls)
+        self.calls = []
+        compare('id_d', self.gd.resolve_path('/a/b/c/d'))
+        compare(None, self.gd.resolve_path('/a/x/c'))
+        compare(['GET'], self.calls)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_forget_deleted(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        self.gd.makedirs('a/b')
+        self.gd.delete_file('id_b')
+        del self.folders[('id_a', 'b')]
+        self.calls = []
+        compare(None, self.gd.resolve_path('a/b'))
+        compare(['GET'], self.calls)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_forget_deleted_subtree(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        self.gd.makedirs('a/b/c/d')
+        self.gd.delete_file('id_b')
+        # the folders two levels under the deleted one are forgotten too
+        compare([(('root', 'a'), 'id_a')], self.gd._folder_cache.items())
+
+
+class Test_upload_tree(unittest.TestCase):
+    """Test mirroring a local directory"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path)
+        self.local_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.local_dir, 'sub', 'deep'))
+        for relpath, content in [('same.txt', b'same'),
+                                 ('changed.txt', b'new content'),
+                                 ('sub/new.txt', b'12345'),
+                                 ('sub/deep/x.bin', b'x' * 10)]:
+            with open(os.path.join(self.local_dir, relpath), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.local_dir)
+
+    @patch.object(GDAPI, 'update_file')
+    @patch.object(GDAPI, 'create_file')
+    @patch.object(GDAPI, '_list_children')
+    @patch.object(GDAPI, 'makedirs')
+    def test_upload_tree(self, mock_makedirs, mock_list, mock_create,
+                         mock_update):
+        mock_makedirs.side_effect = lambda path, parent_id: 'id_' + path
+        mock_list.side_effect = lambda folder_id: {
+            'top': {
+                'same.txt': {'id': 's', 'fileSize': '4',
+                             'md5Checksum': hashlib.md5(b'same').hexdigest()},
+                'changed.txt': {'id': 'c', 'fileSize': '3',
+                                'md5Checksum': 'old'},
+            },
+        }.get(folder_id, {})
+        mock_create.return_value = {'id': 'new'}
+        mock_update.return_value = {'id': 'c'}
+        summary = self.gd.upload_tree(self.local_dir, 'top', workers=2)
+        compare(3, summary['files_uploaded'])
+        compare(1, summary['files_skipped'])
+        compare(0, summary['files_failed'])
+        compare(2, summary['folders'])
+        compare(26, summary['bytes_uploaded'])
+        mock_update.assert_called_once_with(
+            'c', os.path.join(self.local_dir, 'changed.txt'))
+        compare([('id_sub', 'new.txt'), ('id_sub/deep', 'x.bin')],
+                sorted((c[0][0], c[0][2]) for c in mock_create.call_args_list))
+
+
+class Test_changes(unittest.TestCase):
+    """Test the changes feed and its saved cursor"""
+    def setUp(self):
+        fd, self.cred_path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.cred_path)
+        self.gd = GDAPI(self.cred_path)
+        self.pages = {
+            None: {'items': [{'id': '11', 'fileId': 'a', 'deleted': True}],
+                   'nextPageToken': 'p2', 'largestChangeId': '13'},
+            'p2': {'items': [{'id': '13', 'fileId': 'b',
+                              'file': {'id': 'b'},
+                              'modificationDate': '2013-11-11'}],
+                   'largestChangeId': '13'},
+        }
+        self.params = []
+
+    def tearDown(self):
+        self.gd._change_cursor.reset()
+
+    def fake_api_request(self, method, resource, params=None):
+        if resource == '/drive/v2/about':
+            return 200, {'largestChangeId': '10'}
+        self.params.append(params)
+        return 200, self.pages[params.get('pageToken')]
+
+    @patch.object(APIRequest, 'api_request')
+    def test_iter_changes(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        changes = list(self.gd.iter_changes(start_change_id=11))
+        compare([Change(11, 'a', True, None, None),
+                 Change(13, 'b', False, {'id': 'b'}, '2013-11-11')],
+                changes)
+        compare(11, self.params[0]['startChangeId'])
+        compare('p2', self.params[1]['pageToken'])
+        with open(self.cred_path + '.changes') as f:
+            compare({'startChangeId': 14}, json.load(f))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_resume_from_cursor(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        self.pages[None] = {'items': [], 'largestChangeId': '10'}
+        compare([], list(self.gd.iter_changes()))  # start from now
+        compare(11, self.params[0]['startChangeId'])
+        self.params = []
+        self.pages[None] = {'items': [], 'largestChangeId': '15'}
+        compare([], list(self.gd.iter_changes()))
+        compare(11, self.params[0]['startChangeId'])
+        compare({'startChangeId': 16}, self.gd._change_cursor.load())
+
+
+class Test_iter_files(unittest.TestCase):
+    """Test the prefetching file listing"""
+    def setUp(self):
+        fd, self.cred_path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.cred_path)
+        self.gd = GDAPI(self.cred_path)
+        self.pages = {
+            None: {'items': [{'id': '1'}, {'id': '2'}],
+                   'nextPageToken': 'p2'},
+            'p2': {'items': [{'id': '3'}], 'nextPageToken': 'p3'},
+            'p3': {'items': [{'id': '4'}]},
+        }
+        self.params = []
+
+    def fake_api_request(self, method, resource, params=None):
+        self.params.append(params)
+        return 200, self.pages[params.get('pageToken')]
+
+    @patch.object(APIRequest, 'api_request')
+    def test_iter_files(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        items = self.gd.iter_files("trashed=false", page_size=2,
+                                   fields='id,title')
+        compare({'id': '1'}, next(items))
+        compare(['2', '3', '4'], [item['id'] for item in items])
+        compare([None, 'p2', 'p3'],
+                [p.get('pageToken') for p in self.params])
+        compare({'q': 'trashed=false', 'maxResults': 2,
+                 'fields': 'nextPageToken,items(id,title)'},
+                self.params[0])
+
+    @patch.object(APIRequest, 'api_request')
+    def test_prefetch(self, mock_api):
+        import threading
+        fetched = threading.Event()
+
+        def fake_api_request(method, resource, params=None):
+            if params.get('pageToken') == 'p2':
+                fetched.set()
+            return self.fake_api_request(method, resource, params)
+        mock_api.side_effect = fake_api_request
+        items = self.gd.iter_files()
+        next(items)
+        # the second page comes while the first one is still consumed
+        compare(True, fetched.wait(5))
+        compare(['2', '3', '4'], [item['id'] for item in items])
+
+    @patch.object(APIRequest, 'api_request')
+    def test_error(self, mock_api):
+        mock_api.return_value = (500, {'error': {'code': 500}})
+        with ShouldRaise(GoogleApiError):
+            list(self.gd.iter_files(prefetch=False))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_query_title(self, mock_api):
+        mock_api.side_effect = self.fake_api_request
+        compare(['1', '2', '3', '4'],
+                [item['id'] for item in self.gd.query_title(u"it's")])
+        for params in self.params:
+            compare(u"trashed=false and title='it\\'s'", params['q'])
+
+
+class Test_fields(unittest.TestCase):
+    """Test partial responses"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.gd = GDAPI(temp_path, meta_cache_size=4,
+                        default_fields={'get_file_meta': 'id,etag'})
+
+    @patch.object(APIRequest, 'api_request')
+    def test_call_fields(self, mock_api):
+        mock_api.return_value = (200, {'id': 'abc'})
+        self.gd.copy_file('abc', fields='id')
+        mock_api.assert_called_with('POST', '/drive/v2/files/abc/copy',
+                                    params={'fields': 'id'})
+        self.gd.query_permission('abc', fields='items(id)')
+        mock_api.assert_called_with('GET', '/drive/v2/files/abc/permissions',
+                                    params={'fields': 'items(id)'})
+        self.gd.about()
+        mock_api.assert_called_with('GET', '/drive/v2/about', params=None)
+
+    @patch.object(APIRequest, 'api_request')
+    def test_default_fields(self, mock_api):
+        mock_api.return_value = (200, {'id': 'abc', 'etag': '"e"'})
+        self.gd.get_file_meta('abc')
+        mock_api.assert_called_with('GET', '/drive/v2/files/abc',
+                                    params={'fields': 'id,etag'},
+                                    headers=None)
+        self.gd.get_file_meta('abc', fields='id,title')
+        compare(2, mock_api.call_count)  # cached apart
+        self.gd.get_file_meta('abc')
+        compare(2, mock_api.call_count)
+        self.gd._invalidate_meta('abc')
+        compare(0, len(self.gd._meta_cache))
+
+    @patch.object(APIRequest, 'api_request')
+    def test_internal_fields(self, mock_api):
+        mock_api.return_value = (200, {'items': [], 'id': 'f1'})
+        compare('f1', self.gd.create_folder('root', 'a'))
+        lookup, create = mock_api.call_args_list
+        compare('items(id,mimeType)', lookup[1]['params']['fields'])
+        compare({'fields': 'id'}, create[1]['params'])
+
+    @patch.object(APIRequest, 'api_request')
+    def test_create_folder_fields(self, mock_api):
+        mock_api.return_value = (200, {'items': [], 'id': 'f1'})
+        self.gd.create_folder('root', 'a', fields='id,title')
+        compare({'fields': 'id,title'}, mock_api.call_args[1]['params'])
+        self.gd._default_fields['create_folder'] = 'id,etag'
+        self.gd.create_folder('root', 'b')
+        compare({'fields': 'id,etag'}, mock_api.call_args[1]['params'])
+
+    @patch.object(APIRequest, '_api_call')
+    def test_make_role_fields(self, mock_call):
+        mock_call.return_value = (200, {'id': 'p1'})
+        self.gd.make_user_reader_for_file('abc', 'a@b.c', fields='id')
+        compare({'sendNotificationEmails': 'false', 'fields': 'id'},
+                mock_call.call_args[1]['params'])
+        self.gd.make_domain_writer_for_file('abc', 'b.c')
+        compare({'sendNotificationEmails': 'false'},
+                mock_call.call_args[1]['params'])
+        self.gd._default_fields['make_role_for_file'] = 'id,role'
+        self.gd.make_public_reader_for_file('abc')
+        compare({'sendNotificationEmails': 'false', 'fields': 'id,role'},
+                mock_call.call_args[1]['params'])
+
+    @patch.object(APIRequest, 'api_request')
+    def test_download_fields(self, mock_api):
+        mock_api.return_value = (200, {'id': 'abc'})
+        self.gd.download_file('abc', '/dev/null')
+        compare(None, mock_api.call_args[1]['params'])  # not the default
+        self.gd.download_file('abc', '/dev/null', fields='title')
+        compare({'fields': 'title,' + GDAPI._DOWNLOAD_FIELDS},
+                mock_api.call_args[1]['params'])
+
+    @patch.object(GDAPI, 'create_file')
+    @patch.object(APIRequest, 'api_request')
+    def test_create_or_update_fields(self, mock_api, mock_create):
+        self.gd._default_fields['create_file'] = 'title'
+        mock_api.return_value = (200, {'items': []})
+        self.gd.create_or_update_file('root', '/dev/null', 'a')
+        compare(u'', mock_create.call_args[1]['fields'])
+        self.gd.create_or_update_file('root', '/dev/null', 'a',
+                                      fields='title')
+        compare(u'title,id', mock_create.call_args[1]['fields'])
+        compare(u'items(title,id,md5Checksum,description)',
+                mock_api.call_args[1]['params']['fields'])
+
+    @patch.object(APIRequest, 'multipart_file_upload')
+    def test_upload_fields(self, mock_multipart):
+        self.gd.create_file('root', '/dev/null', 'a', fields='id')
+        compare('id', mock_multipart.call_args[1]['fields'])
+
+    @patch.object(APIRequest, 'api_request')
+    def test_iter_files_fields(self, mock_api):
+        mock_api.return_value = (200, {'items': []})
+        list(self.gd.iter_files('x', fields='id'))
+        compare('nextPageToken,items(id)',
+                mock_api.call_args[1]['params']['fields'])
+
+
+class Test_fingerprint_index(unittest.TestCase):
+    """Test skipping unchanged uploads with the local index"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        fd, self.index_path = tempfile.mkstemp()
+        os.close(fd)
+        self.gd = GDAPI(temp_path, index_path=self.index_path)
+        fd, self.src = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'content')
+        self.remote = {'id': 'f1', 'title': 't',
+                       'md5Checksum': hashlib.md5(b'content').hexdigest()}
+
+    def tearDown(self):
+        self.gd.close()
+        os.unlink(self.index_path)
+        os.unlink(self.src)
+
+    @patch('gdapi.index.md5sum', wraps=md5sum)
+    @patch.object(GDAPI, 'update_file')
+    @patch.object(APIRequest, 'api_request')
+    def test_skip_unchanged(self, mock_api, mock_update, mock_md5):
+        mock_api.return_value = (200, {'items': [self.remote]})
+        compare(self.remote,
+                self.gd.create_or_update_file('root', self.src, 't'))
+        compare(self.remote,
+                self.gd.create_or_update_file('root', self.src, 't'))
+        compare(0, mock_update.call_count)
+        compare(1, mock_md5.call_count)  # hashed once
+        compare((self.remote['md5Checksum'], 'f1'),
+                self.gd._index.lookup(self.src))
+
+        with open(self.src, 'wb') as f:
+            f.write(b'changed content')
+        mock_update.return_value = {'id': 'f1'}
+        self.gd.create_or_update_file('root', self.src, 't')
+        compare(1, mock_update.call_count)
+        compare(2, mock_md5.call_count)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import unittest
+from testfixtures import compare
+from gdapi.metrics import (Histogram, MetricsRegistry, endpoint_of,
+                           prometheus_text)
+
+
+class Test_metrics(unittest.TestCase):
+    """Test the metrics registry and its exposition"""
+    def test_endpoint_of(self):
+        for url, expected in [
+                ('https://www.googleapis.com/drive/v2/files',
+                 '/drive/v2/files'),
+                ('https://www.googleapis.com/drive/v2/files/abc',
+                 '/drive/v2/files/{id}'),
+                ('https://www.googleapis.com/drive/v2/files/abc/'
+                 'permissions/p1',
+                 '/drive/v2/files/{id}/permissions/{id}'),
+                ('https://www.googleapis.com/upload/drive/v2/files?x=1',
+                 '/upload/drive/v2/files'),
+                ('https://doc-0s.googleusercontent.com/docs/securesc/x/y',
+                 'download')]:
+            compare(expected, endpoint_of(url))
+
+    def test_histogram(self):
+        hist = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            hist.observe(value)
+        compare({'count': 4, 'sum': 3.65,
+                 'buckets': [(0.1, 2), (1, 3), ('+Inf', 4)]},
+                hist.snapshot())
+
+    def test_snapshot(self):
+        registry = MetricsRegistry(buckets=(1,))
+        url = 'https://www.googleapis.com/drive/v2/files/'
+        registry.observe_request('GET', url + 'a', 200, 0.5, 0, 100)
+        registry.observe_request('GET', url + 'b', 404, 2.0, 0, 10)
+        registry.incr('retries', function='api_request')
+        registry.incr('retries', function='api_request')
+        compare({
+            'requests': {('GET', '/drive/v2/files/{id}'): {
+                'latency': {'count': 2, 'sum': 2.5,
+                            'buckets': [(1, 1), ('+Inf', 2)]},
+                'request_bytes': 0,
+                'response_bytes': 110,
+                'status': {'200': 1, '404': 1},
+            }},
+            'counters': {'retries': {(('function', 'api_request'),): 2}},
+        }, registry.snapshot())
+        registry.reset()
+        compare({'requests': {}, 'counters': {}}, registry.snapshot())
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry(buckets=(1,))
+        registry.observe_request(
+            'POST', 'https://www.googleapis.com/drive/v2/files', 201, 0.25,
+            30, 400)
+        registry.incr('token_refreshes', result='ok')
+        compare('\n'.join([
+            '# HELP gdapi_request_duration_seconds Latency of the HTTP '
+            'requests.',
+            '# TYPE gdapi_request_duration_seconds histogram',
+            'gdapi_request_duration_seconds_bucket{method="POST",'
+            'endpoint="/drive/v2/files",le="1.0"} 1',
+            'gdapi_request_duration_seconds_bucket{method="POST",'
+            'endpoint="/drive/v2/files",le="+Inf"} 1',
+            'gdapi_request_duration_seconds_sum{method="POST",'
+            'endpoint="/drive/v2/files"} 0.25',
+            'gdapi_request_duration_seconds_count{method="POST",'
+            'endpoint="/drive/v2/files"} 1',
+            '# HELP gdapi_requests_total HTTP requests by status code.',
+            '# TYPE gdapi_requests_total counter',
+            'gdapi_requests_total{method="POST",endpoint="/drive/v2/files",'
+            'status="201"} 1',
+            '# HELP gdapi_request_bytes_total Bytes sent in bodies.',
+            '# TYPE gdapi_request_bytes_total counter',
+            'gdapi_request_bytes_total{method="POST",'
+            'endpoint="/drive/v2/files"} 30',
+            '# HELP gdapi_response_bytes_total Bytes received in decoded '
+            'bodies.',
+            '# TYPE gdapi_response_bytes_total counter',
+            'gdapi_response_bytes_total{method="POST",'
+            'endpoint="/drive/v2/files"} 400',
+            '# TYPE gdapi_token_refreshes_total counter',
+            'gdapi_token_refreshes_total{result="ok"} 1',
+        ]) + '\n', prometheus_text(registry))
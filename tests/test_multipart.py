@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import unittest
+from testfixtures import compare
+from gdapi.multipart import MultipartRelatedStream
+
+
+class Test_multipart_stream(unittest.TestCase):
+    """Test the streaming multipart/related body"""
+    def setUp(self):
+        self.media = bytes(bytearray(range(256))) * 1000
+        self.body = {'title': 'a', 'mimeType': 'image/png'}
+        self.expected = b''.join([
+            b'--B\r\n',
+            b'Content-Type: application/json; charset=UTF-8\r\n\r\n',
+            json.dumps(self.body).encode('utf-8'),
+            b'\r\n--B\r\n',
+            b'Content-Type: image/png\r\n\r\n',
+            self.media,
+            b'\r\n--B--\r\n',
+        ])
+
+    def test_read_all(self):
+        stream = MultipartRelatedStream(self.body, io.BytesIO(self.media),
+                                        boundary='B')
+        compare(len(self.expected), len(stream))
+        compare('multipart/related; boundary="B"', stream.content_type)
+        compare(self.expected, stream.read())
+        compare(b'', stream.read())
+
+    def test_read_chunks(self):
+        for size in (1, 7, 8192, 300000):
+            stream = MultipartRelatedStream(
+                self.body, io.BytesIO(self.media), boundary='B')
+            chunks = []
+            while True:
+                data = stream.read(size)
+                if not data:
+                    break
+                self.assertTrue(len(data) <= size)
+                chunks.append(data)
+            compare(self.expected, b''.join(chunks))
+
+    def test_iter_from_position(self):
+        fp = io.BytesIO(b'skip' + self.media)
+        fp.seek(4)
+        stream = MultipartRelatedStream(self.body, fp, boundary='B')
+        compare(len(self.expected), len(stream))
+        compare(self.expected, b''.join(stream))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import unittest
+from mock import patch
+from testfixtures import compare
+from gdapi.ratelimit import RateLimiter
+
+
+class Test_rate_limiter(unittest.TestCase):
+    """Test the AIMD token bucket"""
+    def setUp(self):
+        self.now = [100.0]
+        patcher = patch('gdapi.ratelimit.monotonic',
+                        side_effect=lambda: self.now[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        limiter = RateLimiter(10, burst=2)
+        compare(0.0, limiter.reserve())
+        compare(0.0, limiter.reserve())
+        compare(0.1, round(limiter.reserve(), 6))
+        compare(0.2, round(limiter.reserve(), 6))
+        self.now[0] += 1
+        compare(0.0, limiter.reserve())
+
+    @patch('gdapi.ratelimit.sleep')
+    def test_acquire_sleeps(self, mock_sleep):
+        limiter = RateLimiter(4, burst=1)
+        limiter.acquire()
+        compare(0, mock_sleep.call_count)
+        limiter.acquire()
+        mock_sleep.assert_called_once_with(0.25)
+
+    def test_throttled_decrease_once_per_cooldown(self):
+        limiter = RateLimiter(10, cooldown=1.0)
+        limiter.throttled()
+        limiter.throttled()  # same burst of errors
+        compare(5.0, limiter.rate)
+        self.now[0] += 1
+        limiter.throttled()
+        compare(2.5, limiter.rate)
+        for _ in range(10):
+            self.now[0] += 1
+            limiter.throttled()
+        compare(0.5, limiter.rate)  # min_rate
+
+    def test_succeeded_increase(self):
+        limiter = RateLimiter(10, increase=1)
+        limiter.throttled()
+        limiter.succeeded()
+        limiter.succeeded()
+        compare(7.0, limiter.rate)
+        for _ in range(10):
+            limiter.succeeded()
+        compare(10.0, limiter.rate)
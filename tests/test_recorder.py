@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import json
+import shutil
+import unittest
+import tempfile
+import requests
+from mock import patch
+from testfixtures import compare, ShouldRaise
+from gdapi.gdapi import GDAPI
+from gdapi.apirequest import APIRequest
+from gdapi.emulator import DriveEmulator
+from gdapi.recorder import TrafficRecorder, ReplayServer, load_traffic, \
+    replay
+
+
+class Test_recorder(unittest.TestCase):
+    """Test the recording and the replay of the traffic of a client"""
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cred_path = os.path.join(self.temp_dir, 'cred.json')
+        self.log_path = os.path.join(self.temp_dir, 'traffic.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_record(self):
+        path = os.path.join(self.temp_dir, 'a.txt')
+        with open(path, 'wb') as f:
+            f.write(b'hello')
+        with DriveEmulator() as drive, \
+                TrafficRecorder(self.log_path) as recorder:
+            api = GDAPI(self.cred_path, api_url=drive.url,
+                        token_url=drive.token_url, recorder=recorder,
+                        collect_timings=True)
+            drive_file = api.create_file('root', path, 'a.txt')
+            api.query_title('a.txt')
+            api.get_file_meta('missing')
+            api.close()
+        entries = load_traffic(self.log_path)
+        compare(['POST', 'GET', 'GET'], [e['method'] for e in entries])
+        compare([200, 200, 404], [e['status'] for e in entries])
+        compare(True, entries[0]['request_bytes'] > 5)
+        compare(len(json.dumps(drive_file)), entries[0]['response_bytes'])
+        compare(True, 'q=trashed' in entries[1]['url'])
+        compare(True, entries[0]['timing']['ttfb'] > 0)
+
+    def test_record_error(self):
+        out = io.StringIO()
+        recorder = TrafficRecorder(out)
+        api = APIRequest(self.cred_path, recorder=recorder)
+        with patch.object(requests.Session, 'request',
+                          side_effect=requests.ConnectionError):
+            with ShouldRaise(requests.ConnectionError):
+                api._api_request('GET', 'https://example.com/x',
+                                 params={'a': 1})
+        entry = json.loads(out.getvalue())
+        compare('error', entry['status'])
+        compare('https://example.com/x?a=1', entry['url'])
+
+    def entry(self, ts, method, path, status, request_bytes=0,
+              response_bytes=0):
+        return {'ts': ts, 'method': method,
+                'url': 'https://www.googleapis.com' + path,
+                'status': status, 'elapsed': 0.01,
+                'request_bytes': request_bytes,
+                'response_bytes': response_bytes}
+
+    def test_replay(self):
+        entries = [
+            self.entry(100.0, 'GET', '/drive/v2/files?q=x', 200,
+                       response_bytes=1000),
+            self.entry(100.1, 'POST', '/upload/drive/v2/files', 503,
+                       request_bytes=5000),
+            self.entry(100.2, 'DELETE', '/drive/v2/files/abc', 204),
+            self.entry(100.3, 'GET', '/drive/v2/about', 'error'),
+        ]
+        results = []
+        with ReplayServer(entries) as server:
+            api = APIRequest(self.cred_path, api_url=server.url)
+            summary = replay(entries, api, speed=2, concurrency=2,
+                             progress=lambda *args: results.append(args))
+            api.close()
+        compare({'200': 1, '503': 2, '204': 1}, summary['status'])
+        compare(4, summary['sent'])
+        compare(True, summary['seconds'] >= 0.15)  # 0.3s at 2x
+        compare(1, server.stats[('replay', 200)])
+        compare(4, len(results))
+
+    def test_replay_as_fast_as_possible(self):
+        entries = [self.entry(100.0 + i * 10, 'GET', '/drive/v2/about', 200)
+                   for i in range(5)]
+        with ReplayServer(entries) as server:
+            api = APIRequest(self.cred_path, api_url=server.url)
+            summary = replay(entries, api, speed=0)
+            api.close()
+        compare({'200': 5}, summary['status'])
+        compare(True, summary['seconds'] < 5)
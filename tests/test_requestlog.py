@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import io
+import unittest
+from testfixtures import compare
+from gdapi.requestlog import REDACTED, redact_headers, redact_fields, \
+    summarize_body, RequestLogMessage
+
+
+class Test_redact(unittest.TestCase):
+    """Test that credentials never reach the log"""
+    def test_headers(self):
+        compare({'authorization': REDACTED, 'content-type': 'text/plain'},
+                redact_headers({'authorization': 'Bearer SECRET',
+                                'content-type': 'text/plain'}))
+        compare({'Authorization': REDACTED},
+                redact_headers({'Authorization': 'Bearer SECRET'}))
+        compare(None, redact_headers(None))
+
+    def test_fields(self):
+        compare({'client_id': 'C', 'client_secret': REDACTED,
+                 'refresh_token': REDACTED},
+                redact_fields({'client_id': 'C', 'client_secret': 'S',
+                               'refresh_token': 'R'}))
+        compare('raw', redact_fields('raw'))
+
+
+class Test_summarize_body(unittest.TestCase):
+    """Test the description of request bodies"""
+    def test_truncate(self):
+        compare(u'abc...(7 more)', summarize_body(u'abcdefghij', 3))
+        compare(u'abcdefghij', summarize_body(u'abcdefghij', None))
+        compare(u'<10 chars>', summarize_body(u'abcdefghij', 0))
+        compare(repr(b'xxxxx') + u'...(5 more bytes)',
+                summarize_body(b'x' * 10, 5))
+        compare(u'<10 bytes>', summarize_body(b'x' * 10, 0))
+        compare(u'-', summarize_body(None, 10))
+
+    def test_dict(self):
+        compare(u'{"client_secret": "<redacted>", "id": 1}',
+                summarize_body({'id': 1, 'client_secret': 'S'}, None))
+
+    def test_stream_not_read(self):
+        stream = io.BytesIO(b'content')
+        compare(u'<BytesIO>', summarize_body(stream, 100))
+        compare(0, stream.tell())
+
+
+class Test_message(unittest.TestCase):
+    """Test the lazy log message"""
+    def test_str(self):
+        message = RequestLogMessage(
+            'POST', 'https://example.com/x', 200, 0.5,
+            headers={'Authorization': 'Bearer SECRET'},
+            params={'uploadType': 'multipart'}, data=u'x' * 1000,
+            body_limit=4)
+        text = str(message)
+        compare(False, 'SECRET' in text)
+        compare(True, text.startswith(u'POST https://example.com/x 200 '
+                                      u'0.500s'))
+        compare(True, text.endswith(u'data xxxx...(996 more)'))
+        compare({'method': 'POST', 'url': 'https://example.com/x',
+                 'status': 200, 'elapsed': 0.5}, message.fields)
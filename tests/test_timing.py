@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import unittest
+import tempfile
+import threading
+import requests
+from mock import patch
+from testfixtures import compare
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler  # 3.*
+    from socketserver import ThreadingMixIn
+from gdapi.apirequest import APIRequest
+from gdapi.timing import RequestTiming, TimedHTTPAdapter, recording, \
+    current_timing
+
+BODY = b'x' * 100000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True  # kept-alive connections must not block
+
+
+class LocalServerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = _Server(('127.0.0.1', 0), _Handler)
+        cls.url = 'http://localhost:{0}/drive/v2/files'.format(
+            cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class Test_timed_adapter(LocalServerTestCase):
+    """Test the phases recorded by the transport"""
+    def setUp(self):
+        self.session = requests.Session()
+        self.session.mount('http://', TimedHTTPAdapter())
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_new_connection(self):
+        with recording(RequestTiming('GET', self.url)) as timing:
+            self.session.get(self.url)
+        compare(False, timing.reused)
+        self.assertTrue(timing.dns > 0)
+        self.assertTrue(timing.connect > 0)
+        compare(0.0, timing.tls)  # plain HTTP
+        self.assertTrue(timing.send > 0)
+        self.assertTrue(timing.ttfb > 0)
+
+    def test_next_address(self):
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, *args, **kwargs):
+            if host != 'localhost':
+                return getaddrinfo(host, *args, **kwargs)
+            # nothing listens on the first one
+            return [info[:4] + ((address,) + info[4][1:],)
+                    for address in ('127.0.0.2', '127.0.0.1')
+                    for info in getaddrinfo(address, *args, **kwargs)]
+        with patch('socket.getaddrinfo', side_effect=resolve):
+            with recording(RequestTiming('GET', self.url)) as timing:
+                compare(200, self.session.get(self.url).status_code)
+        compare(False, timing.reused)
+        self.assertTrue(timing.dns > 0)
+
+    def test_reused_connection(self):
+        self.session.get(self.url)
+        with recording(RequestTiming('GET', self.url)) as timing:
+            self.session.get(self.url)
+        compare(True, timing.reused)
+        compare(0.0, timing.dns)
+        compare(0.0, timing.connect)
+        self.assertTrue(timing.ttfb > 0)
+
+    def test_not_recording(self):
+        timing = RequestTiming()
+        with recording(timing):
+            with recording(None):
+                self.session.get(self.url)
+            compare(timing, current_timing())
+        compare(None, current_timing())
+        compare(0.0, timing.ttfb)
+
+
+class Test_request_timings(LocalServerTestCase):
+    """Test the timings of the API calls"""
+    def setUp(self):
+        fd, temp_path = tempfile.mkstemp()
+        os.close(fd)  # we use temp_path only
+        os.unlink(temp_path)
+        self.temp_path = temp_path
+        self.timings = []
+
+    def test_callback(self):
+        ar = APIRequest(self.temp_path, timing_callback=self.timings.append)
+        ar._api_request('GET', self.url)
+        compare(1, len(self.timings))
+        timing = self.timings[0]
+        compare(200, timing.status)
+        compare(len(BODY), timing.bytes)
+        self.assertTrue(timing.transfer >= 0)
+        compare(timing, ar.last_timing)
+        self.assertTrue(timing.total >= timing.dns + timing.connect +
+                        timing.send + timing.ttfb)
+
+    def test_streamed_body(self):
+        ar = APIRequest(self.temp_path, timing_callback=self.timings.append)
+        resp = ar._api_request('GET', self.url, stream=True)
+        compare([], self.timings)  # the body is not read yet
+        compare(None, resp.timing.transfer)
+        compare(len(BODY), sum(len(data) for data in
+                               resp.iter_content(65536)))
+        compare([resp.timing], self.timings)
+        compare(len(BODY), resp.timing.bytes)
+        self.assertTrue(resp.timing.transfer >= 0)
+
+    def test_streamed_body_closed(self):
+        ar = APIRequest(self.temp_path, timing_callback=self.timings.append)
+        resp = ar._api_request('GET', self.url, stream=True)
+        resp.close()
+        resp.close()
+        compare([resp.timing], self.timings)
+        compare(None, resp.timing.transfer)
+        compare(0, resp.timing.bytes)
+
+    def test_off_by_default(self):
+        ar = APIRequest(self.temp_path)
+        resp = ar._api_request('GET', self.url)
+        compare(False, hasattr(resp, 'timing'))
+        compare(None, ar.last_timing)
+        compare(False, isinstance(ar._session.get_adapter(self.url),
+                                  TimedHTTPAdapter))
+
+    def test_callback_error(self):
+        def callback(timing):
+            raise ValueError
+        ar = APIRequest(self.temp_path, timing_callback=callback)
+        compare(200, ar._api_request('GET', self.url).status_code)
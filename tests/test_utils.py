@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import unittest
+import requests
+from mock import patch
+from testfixtures import compare, ShouldRaise
+from gdapi.utils import retry, RetryBudget, RetryPolicy, retry_after_seconds
+from gdapi.errors import RetryLimitError
+from gdapi.metrics import MetricsRegistry
+
+
+def _error(retry_after=None, status_code=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return requests.ConnectionError(response=response)
+
+
+class Client(object):
+    def __init__(self, errors, budget=None, deadline=None):
+        self.errors = list(errors)
+        self.calls = 0
+        self._retry_budget = budget
+        self._retry_deadline = deadline
+        self._metrics = MetricsRegistry()
+
+    @retry(requests.ConnectionError, 5, delay=1)
+    def call(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+class Test_retry(unittest.TestCase):
+    """Test the retry decorator and its policy"""
+    def setUp(self):
+        self.now = [0.0]
+        for target, kwargs in [
+                ('gdapi.utils.monotonic',
+                 {'side_effect': lambda: self.now[0]}),
+                ('gdapi.utils.sleep', {'side_effect': self._sleep}),
+                ('gdapi.utils.uniform', {'side_effect': lambda a, b: b})]:
+            patcher = patch(target, **kwargs)
+            setattr(self, target.rsplit('.', 1)[1], patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def _sleep(self, seconds):
+        self.now[0] += seconds
+
+    def test_full_jitter(self):
+        client = Client([_error()] * 3)
+        compare('done', client.call())
+        compare(4, client.calls)
+        compare([((0, 1),), ((0, 2),), ((0, 4),)],
+                [c[0:1] for c in self.uniform.call_args_list])
+        compare({(('function', 'call'),): 3},
+                client._metrics.snapshot()['counters']['retries'])
+
+    def test_max_delay(self):
+        policy = RetryPolicy(30, delay=1, max_delay=600)
+        compare(600, policy.wait_time(20))
+
+    def test_out_of_tries(self):
+        client = Client([_error()] * 10)
+        compare(False, client.call())
+        compare(5, client.calls)
+        compare(4, self.sleep.call_count)
+
+    def test_retry_after(self):
+        client = Client([_error('7')])
+        compare('done', client.call())
+        self.sleep.assert_called_once_with(7.0)
+        compare(0, self.uniform.call_count)
+
+    def test_retry_after_date(self):
+        with patch('gdapi.utils.time', return_value=784111777):
+            compare(10.0, retry_after_seconds(
+                _error('Sun, 06 Nov 1994 08:49:47 GMT')))
+        compare(None, retry_after_seconds(_error('soon')))
+        compare(None, retry_after_seconds(ValueError()))
+
+    def test_deadline(self):
+        client = Client([_error()] * 10, deadline=5)
+        with ShouldRaise(RetryLimitError):
+            client.call()
+        compare(3, client.calls)  # waits 1 + 2, the next 4 would pass 5
+        compare(3.0, self.now[0])
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=2)
+        client = Client([_error()] * 10, budget=budget)
+        with ShouldRaise(RetryLimitError):
+            client.call()
+        compare(3, client.calls)
+        client = Client([_error()], budget=budget)
+        with ShouldRaise(RetryLimitError):
+            client.call()  # shared budget is spent
+        compare(1, client.calls)
+
+    def test_budget_sustained_errors(self):
+        budget = RetryBudget(ratio=0, min_per_second=0.25, max_tokens=2)
+        client = Client([_error(status_code=503)] * 100, budget=budget)
+        with ShouldRaise(RetryLimitError) as s:
+            client.call()
+        compare(503, s.raised._code)
+        compare(3, client.calls)  # 2 tokens, then 0.75 earned in 3 seconds
+        with ShouldRaise(RetryLimitError):
+            client.call()
+        compare(4, client.calls)  # not retried until a token is earned
+        self.now[0] += 1
+        with ShouldRaise(RetryLimitError):
+            client.call()
+        compare(6, client.calls)
+
+    def test_budget_earned(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+        for _ in range(2):
+            budget.withdraw()
+        compare(False, budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        compare(True, budget.withdraw())
+        self.now[0] += 100
+        compare(False, budget.withdraw())
+        budget = RetryBudget(ratio=0, min_per_second=1, max_tokens=1)
+        budget.withdraw()
+        self.now[0] += 1
+        compare(True, budget.withdraw())
+
+    def test_invalid(self):
+        for tries, delay in [(-1, 1), (1, 0)]:
+            with self.assertRaises(ValueError):
+                retry(requests.ConnectionError, tries, delay=delay)
+
+    def test_not_handled(self):
+        client = Client([KeyError('x')])
+        with self.assertRaises(KeyError):
+            client.call()
+        compare(0, self.sleep.call_count)